@@ -58,7 +58,8 @@ def main():
             delay_first_trial_only=args.delay_first_trial_only,\
             primer_load_first=args.primer_load_first,\
             save_content=save_content,\
-            configs=configs)
+            configs=configs,\
+            checkpoint=args.checkpoint)
         loader.load_pages(urls)
 
         # pickle load results
@@ -90,6 +91,7 @@ if __name__ == "__main__":
     parser.add_argument('--disable-spdy', action='store_true', default=False, help='Disable SPDY/HTTP2')
     parser.add_argument('--timeout', type=int, default=30, help='Timout in seconds')
     parser.add_argument('--primer-load-first', action='store_true', default=False, help='Load page once before actual trials (e.g., to prime DNS cache.')
+    parser.add_argument('-k', '--checkpoint', default=None, help='Checkpoint journal path. Finished trials are recorded here and skipped if the run is restarted.')
     parser.add_argument('--save-content-first-trial', action='store_true', default=False, help='Save HTTP bodies for first trial of each URL.')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
@@ -12,7 +12,7 @@ import multiprocessing
 from collections import defaultdict
 
 sys.path.append('..')
-from webloader.loader import PageResult
+from webloader.loader import PageResult, PhaseTimings, TimeStats
 from webloader.phantomjs_loader import PhantomJSLoader
 from webloader.curl_loader import CurlLoader
 
@@ -41,16 +41,38 @@ class URLResult(object):
         self.https_times = []
         self.http_sizes = []  # shouldn't be changing, but...
         self.https_sizes = [] # shouldn't be different, but...
+        self.http_phase_times = defaultdict(list)
+        self.https_phase_times = defaultdict(list)
 
     def add_http_result(self, result):
         if result.status == SUCCESS:
             self.http_times.append(result.time)
             self.http_sizes.append(result.size)
+            self._add_phase_times(self.http_phase_times, result)
 
     def add_https_result(self, result):
         if result.status == SUCCESS:
             self.https_times.append(result.time)
             self.https_sizes.append(result.size)
+            self._add_phase_times(self.https_phase_times, result)
+
+    def _add_phase_times(self, phase_times, result):
+        if result.timings:
+            for phase, t in result.timings.as_dict().iteritems():
+                if t is not None:
+                    phase_times[phase].append(t)
+
+    def _get_phase_inflation(self):
+        '''Mean HTTPS minus mean HTTP time for each phase we measured over
+        both protocols.'''
+        inflation = {}
+        for phase in PhaseTimings.PHASES:
+            http = getattr(self, 'http_phase_times', {}).get(phase)
+            https = getattr(self, 'https_phase_times', {}).get(phase)
+            if http and https:
+                inflation[phase] = numpy.mean(https) - numpy.mean(http)
+        return inflation
+    phase_inflation = property(_get_phase_inflation)
 
     def _get_http_mean(self):
         return numpy.mean(self.http_times)
@@ -123,16 +145,18 @@ def make_url(url, protocol, port=None):
 
 
 
-def process_url(url):
-    # numpy warnings are errors
-    old_numpy_settings = numpy.seterr(all='raise')
-
+def make_urls(url):
     http_url = make_url(url, 'http', args.httpport)
     https_url = make_url(url, 'https', args.httpsport)
     logging.debug('HTTP URL:  %s' % http_url)
     logging.debug('HTTPS URL: %s' % https_url)
-    
-    result = URLResult(SUCCESS, url)
+    return http_url, https_url
+
+def process_url(url):
+    # numpy warnings are errors
+    old_numpy_settings = numpy.seterr(all='raise')
+
+    http_url, https_url = make_urls(url)
 
     # If we're loading the full page, use PhantomJSLoader; otherwise, use
     # PythonRequestsLoader
@@ -140,18 +164,42 @@ def process_url(url):
     if args.loadpage:
         loader = PhantomJSLoader(outdir=args.outdir, num_trials=args.numtrials,\
             disable_local_cache=True, disable_network_cache=True,\
-            timeout=args.timeout, full_page=True)
+            timeout=args.timeout, full_page=True,\
+            target_ci_width=args.ciwidth, min_trials=args.mintrials)
     else:
         loader = CurlLoader(outdir=args.outdir, num_trials=args.numtrials,\
             disable_local_cache=True, disable_network_cache=True,\
-            timeout=args.timeout, full_page=False)
+            timeout=args.timeout, full_page=False,\
+            target_ci_width=args.ciwidth, min_trials=args.mintrials)
         #loader = PythonRequestsLoader(outdir=args.outdir, num_trials=args.numtrials,\
         #    disable_local_cache=True, disable_network_cache=True,\
         #    timeout=args.timeout, full_page=False)
     
     # Load the pages; 
     loader.load_pages([http_url, https_url])
-    
+    return collect_result(url, loader, http_url, https_url)
+
+def process_urls_multi(urls):
+    '''Load every URL over both protocols in this process, with one
+    CurlMultiLoader event loop, instead of a process (and curl fork) per
+    load.'''
+    from webloader.curl_multi_loader import CurlMultiLoader  # needs pycurl
+    numpy.seterr(all='raise')
+
+    loader = CurlMultiLoader(outdir=args.outdir, num_trials=args.numtrials,\
+        disable_local_cache=True, disable_network_cache=True,\
+        timeout=args.timeout, full_page=False,\
+        max_transfers=args.maxtransfers, max_per_host=args.maxperhost,\
+        target_ci_width=args.ciwidth, min_trials=args.mintrials)
+    url_pairs = [(url, make_urls(url)) for url in urls]
+    loader.load_pages([u for url, pair in url_pairs for u in pair])
+    return [collect_result(url, loader, *pair) for url, pair in url_pairs]
+
+def collect_result(url, loader, http_url, https_url):
+    '''Build a URLResult for `url` from a loader that loaded its HTTP and
+    HTTPS versions.'''
+    result = URLResult(SUCCESS, url)
+
     # Make sure the URL was accessible over both HTTP and HTTPS
     if loader.page_results[http_url].status == PageResult.FAILURE_NOT_ACCESSIBLE:
         logging.debug('The URL "%s" cannot be accessed over HTTP.' % url)
@@ -322,6 +370,20 @@ def summarize_results(filename_to_results):
     for results in filename_to_results.values():
         for result in results:
             print result
+            if result.status == SUCCESS:
+                http, https = TimeStats(result.http_times),\
+                    TimeStats(result.https_times)
+                print '\tHTTP/HTTPS p90=%f/%f p99=%f/%f mean 95%%CI=%s/%s outliers=%d/%d'\
+                    % (http.percentile(90), https.percentile(90),\
+                    http.percentile(99), https.percentile(99),\
+                    '[%f, %f]' % http.confidence_interval(),\
+                    '[%f, %f]' % https.confidence_interval(),\
+                    http.num_outliers, https.num_outliers)
+            inflation = result.phase_inflation
+            if inflation:
+                print '\tHTTPS-HTTP by phase: %s' % '  '.join('%s=%f' %\
+                    (phase, inflation[phase]) for phase in PhaseTimings.PHASES\
+                    if phase in inflation)
 
 def main():
 
@@ -341,14 +403,17 @@ def main():
                     args.urls.append(line.strip())
             f.closed
             
-        # process logs individually in separate processes
-        pool = multiprocessing.Pool(args.numcores)
-        try:
-            results = pool.map_async(process_url, args.urls).get(0xFFFF)
-        except KeyboardInterrupt:
-            sys.exit()
-        except multiprocessing.TimeoutError:
-            logging.warn('Multiprocessing timeout')
+        if args.multi and not args.loadpage:
+            results = process_urls_multi(args.urls)
+        else:
+            # process logs individually in separate processes
+            pool = multiprocessing.Pool(args.numcores)
+            try:
+                results = pool.map_async(process_url, args.urls).get(0xFFFF)
+            except KeyboardInterrupt:
+                sys.exit()
+            except multiprocessing.TimeoutError:
+                logging.warn('Multiprocessing timeout')
         
         filename = os.path.join(args.outdir, '%s_fetcher.pickle'%args.tag)
         with open(filename, 'w') as f:
@@ -373,7 +438,9 @@ if __name__ == "__main__":
     parser.add_argument('-f', '--urlfile', help='File containing list of URLs, one per line.')
     parser.add_argument('-r', '--readfile', nargs='+', help='Read previously pickled results instead of fetching URLs.')
     parser.add_argument('-y', '--summary', action='store_true', default=False, help='Show a summary of results instead of generating plots.')
-    parser.add_argument('-n', '--numtrials', type=int, default=20, help='How many times to fetch each URL with each protocol.')
+    parser.add_argument('-n', '--numtrials', type=int, default=20, help='How many times to fetch each URL with each protocol (at most, with --ciwidth).')
+    parser.add_argument('--ciwidth', type=float, default=None, help='Stop fetching a URL over a protocol once the 95%% confidence interval of its mean load time is narrower than this fraction of the mean.')
+    parser.add_argument('--mintrials', type=int, default=5, help='With --ciwidth, fetch each URL successfully at least this many times with each protocol.')
     parser.add_argument('-t', '--timeout', type=int, default=10, help='Timeout for requests, in seconds')
     parser.add_argument('-p', '--loadpage', action='store_true', default=False, help='Load the full page, not just the object.')
     parser.add_argument('-x', '--httpport', default=None, help='Port used for HTTP connections')
@@ -381,6 +448,9 @@ if __name__ == "__main__":
     parser.add_argument('-g', '--tag', help='Tag to prepend to output files')
     parser.add_argument('-o', '--outdir', default='.', help='Output directory (for plots, etc.)')
     parser.add_argument('-c', '--numcores', type=int, help='Number of cores to use.')
+    parser.add_argument('-m', '--multi', action='store_true', default=False, help='Load all objects concurrently from one process using libcurl\'s multi interface (requires pycurl; ignored with -p).')
+    parser.add_argument('--maxtransfers', type=int, default=50, help='With -m, the maximum number of transfers in flight at once.')
+    parser.add_argument('--maxperhost', type=int, default=6, help='With -m, the maximum number of transfers in flight to one host.')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
     args = parser.parse_args()
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import urlparse
+import requests
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_TTL = 24*60*60  # seconds a cached availability check stays valid
+MAX_PARALLEL_CHECKS = 32
+
+
+class AvailabilityCache(object):
+    '''Remembers whether hosts can be reached over a given protocol, keyed by
+    scheme and host.
+
+    :param path: JSON file to keep entries in across runs (shared by every
+        loader using the same path); None to keep them in memory only
+    :param ttl: how long (in seconds) an entry stays valid
+    '''
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self._path = path
+        self._ttl = ttl
+        self._entries = {}  # key -> [available, time checked]
+        self._unsaved = {}
+        if self._path:
+            self._entries.update(self._read())
+
+    @staticmethod
+    def key(url):
+        '''The cache key for `url` (its scheme and host).'''
+        parts = urlparse.urlsplit(url)
+        return '%s://%s' % (parts.scheme, parts.netloc.lower())
+
+    def _read(self):
+        try:
+            with open(self._path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, url):
+        '''True or False if we know whether `url`'s host is reachable over
+        `url`'s protocol; None if we don't (or the entry has expired).'''
+        entry = self._entries.get(self.key(url))
+        if entry and time.time() - entry[1] < self._ttl:
+            return entry[0]
+        return None
+
+    def put(self, url, available):
+        '''Record the result of checking `url`.'''
+        entry = [available, time.time()]
+        self._entries[self.key(url)] = entry
+        self._unsaved[self.key(url)] = entry
+
+    def save(self):
+        '''Merge new entries into the cache file (if there is one).'''
+        if not self._path or not self._unsaved:
+            return
+        try:
+            with open(self._path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                entries = self._read()
+                entries.update(self._unsaved)
+                now = time.time()
+                entries = dict((k, v) for k, v in entries.iteritems()\
+                    if now - v[1] < self._ttl)
+                tmp_path = '%s.%d.tmp' % (self._path, os.getpid())
+                with open(tmp_path, 'w') as f:
+                    json.dump(entries, f)
+                os.rename(tmp_path, self._path)
+            self._entries.update(entries)
+            self._unsaved = {}
+        except Exception as e:
+            logging.warn('Error saving availability cache %s: %s', self._path, e)
+
+
+def check_url(url, timeout=30, user_agent=None):
+    '''Check if `url` can be loaded over its protocol (e.g., an HTTPS URL
+    might not respond or an HTTP URL might be redirected to an HTTPS one).
+
+    Sends a HEAD request, falling back to a GET for the first byte if the
+    server rejects HEAD; bodies are never read.
+    '''
+    orig_protocol = urlparse.urlparse(url).scheme
+    logging.debug('Checking if %s can be accessed using %s', url, orig_protocol)
+
+    headers = {}
+    if user_agent:
+        headers['User-Agent'] = user_agent
+    try:
+        response = requests.head(url, timeout=timeout, headers=headers,\
+            verify=False, allow_redirects=True)
+        response.close()
+        if response.status_code >= 400:
+            # plenty of servers don't implement HEAD properly
+            headers['Range'] = 'bytes=0-0'
+            response = requests.get(url, timeout=timeout, headers=headers,\
+                verify=False, stream=True)
+            response.close()
+    except requests.exceptions.ConnectionError as e:
+        logging.debug('Could not connect to %s: %s', url, e)
+        return False
+    except requests.exceptions.Timeout as e:
+        logging.debug('Timed out connecting to %s: %s', url, e)
+        return False
+    except Exception as e:
+        logging.exception('Error requesting %s: %s', url, e)
+        return False
+
+    # if we got a response, check if we changed protocols
+    return urlparse.urlparse(response.url).scheme == orig_protocol
+
+def check_urls(urls, timeout=30, user_agent=None, cache=None,\
+    max_parallel=MAX_PARALLEL_CHECKS):
+    '''Check a batch of URLs with :func:`check_url`, in parallel, once per
+    scheme and host, skipping any `cache` already knows about.
+
+    Returns a dict mapping each URL to True or False.
+    '''
+    if cache is None:
+        cache = AvailabilityCache()
+
+    fresh = {}  # key -> result of checking it now
+    to_check = {}  # key -> URL to check it with
+    for url in urls:
+        if cache.get(url) is None:
+            to_check.setdefault(cache.key(url), url)
+
+    if to_check:
+        logging.info('Checking protocol availability for %d hosts', len(to_check))
+        pool = ThreadPool(min(max_parallel, len(to_check)))
+        try:
+            checked = pool.map(lambda url: (url, check_url(url, timeout,\
+                user_agent)), to_check.values())
+        finally:
+            pool.close()
+            pool.join()
+        for url, available in checked:
+            fresh[cache.key(url)] = available
+            cache.put(url, available)
+        cache.save()
+
+    return dict((url, fresh.get(cache.key(url), cache.get(url))) for url in urls)
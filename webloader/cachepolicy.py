@@ -0,0 +1,188 @@
+import re
+from httpdate import parse_http_date
+
+# status codes a cache may store without explicit freshness information
+# (RFC 7231 6.1, RFC 7538)
+CACHEABLE_BY_DEFAULT = frozenset((200, 203, 204, 206, 300, 301, 308, 404, 405,\
+    410, 414, 501))
+HEURISTIC_FRACTION = 0.1  # of the time since Last-Modified (RFC 7234 4.2.2)
+MAX_DELTA_SECONDS = 2**31  # RFC 7234 1.2.1
+
+_DIRECTIVE = re.compile(r'\s*([^\s,=]+)\s*(?:=\s*("(?:[^"\\]|\\.)*"|[^,]*?))?\s*(?:,|$)')
+
+
+def parse_cache_control(values):
+    '''Parse Cache-Control header values (one or more headers) into a dict
+    mapping each lower-cased directive to a list of its arguments (None for
+    directives without one), in order.'''
+    directives = {}
+    for value in values:
+        for m in _DIRECTIVE.finditer(value):
+            name, argument = m.groups()
+            if argument is not None:
+                argument = argument.strip()
+                if argument.startswith('"'):
+                    argument = re.sub(r'\\(.)', r'\1', argument[1:-1])
+            directives.setdefault(name.lower(), []).append(argument)
+    return directives
+
+def _delta_seconds(arguments):
+    '''The value of a delta-seconds directive like max-age, or 0 (stale) if
+    it's invalid or given more than once (RFC 7234 4.2.1).'''
+    if len(arguments) != 1:
+        return 0
+    try:
+        return min(int(arguments[0]), MAX_DELTA_SECONDS)
+    except (TypeError, ValueError):
+        return 0
+
+def _field_names(arguments):
+    # no-cache="Set-Cookie" and private="..." only apply to the fields named
+    return [a for a in arguments if a]
+
+
+class CachePolicy(object):
+    '''How a cache may reuse one response, per RFC 7234. Build one with
+    :func:`cache_policy`.
+
+    :param storable: the cache may store the response
+    :param freshness_lifetime: seconds the response stays fresh after it was
+        generated
+    :param heuristic: `freshness_lifetime` was estimated (from Last-Modified)
+        rather than given by the server
+    :param age: how old (seconds) the response already was when received
+    :param no_cache: the cache must revalidate before every reuse
+    :param revalidatable: the response has a validator (ETag or
+        Last-Modified), so a stale copy can be revalidated with a conditional
+        request instead of fetched again
+    '''
+
+    FRESH = 'FRESH'  #: Reusable without contacting the server
+    REVALIDATE = 'REVALIDATE'  #: Reusable after a conditional request (e.g., a 304)
+
+    __slots__ = ('storable', 'freshness_lifetime', 'heuristic', 'age',\
+        'no_cache', 'revalidatable')
+
+    def __init__(self, storable=False, freshness_lifetime=0, heuristic=False,\
+        age=0, no_cache=False, revalidatable=False):
+        self.storable = storable
+        self.freshness_lifetime = freshness_lifetime
+        self.heuristic = heuristic
+        self.age = age
+        self.no_cache = no_cache
+        self.revalidatable = revalidatable
+
+    def fresh_after(self, elapsed):
+        '''Whether a stored copy is still fresh `elapsed` seconds after it was
+        received.'''
+        return self.storable and not self.no_cache and\
+            self.freshness_lifetime > self.age + elapsed
+
+    def reuse_after(self, elapsed):
+        '''How a stored copy can be used `elapsed` seconds after it was
+        received: :attr:`FRESH`, :attr:`REVALIDATE`, or None if it can't.'''
+        if not self.storable:
+            return None
+        if self.fresh_after(elapsed):
+            return CachePolicy.FRESH
+        if self.revalidatable:
+            return CachePolicy.REVALIDATE
+        return None
+
+    def __str__(self):
+        return 'CachePolicy: storable=%s lifetime=%s%s age=%s no_cache=%s revalidatable=%s'\
+            % (self.storable, self.freshness_lifetime,\
+            ' (heuristic)' if self.heuristic else '', self.age, self.no_cache,\
+            self.revalidatable)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def cache_policy(response_headers, status=200, request_headers=(),\
+    method='GET', response_time=None, shared=False):
+    '''Work out how a browser cache (or, if `shared`, a shared cache such as
+    a CDN or proxy) may reuse a response.
+
+    :param response_headers: the response's headers (a
+        :class:`har.HarHeaders`, or anything with the same case-insensitive
+        ``get_all(name)``); repeated headers are all taken into account
+    :param status: the response's status code
+    :param request_headers: the request's headers (anything that supports
+        case-insensitive ``name in request_headers``)
+    :param method: the request method
+    :param response_time: when the response was received (seconds since the
+        epoch); used for Date-less responses and to estimate the response's
+        age from its Date
+    :param shared: evaluate for a shared cache rather than a private one
+    :returns: a :class:`CachePolicy`
+    '''
+    get_all = response_headers.get_all
+    cc = parse_cache_control(get_all('cache-control'))
+    last_modified = get_all('last-modified')
+    validators = bool(last_modified or get_all('etag'))
+
+    # Vary: * means no later request can match the stored one
+    vary = ','.join(get_all('vary'))
+    if method.upper() not in ('GET', 'HEAD') or 'no-store' in cc or\
+        '*' in [v.strip() for v in vary.split(',')]:
+        return CachePolicy(revalidatable=validators)
+    if shared:
+        if 'private' in cc and not _field_names(cc['private']):
+            return CachePolicy(revalidatable=validators)
+        if 'authorization' in request_headers and not\
+            ('must-revalidate' in cc or 'public' in cc or 's-maxage' in cc):
+            return CachePolicy(revalidatable=validators)
+
+    date = None
+    dates = get_all('date')
+    if len(dates) == 1:
+        date = parse_http_date(dates[0])
+    if date is None:
+        date = response_time
+
+    # explicit freshness lifetime (RFC 7234 4.2.1)
+    lifetime = None
+    if shared and 's-maxage' in cc:
+        lifetime = _delta_seconds(cc['s-maxage'])
+    elif 'max-age' in cc:
+        lifetime = _delta_seconds(cc['max-age'])
+    elif get_all('expires'):
+        expires = get_all('expires')
+        expires = parse_http_date(expires[0]) if len(expires) == 1 else None
+        if expires is None or date is None:
+            lifetime = 0  # invalid Expires (e.g., "0") means already expired
+        else:
+            lifetime = max(expires - date, 0)
+
+    heuristic = False
+    if lifetime is None:
+        if status not in CACHEABLE_BY_DEFAULT and 'public' not in cc:
+            # nothing allows storing this response
+            return CachePolicy(revalidatable=validators)
+        # heuristic freshness (RFC 7234 4.2.2)
+        lifetime = 0
+        last_modified = parse_http_date(last_modified[0])\
+            if last_modified else None
+        if last_modified is not None and date is not None:
+            lifetime = max(int((date - last_modified) * HEURISTIC_FRACTION), 0)
+            heuristic = True
+
+    # age when received (RFC 7234 4.2.3)
+    age = 0
+    ages = get_all('age')
+    try:
+        age = max(int(ages[0]), 0) if ages else 0
+    except ValueError:
+        pass
+    if response_time is not None and date is not None:
+        age = max(age, response_time - date)
+
+    no_cache = 'no-cache' in cc and not _field_names(cc['no-cache'])
+    if not no_cache and not cc and\
+        'no-cache' in ','.join(get_all('pragma')).lower():
+        no_cache = True  # HTTP/1.0 (RFC 7234 5.4)
+
+    return CachePolicy(storable=True, freshness_lifetime=lifetime,\
+        heuristic=heuristic, age=age, no_cache=no_cache,\
+        revalidatable=validators)
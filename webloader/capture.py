@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import struct
+import logging
+import threading
+import subprocess
+
+TCPDUMP = '/usr/sbin/tcpdump'
+READY_TIMEOUT = 10  # seconds to wait for tcpdump to start listening
+
+# pcap file format (https://wiki.wireshark.org/Development/LibpcapFileFormat)
+PCAP_MAGIC = 0xa1b2c3d4  # microsecond timestamps
+PCAP_MAGIC_NS = 0xa1b23c4d  # nanosecond timestamps
+PCAP_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+
+class RunCapture(object):
+    '''One tcpdump capture for a whole run, plus an index recording when each
+    trial started and finished. Afterwards, :func:`slice_capture` cuts the
+    capture into one pcap per trial.
+
+    Compared to starting tcpdump for every trial, this costs nothing per
+    trial and can't miss the start of a load while tcpdump is still starting.
+    Trials that overlap (e.g., parallel loads) get each other's packets in
+    their slices.
+
+    Index records are appended with a single ``write()`` to a file opened with
+    O_APPEND, so worker threads and processes can share one index.
+
+    :param pcap_path: where tcpdump writes the whole capture
+    :param index_path: JSON lines file with one record per trial; defaults to
+        `pcap_path` + '.index'
+    '''
+
+    def __init__(self, pcap_path, index_path=None):
+        self._pcap_path = pcap_path
+        self._index_path = index_path or pcap_path + '.index'
+        self._proc = None
+        self._log = None
+        self._fd = None
+        self._fd_pid = None  # process that opened _fd
+        self._lock = threading.Lock()
+
+    @property
+    def pcap_path(self):
+        '''Path of the whole-run capture.'''
+        return self._pcap_path
+
+    @property
+    def index_path(self):
+        '''Path of the trial index.'''
+        return self._index_path
+
+    def start(self, stdout_file=None):
+        '''Start tcpdump and wait until it's capturing. Starts a new (empty)
+        index. Returns True if tcpdump is running.'''
+        with open(self._index_path, 'w'):
+            pass
+        self._log = open(self._pcap_path + '.log', 'w+')
+        command = ['sudo', TCPDUMP, '-w', self._pcap_path]
+        logging.debug('Starting tcpdump: %s', ' '.join(command))
+        self._proc = subprocess.Popen(command, stdout=stdout_file,\
+            stderr=self._log)
+
+        # tcpdump says "listening on <interface>" once the capture is open
+        deadline = time.time() + READY_TIMEOUT
+        while time.time() < deadline:
+            self._log.seek(0)
+            if 'listening on' in self._log.read():
+                return True
+            if self._proc.poll() is not None:
+                break
+            time.sleep(0.05)
+        self._log.seek(0)
+        logging.error('tcpdump did not start capturing: %s',\
+            self._log.read().strip())
+        self.stop()
+        return False
+
+    def stop(self):
+        '''Stop tcpdump (if it's running) and close the index.'''
+        if self._proc is not None:
+            logging.debug('Stopping tcpdump')
+            if self._proc.poll() is None:
+                os.system('sudo kill %s' % self._proc.pid)
+            self._proc.wait()
+            self._proc = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._fd is not None and self._fd_pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+        self._fd_pid = None
+
+    def record(self, url, tag, trial, start, end, pcap_path):
+        '''Add a trial that ran from `start` to `end` (from
+        :func:`time.time`) to the index; its slice of the capture will be
+        written to `pcap_path`.'''
+        record = json.dumps({'url': url, 'tag': tag, 'trial': trial,\
+            'start': start, 'end': end, 'pcap': pcap_path})
+        with self._lock:
+            if self._fd is None or self._fd_pid != os.getpid():
+                # don't share a descriptor with a parent
+                self._fd = os.open(self._index_path,\
+                    os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+                self._fd_pid = os.getpid()
+            os.write(self._fd, record + '\n')
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_proc'] = None
+        state['_log'] = None
+        state['_fd'] = None
+        state['_fd_pid'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def read_index(index_path):
+    '''The trial records in a :class:`RunCapture` index, as dicts with keys
+    url, tag, trial, start, end and pcap.'''
+    records = []
+    with open(index_path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logging.warn('Ignoring bad record in capture index %s: %r',\
+                    index_path, line)
+    return records
+
+def slice_capture(pcap_path, index_path=None, margin=0.0):
+    '''Cut a whole-run capture into one pcap per trial in its index (see
+    :class:`RunCapture`), in a single pass over the capture. Each trial's
+    file gets the packets timestamped from its start to its end, widened by
+    `margin` seconds on both sides. Returns the number of files written.'''
+    windows = sorted(read_index(index_path or pcap_path + '.index'),\
+        key=lambda w: w['start'])
+    if not windows:
+        return 0
+
+    with open(pcap_path, 'rb') as capture:
+        header = capture.read(PCAP_HEADER_LEN)
+        if len(header) < PCAP_HEADER_LEN:
+            raise ValueError('%s is not a pcap file (too short)' % pcap_path)
+        for endian in ('<', '>'):
+            magic = struct.unpack(endian + 'I', header[:4])[0]
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+                break
+        else:
+            raise ValueError('%s is not a pcap file (bad magic)' % pcap_path)
+        frac = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+        record_header = struct.Struct(endian + 'IIII')
+
+        next_window = 0
+        active = []  # (end, output file) of windows the capture has reached
+
+        def open_slice(window):
+            f = open(window['pcap'], 'wb')
+            f.write(header)
+            return (window['end'] + margin, f)
+
+        while True:
+            data = capture.read(RECORD_HEADER_LEN)
+            if len(data) < RECORD_HEADER_LEN:
+                break
+            ts_sec, ts_frac, incl_len, orig_len = record_header.unpack(data)
+            packet = capture.read(incl_len)
+            if len(packet) < incl_len:
+                break  # capture cut off mid-packet
+            ts = ts_sec + ts_frac * frac
+
+            while next_window < len(windows) and\
+                windows[next_window]['start'] - margin <= ts:
+                active.append(open_slice(windows[next_window]))
+                next_window += 1
+            still_active = []
+            for end, f in active:
+                if end < ts:
+                    f.close()
+                else:
+                    f.write(data)
+                    f.write(packet)
+                    still_active.append((end, f))
+            active = still_active
+
+        for end, f in active:
+            f.close()
+        # trials after the last packet get empty captures
+        for window in windows[next_window:]:
+            open_slice(window)[1].close()
+
+    return len(windows)
@@ -0,0 +1,110 @@
+import os
+import gc
+import logging
+import cPickle
+import cStringIO
+
+
+class Checkpoint(object):
+    '''Append-only journal of finished trials, so a run that dies part way
+    through can be restarted and pick up where it left off.
+
+    Each record is one pickled ``(url, tag, trial, LoadResult)`` tuple, or
+    ``(url, None, None, None)`` once a URL's results have been sent to the
+    result sinks (so a resumed run doesn't send them again). Records are
+    appended with a single ``write()`` to a file opened with O_APPEND, so
+    worker threads and processes can share one journal. A record torn by a
+    crash is cut off the end of the file on the next :meth:`replay`.
+
+    :param path: the journal file (created if it doesn't exist)
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        self._done = {}  # (url, tag, trial) -> LoadResult
+        self._published = set()  # URLs published by the run we're resuming
+        self._fd = None
+        self._fd_pid = None  # process that opened _fd
+
+    def replay(self):
+        '''Read the journal. Returns the number of finished trials in it.'''
+        self._done = {}
+        self._published = set()
+        if not os.path.exists(self._path):
+            return 0
+
+        with open(self._path, 'rb') as f:
+            data = cStringIO.StringIO(f.read())
+        unpickler = cPickle.Unpickler(data)
+        good_end = 0
+        gc_was_enabled = gc.isenabled()
+        gc.disable()  # we only add objects; collecting as we go is wasted time
+        try:
+            while True:
+                try:
+                    url, tag, trial, result = unpickler.load()
+                except EOFError:
+                    break
+                except Exception as e:
+                    logging.warn('Ignoring torn record at byte %d of checkpoint %s: %s',\
+                        good_end, self._path, e)
+                    break
+                if tag is None and trial is None:
+                    self._published.add(url)
+                else:
+                    self._done[(url, tag, trial)] = result
+                good_end = data.tell()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        if os.path.getsize(self._path) > good_end:
+            with open(self._path, 'r+b') as f:
+                f.truncate(good_end)
+
+        logging.info('Checkpoint %s has %d finished trials', self._path,\
+            len(self._done))
+        return len(self._done)
+
+    def get(self, url, tag, trial):
+        '''The recorded :class:`LoadResult` for a trial, or None if it hasn't
+        finished.'''
+        return self._done.get((url, tag, trial))
+
+    def was_published(self, url):
+        '''Whether the run being resumed already sent `url`'s results to the
+        sinks (see :meth:`record_published`).'''
+        return url in self._published
+
+    def record(self, url, tag, trial, result):
+        '''Append a finished trial to the journal.'''
+        self._append((url, tag, trial, result))
+        self._done[(url, tag, trial)] = result
+
+    def record_published(self, url):
+        '''Note in the journal that `url`'s results were sent to the sinks.
+        (:meth:`was_published` only reports URLs published before the last
+        :meth:`replay`, so a URL repeated within one run is still published
+        each time.)'''
+        self._append((url, None, None, None))
+
+    def _append(self, record):
+        if self._fd is None or self._fd_pid != os.getpid():
+            # don't share a descriptor (and its buffering) with a parent
+            self._fd = os.open(self._path,\
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            self._fd_pid = os.getpid()
+        os.write(self._fd, cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL))
+
+    def close(self):
+        '''Close the journal file (it's reopened if more trials are recorded).'''
+        if self._fd is not None and self._fd_pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+        self._fd_pid = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_fd'] = None
+        state['_fd_pid'] = None
+        return state
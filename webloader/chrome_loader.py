@@ -1,119 +1,243 @@
 import os
+import re
 import sys
 import subprocess
 import traceback
 import logging
+import json
+import threading
 from time import sleep
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, Timeout, TimeoutError, popen,\
+    kill_process_tree
+from devtools import DevToolsClient, DevToolsError, HarCapture, IsolatedTab
+from resources import lease_display, lease_port, make_profile_dir,\
+    remove_profile_dir
 
 CHROME = '/usr/bin/env google-chrome'
-CHROME_HAR_CAPTURER = '/usr/bin/env chrome-har-capturer'
 XVFB = '/usr/bin/env Xvfb'
-DISPLAY = ':99'
-CURL = '/usr/bin/env curl'
+
+# Chrome prints this to stderr once remote debugging is ready
+DEVTOOLS_ANNOUNCEMENT = re.compile(r'DevTools listening on (ws://\S+)')
 
 # TODO: test if isntalled chrome can support HTTP2
-# TODO: pick different display if multiple instances are used at once
-# TODO: get load time
 # TODO: screenshot?
-# TODO: final URL?
-# TODO: pass timeout to chrome?
 # TODO: FAILURE_NO_200?
 
 class ChromeLoader(Loader):
     '''Subclass of :class:`Loader` that loads pages using Chrome.
     
-    .. note:: The :class:`ChromeLoader` currently does not time page load.
     .. note:: The :class:`ChromeLoader` currently does not save screenshots.
     .. note:: The :class:`ChromeLoader` currently does not support single-object loading (i.e., it always loads the full page).
     .. note:: The :class:`ChromeLoader` currently does not support saving screenshots.
+
+    :param native_headless: if `headless` is set, use Chrome's built-in
+        headless mode instead of running it under Xvfb (no X server needed,
+        and much faster to start).
+    :param num_tabs: load this many pages at once in one Chrome process. Each
+        load runs in its own tab inside its own browser context (so tabs share
+        no cache or cookies), and each URL gets a fresh context. Chrome
+        command-line settings (e.g., `disable_quic`) are fixed for the whole
+        run in this mode, so they can't vary between configs.
     '''
 
-    def __init__(self, **kwargs):
+    # one running Chrome (see Loader.standby_instances)
+    _backend_state = ('_xvfb_proc', '_chrome_proc', '_display_lease',\
+        '_port_lease', '_profile_dir', '_devtools', '_har_capture',\
+        '_browser_devtools')
+
+    def __init__(self, native_headless=False, num_tabs=1, **kwargs):
         super(ChromeLoader, self).__init__(**kwargs)
         if not self._full_page:
             raise NotImplementedError('ChromeLoader does not support loading only an object')
         if self._save_screenshot:
             raise NotImplementedError('ChromeLoader does not support saving screenshots.')
 
+        self._native_headless = native_headless
         self._xvfb_proc = None
         self._chrome_proc = None
 
+        # per-instance resources, so several loaders can share a machine
+        self._display_lease = None
+        self._port_lease = None
+        self._profile_dir = None
+        self._devtools = None
+        self._har_capture = None
+
+        # tab pool mode
+        self._num_tabs = num_tabs
+        self._parallel_loads = num_tabs
+        self._browser_devtools = None
+        self._tab_lock = threading.Lock()
+        self._open_tabs = []  # shared by all workers
+        self._tab = None  # the IsolatedTab this worker is using
+
+    def __getstate__(self):
+        '''don't try to pickle DevTools connections or locks'''
+        state = super(ChromeLoader, self).__getstate__()
+        for key in ('_devtools', '_har_capture', '_browser_devtools',\
+                    '_tab_lock', '_open_tabs', '_tab', '_display_lease',\
+                    '_port_lease'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._devtools = None
+        self._har_capture = None
+        self._browser_devtools = None
+        self._tab_lock = threading.Lock()
+        self._open_tabs = []
+        self._tab = None
+        self._display_lease = None
+        self._port_lease = None
+
+    @property
+    def _debugging_port(self):
+        return self._port_lease.value
+
+    def _open_tab(self):
+        with self._tab_lock:
+            tab = IsolatedTab(self._browser_devtools, port=self._debugging_port,\
+                timeout=self._timeout)
+            self._open_tabs.append(tab)
+        tab.capture.enable(disable_cache=self._disable_local_cache,\
+            disable_network_cache=self._disable_network_cache)
+        return tab
+
+    def _close_tab(self, tab):
+        with self._tab_lock:
+            tab.close()
+            if tab in self._open_tabs:
+                self._open_tabs.remove(tab)
+
+    def _recycle(self):
+        '''Swap this worker's tab for one in a fresh browser context.'''
+        try:
+            if self._tab:
+                self._close_tab(self._tab)
+                self._tab = None
+            self._tab = self._open_tab()
+        except Exception as e:
+            logging.exception('Error opening new tab')
+            return False
+        return True
+
     def _load_page(self, url, outdir, trial_num=None, tag=None):
         # path for new HAR file
+        harpath = None
         if self._save_har:
             harpath = self._outfile_path(url, suffix='.har', trial=trial_num, tag=tag)
-        else:
-            harpath = '/dev/null'
-        logging.debug('Will save HAR to %s', harpath)
-
-
-        # build chrome-har-capturer arguments
-        capturer_args = ''
+            logging.debug('Will save HAR to %s', harpath)
 
         onload_delay = self._delay_after_onload
         if self._delay_first_trial_only and trial_num != 0:
             onload_delay = 0
-        capturer_args += ' -d %i' % onload_delay
-
-        if self._disable_network_cache:
-            capturer_args += ' --no-network-cache'
 
-        if self._save_content == 'always' or\
-           (self._save_content == 'first' and trial_num == 0):
-            capturer_args += ' -c'
+        save_content = self._save_content == 'always' or\
+           (self._save_content == 'first' and trial_num == 0)
 
     
         # load the specified URL
         logging.info('Fetching page %s (%s)', url, tag)
         try:
-            capturer_cmd = '%s -o "%s" %s %s' %\
-                (CHROME_HAR_CAPTURER, harpath, capturer_args, url)
-            logging.debug('Running capturer: %s', capturer_cmd)
-            with Timeout(seconds=self._timeout+5):
-                subprocess.check_call(capturer_cmd, shell=True,\
-                    stdout=self._stdout_file, stderr=subprocess.STDOUT)
+            if self._num_tabs > 1:
+                if self._tab is None:
+                    self._tab = self._open_tab()
+                har_capture = self._tab.capture
+            else:
+                har_capture = self._har_capture
+
+            # in tab pool mode each context has its own cache; clearing the
+            # browser-wide cache would disturb the other tabs' loads
+            har, final_url, load_time = har_capture.capture(url,\
+                timeout=self._timeout, onload_delay=onload_delay,\
+                save_content=save_content,\
+                clear_cache=self._disable_local_cache and self._num_tabs == 1)
+
+            if harpath:
+                with open(harpath, 'w') as f:
+                    json.dump(har, f, indent=4)
+                f.closed
         
         except TimeoutError:
             logging.error('Timeout fetching %s', url)
             return LoadResult(LoadResult.FAILURE_TIMEOUT, url)
-        except subprocess.CalledProcessError as e:
-            logging.exception('Error loading %s: %s\n%s' % (url, e, e.output))
+        except DevToolsError as e:
+            logging.error('Error loading %s: %s' % (url, e))
             return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
         except Exception as e:
             logging.exception('Error loading %s: %s' % (url, e))
             return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
         logging.debug('Page loaded.')
     
-        return LoadResult(LoadResult.SUCCESS, url, har=harpath)
+        return LoadResult(LoadResult.SUCCESS, url, final_url=final_url,\
+            time=load_time, har=harpath)
 
 
+    def _wait_for_devtools(self):
+        '''Read Chrome's stderr until it announces its DevTools endpoint; then
+        keep forwarding the rest of its stderr in the background (so the pipe
+        never fills up). Returns the announced websocket URL.'''
+        dest = self._stdout_file if self._stdout_file else sys.stderr
+        pipe = self._chrome_proc.stderr
+        while True:
+            line = pipe.readline()
+            if line == '':
+                raise Exception('Chrome exited before DevTools was ready (return code: %s)'\
+                    % self._chrome_proc.poll())
+            dest.write(line)
+            match = DEVTOOLS_ANNOUNCEMENT.search(line)
+            if match:
+                break
+
+        def forward():
+            try:
+                for line in iter(pipe.readline, ''):
+                    dest.write(line)
+            except Exception as e:
+                logging.debug('Stopped forwarding Chrome output: %s', e)
+        thread = threading.Thread(target=forward)
+        thread.daemon = True
+        thread.start()
+
+        return match.group(1)
+
     def _setup(self):
         stdout = self._stdout_file
         stderr = self._stdout_file
+        env = dict(os.environ)
 
-        if self._headless:
+        try:
+            self._port_lease = lease_port()
+            self._profile_dir = make_profile_dir()
+        except Exception as e:
+            logging.exception('Error reserving resources for Chrome')
+            return False
+
+        if self._headless and not self._native_headless:
             # start a virtual display
             try:
-                os.environ['DISPLAY'] = DISPLAY
-                xvfb_command = '%s %s -screen 0 1366x768x24 -ac' % (XVFB, DISPLAY)
+                self._display_lease = lease_display()
+                display = ':%d' % self._display_lease.value
+                env['DISPLAY'] = display
+                xvfb_command = '%s %s -screen 0 1366x768x24 -ac' % (XVFB, display)
                 logging.debug('Starting XVFB: %s', xvfb_command)
-                self._xvfb_proc = subprocess.Popen(xvfb_command.split(),\
+                self._xvfb_proc = popen(xvfb_command.split(),\
                     stdout=stdout, stderr=stderr)
                 sleep(1)
 
                 # check if Xvfb failed to start and process terminated
                 retcode = self._xvfb_proc.poll()
                 if retcode != None:
-                    raise("Xvfb proc exited with return code: %i" % retcode)
+                    raise Exception("Xvfb proc exited with return code: %i" % retcode)
             except Exception as e:
                 logging.exception("Error starting XFVB")
                 return False
-            logging.debug('Started XVFB (DISPLAY=%s)', os.environ['DISPLAY'])
+            logging.debug('Started XVFB (DISPLAY=%s)', display)
 
         if self._log_ssl_keys:
             keylog_file = os.path.join(self._outdir, 'ssl_keylog')
-            os.environ['SSLKEYLOGFILE'] = keylog_file
+            env['SSLKEYLOGFILE'] = keylog_file
             
     
         # launch chrome with no cache and remote debug on
@@ -130,33 +254,26 @@ class ChromeLoader(Loader):
                 options += ' --use-spdy=off'
             if self._ignore_certificate_errors:
                 options += ' --ignore-certificate-errors'
-            # options for chrome-har-capturer
-            options += ' --remote-debugging-port=9222 --enable-benchmarking --enable-net-benchmarking'
+            if self._headless and self._native_headless:
+                options += ' --headless --disable-gpu'
+            # keep this instance's profile separate from other Chromes (or
+            # Chrome just hands the launch off to the existing browser)
+            options += ' --user-data-dir=%s --no-first-run' % self._profile_dir
+            # options for DevTools HAR capture
+            options += ' --remote-debugging-port=%d --enable-benchmarking --enable-net-benchmarking'\
+                % self._debugging_port
 
             chrome_command = '%s %s' % (CHROME, options)
             logging.debug('Starting Chrome: %s', chrome_command)
-            self._chrome_proc = subprocess.Popen(chrome_command.split(),\
-                stdout=stdout, stderr=stderr)
-                
-
-            # wait until chrome remote debugging is ready
-            with Timeout(seconds=5):
-                curl_retcode = -1
-                while curl_retcode != 0:
-                    # try to access chrome remote debug interface
-                    curl_cmd = '%s -sS --max-time 1 -o /dev/null localhost:9222/json' % CURL
-                    curl_retcode = subprocess.call(curl_cmd.split(),\
-                        stdout=self._stdout_file, stderr=subprocess.STDOUT)
-
-                    logging.debug('Checking if Chrome remote debug is ready. Curl return code: %d' % curl_retcode)
-                
-                    # check to see if chrome exited for some reason
-                    # (e.g., if Xvfb failed to start)
-                    chrome_retcode = self._chrome_proc.poll()
-                    if chrome_retcode != None:
-                        raise("Chrome proc exited with return code: %i" % chrome_retcode)
-
-                    sleep(0.5)
+            self._chrome_proc = popen(chrome_command.split(),\
+                stdout=stdout, stderr=subprocess.PIPE, env=env)
+
+            # wait until chrome remote debugging is ready (if chrome exits
+            # or we time out and kill it, stderr hits EOF and we give up)
+            with Timeout(seconds=5) as timeout:
+                timeout.track(self._chrome_proc)
+                ws_url = self._wait_for_devtools()
+            logging.debug('Chrome remote debugging ready: %s', ws_url)
 
         except TimeoutError:
             logging.error('Timeout waiting for Chrome to be ready')
@@ -165,28 +282,63 @@ class ChromeLoader(Loader):
             logging.exception("Error starting Chrome")
             return False
         logging.debug('Started Chrome')
+
+        # open the (persistent) DevTools connection used for every load; in
+        # tab pool mode, workers open their own tabs through the browser target
+        try:
+            if self._num_tabs > 1:
+                self._browser_devtools = DevToolsClient(port=self._debugging_port,\
+                    timeout=self._timeout, browser=True)
+                self._browser_devtools.connect()
+            else:
+                self._devtools = DevToolsClient(port=self._debugging_port,\
+                    timeout=self._timeout)
+                self._devtools.connect()
+                self._har_capture = HarCapture(self._devtools)
+                self._har_capture.enable(disable_cache=self._disable_local_cache,\
+                    disable_network_cache=self._disable_network_cache)
+        except Exception as e:
+            logging.exception('Error connecting to Chrome DevTools')
+            return False
         return True
 
 
     def _teardown(self):
+        if self._devtools:
+            self._devtools.close()
+            self._devtools = None
+            self._har_capture = None
+        for tab in list(self._open_tabs):
+            self._close_tab(tab)
+        self._tab = None
+        if self._browser_devtools:
+            self._browser_devtools.close()
+            self._browser_devtools = None
+
+        # kill chrome and any subprocesses it opened (but not other loaders')
         try:
             if self._chrome_proc:
                 logging.debug('Stopping Chrome')
-                self._chrome_proc.kill()
+                kill_process_tree(self._chrome_proc)
                 self._chrome_proc.wait()
+                self._chrome_proc = None
         except:
             logging.exception('Error closing Chrome')
 
-        # kill any subprocesses chrome might have opened
-        try:
-            subprocess.check_output('killall -q chrome'.split())
-        except Exception as e:
-            logging.debug('Problem killing all chrome processes (maybe there were none): %s' % e)
-
         try:
             if self._xvfb_proc:
                 logging.debug('Stopping XVFB')
-                self._xvfb_proc.kill()
-            self._xvfb_proc.wait()
+                kill_process_tree(self._xvfb_proc)
+                self._xvfb_proc.wait()
+                self._xvfb_proc = None
         except:
             logging.exception('Error closing Xvfb')
+
+        if self._profile_dir:
+            remove_profile_dir(self._profile_dir)
+            self._profile_dir = None
+        for lease in (self._display_lease, self._port_lease):
+            if lease:
+                lease.release()
+        self._display_lease = None
+        self._port_lease = None
@@ -5,7 +5,8 @@ import shlex
 import subprocess
 import string
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, PhaseTimings, Timeout, TimeoutError,\
+    check_output
 
 CURL = '/usr/bin/env curl'
 
@@ -41,7 +42,7 @@ class CurlLoader(Loader):
         self._image_paths_by_url = defaultdict(list)
 
 
-    def _load_page(self, url, outdir, trial_num=-1):
+    def _load_page(self, url, outdir, trial_num=-1, tag=None):
     
         # load the specified URL
         logging.info('Loading page: %s', url)
@@ -52,6 +53,7 @@ class CurlLoader(Loader):
             curl_cmd += ' -L'  # follow redirects
             curl_cmd += ' -o /dev/null'  # don't print file to stdout
             curl_cmd += ' -w http_code=%{http_code};final_url=%{url_effective};time=%{time_total};size=%{size_download}'   # format for stats at end
+            curl_cmd += ';time_namelookup=%{time_namelookup};time_connect=%{time_connect};time_appconnect=%{time_appconnect};time_starttransfer=%{time_starttransfer}'  # phase timings
             curl_cmd += ' --connect-timeout %i' % self._timeout  # TCP connect timeout
             if self._disable_network_cache:
                 curl_cmd += ' --header "Cache-Control: max-age=0"'  # disable network caches
@@ -62,11 +64,12 @@ class CurlLoader(Loader):
             # load the page
             logging.debug('Running curl: %s', curl_cmd)
             with Timeout(seconds=self._timeout+5):
-                output = subprocess.check_output(shlex.split(curl_cmd))
+                output = check_output(shlex.split(curl_cmd))
                 logging.debug('curl returned: %s', output.strip())
 
             # curl returned, but may or may not have succeeded
-            returnvals = {field.split('=')[0]: field.split('=')[1] for field in output.split('\n')[-1].split(';')}
+            returnvals = {field.split('=', 1)[0]: field.split('=', 1)[1] for field in output.split('\n')[-1].split(';')}
+            seconds = lambda field: float(string.replace(returnvals[field], ',', '.'))
 
             if returnvals['http_code'] != '200':
                 return LoadResult(LoadResult.FAILURE_NO_200, url)
@@ -75,8 +78,11 @@ class CurlLoader(Loader):
                 return LoadResult(LoadResult.SUCCESS,
                     url,
                     final_url=returnvals['final_url'],
-                    time=float(string.replace(returnvals['time'], ',', '.')),
-                    size=returnvals['size'])
+                    time=seconds('time'),
+                    size=returnvals['size'],
+                    timings=PhaseTimings.from_curl(seconds('time_namelookup'),
+                        seconds('time_connect'), seconds('time_appconnect'),
+                        seconds('time_starttransfer'), seconds('time')))
 
         # problem running curl
         except TimeoutError:
@@ -0,0 +1,260 @@
+import time
+import logging
+import urlparse
+import pycurl
+from collections import defaultdict, deque, OrderedDict
+from curl_loader import CurlLoader
+from loader import LoadResult, PageResult, PhaseTimings
+
+# curl error code for "operation timed out"
+CURLE_OPERATION_TIMEDOUT = 28
+
+
+class CurlMultiLoader(CurlLoader):
+    '''Subclass of :class:`CurlLoader` that drives many transfers at once
+    through one libcurl multi handle (via pycurl) instead of forking curl for
+    every load.
+
+    Each trial still gets a fresh connection and DNS lookup, and trials of
+    the same URL never overlap, so individual load times are comparable to
+    :class:`CurlLoader`'s. Different URLs load concurrently, one event loop
+    for the whole batch, so one process can sweep thousands of objects.
+
+    Besides `time`, each :class:`LoadResult` carries a :class:`PhaseTimings`
+    breakdown from curl's timers.
+
+    A URL given more than once is loaded once; its results are published
+    for each occurrence. With `primer_load_first`, every URL that still needs
+    trials is loaded once (also concurrently) before any trials start.
+
+    :param max_transfers: maximum number of transfers in flight at once
+    :param max_per_host: maximum number of transfers in flight to any one
+        host (None for no limit)
+
+    .. note:: Of the packet capture modes, :class:`CurlMultiLoader` supports
+        only ``save_packet_capture='run'``. Transfers overlap, so each trial's
+        slice of the capture also holds packets from other transfers.
+    .. note:: :class:`CurlMultiLoader` does not support `concurrency` > 1; one
+        process already runs many transfers at once.
+    '''
+
+    def __init__(self, max_transfers=50, max_per_host=6, **kwargs):
+        super(CurlMultiLoader, self).__init__(**kwargs)
+        if self._save_packet_capture and self._save_packet_capture != 'run':
+            raise NotImplementedError('CurlMultiLoader only supports whole-run packet capture (save_packet_capture="run")')
+        if self._concurrency > 1:
+            raise NotImplementedError('CurlMultiLoader does not support concurrency > 1')
+        self._max_transfers = max_transfers
+        self._max_per_host = max_per_host
+
+    def _make_handle(self, url):
+        handle = pycurl.Curl()
+        handle.setopt(pycurl.URL, url)
+        handle.setopt(pycurl.FOLLOWLOCATION, 1)  # follow redirects
+        handle.setopt(pycurl.CONNECTTIMEOUT, self._timeout)  # TCP connect timeout
+        handle.setopt(pycurl.TIMEOUT, self._timeout + 5)  # whole transfer
+        handle.setopt(pycurl.NOSIGNAL, 1)
+        handle.setopt(pycurl.WRITEFUNCTION, lambda data: None)  # discard body
+
+        # don't let trials share connections or DNS results (a forked curl
+        # wouldn't either)
+        handle.setopt(pycurl.FRESH_CONNECT, 1)
+        handle.setopt(pycurl.FORBID_REUSE, 1)
+        handle.setopt(pycurl.DNS_CACHE_TIMEOUT, 0)
+
+        if self._disable_network_cache:
+            handle.setopt(pycurl.HTTPHEADER, ['Cache-Control: max-age=0'])  # disable network caches
+        if self._user_agent:
+            handle.setopt(pycurl.USERAGENT, self._user_agent)  # custom user agent
+        handle.url = url
+        return handle
+
+    def _make_result(self, handle, errno=None, errmsg=None):
+        url = handle.url
+        if errno is not None:
+            logging.error('Error loading %s: (%d) %s', url, errno, errmsg)
+            if errno == CURLE_OPERATION_TIMEDOUT:
+                return LoadResult(LoadResult.FAILURE_TIMEOUT, url)
+            return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
+
+        if handle.getinfo(pycurl.RESPONSE_CODE) != 200:
+            return LoadResult(LoadResult.FAILURE_NO_200, url)
+
+        total = handle.getinfo(pycurl.TOTAL_TIME)
+        return LoadResult(LoadResult.SUCCESS,
+            url,
+            final_url=handle.getinfo(pycurl.EFFECTIVE_URL),
+            time=total,
+            size=int(handle.getinfo(pycurl.SIZE_DOWNLOAD)),
+            timings=PhaseTimings.from_curl(\
+                handle.getinfo(pycurl.NAMELOOKUP_TIME),
+                handle.getinfo(pycurl.CONNECT_TIME),
+                handle.getinfo(pycurl.APPCONNECT_TIME),
+                handle.getinfo(pycurl.STARTTRANSFER_TIME),
+                total))
+
+    def _finished_trials(self, url, tag):
+        '''Results of the leading trials of `url` already in the checkpoint.'''
+        finished = []
+        while self._checkpoint and len(finished) < self._num_trials:
+            result = self._checkpoint.get(url, tag, len(finished))
+            if not result:
+                break
+            finished.append(result)
+        return finished
+
+    def _load_batch(self, urls, tag, primer=False):
+        '''Run trials of each URL through one multi handle until it has
+        `num_trials` (or its load time estimate converges; see
+        `target_ci_width`), skipping trials already in the checkpoint. Returns
+        a dict mapping each URL to its LoadResults in trial order.
+
+        With `primer`, load each URL just once (retrying failures as usual)
+        and don't record anything.'''
+        urls = list(OrderedDict.fromkeys(urls))  # one entry per URL
+        if primer:
+            results = dict((url, []) for url in urls)
+            more_needed = lambda results: not results
+        else:
+            results = dict((url, self._finished_trials(url, tag))\
+                for url in urls)
+            more_needed = self._more_trials_needed
+        tries = defaultdict(int)  # tries so far for each URL's current trial
+        active = {}  # URL -> handle in flight (at most one per URL)
+
+        # URLs waiting for their next trial, queued by host; hosts with a
+        # waiting URL and room under max_per_host take turns
+        waiting = defaultdict(deque)
+        active_per_host = defaultdict(int)
+        ready_hosts = deque()
+        host_of = dict((url, urlparse.urlsplit(url).netloc) for url in urls)
+
+        def host_has_room(host):
+            return self._max_per_host is None or\
+                active_per_host[host] < self._max_per_host
+
+        def make_ready(url):
+            host = host_of[url]
+            waiting[host].append(url)
+            if len(waiting[host]) == 1 and host_has_room(host):
+                ready_hosts.append(host)
+
+        for url in urls:
+            if more_needed(results[url]):
+                make_ready(url)
+
+        multi = pycurl.CurlMulti()
+        try:
+            while active or ready_hosts:
+                # start transfers, round robin across hosts, up to the caps
+                while ready_hosts and len(active) < self._max_transfers:
+                    host = ready_hosts.popleft()
+                    url = waiting[host].popleft()
+                    logging.info('Loading page: %s', url)
+                    handle = self._make_handle(url)
+                    handle.start = time.time()
+                    multi.add_handle(handle)
+                    active[url] = handle
+                    active_per_host[host] += 1
+                    if waiting[host] and host_has_room(host):
+                        ready_hosts.append(host)
+
+                # let libcurl make progress
+                while True:
+                    ret, num_handles = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+
+                # collect finished transfers
+                while True:
+                    num_queued, ok_list, err_list = multi.info_read()
+                    finished = [(h, None, None) for h in ok_list] + err_list
+                    for handle, errno, errmsg in finished:
+                        multi.remove_handle(handle)
+                        url = handle.url
+                        host = host_of[url]
+                        del active[url]
+                        active_per_host[host] -= 1
+                        if waiting[host] and self._max_per_host is not None\
+                            and active_per_host[host] == self._max_per_host - 1:
+                            ready_hosts.append(host)  # was full; has room now
+                        result = self._make_result(handle, errno, errmsg)
+                        handle.close()
+
+                        # if load fails, keep trying self._retries_per_trial times
+                        tries[url] += 1
+                        if result.status == LoadResult.SUCCESS or\
+                            tries[url] > self._retries_per_trial:
+                            if self._checkpoint and not primer:
+                                self._checkpoint.record(url, tag,\
+                                    len(results[url]), result)
+                            if not primer:
+                                self._record_capture_window(url, tag,\
+                                    len(results[url]), handle.start,\
+                                    time.time())
+                            results[url].append(result)
+                            tries[url] = 0
+                        if more_needed(results[url]):
+                            make_ready(url)
+                    if num_queued == 0:
+                        break
+
+                if active:
+                    multi.select(1.0)
+        finally:
+            for handle in active.values():
+                multi.remove_handle(handle)
+                handle.close()
+            multi.close()
+
+        return results
+
+    def _load_urls(self, urls):
+        '''Load every URL in `urls`, with transfers for different URLs
+        overlapping, and publish the results in input order.'''
+        # make sure URLs are well-formed and accessible over the specified
+        # protocol (availability was checked for all URLs up front)
+        urls = [self._check_url(url) for url in urls]
+        to_load = []
+        not_accessible = set()
+        for url in OrderedDict.fromkeys(urls):
+            if self._check_protocol_availability and\
+                not self._check_protocol_available(url):
+                logging.info('%s is not accessible', url)
+                not_accessible.add(url)
+            else:
+                to_load.append(url)
+
+        # Load page once before actual trials (e.g., to prime DNS cache)
+        if self._primer_load_first:
+            to_prime = [url for url in to_load if any(\
+                self._more_trials_needed(self._finished_trials(url, c['tag']))\
+                for c in self._configs)]
+            if to_prime:
+                self._load_batch(to_prime, 'primer', primer=True)
+
+        # Load URLs for each config
+        results = defaultdict(list)
+        for config in self._configs:
+            for k, v in config['settings'].iteritems():
+                self.__dict__[k] = v  # FIXME: hacky
+            tag = config['tag']
+            batch = self._load_batch(to_load, tag)
+            for url, load_results in batch.iteritems():
+                results[url] += [(tag, trial, result)\
+                    for trial, result in enumerate(load_results)]
+
+        # record results in input order, once per occurrence of each URL
+        occurrences = defaultdict(int)
+        for url in urls:
+            occurrences[url] += 1
+        for url in urls:
+            if url in not_accessible:
+                self._publish_url_results(url, [], PageResult(url,\
+                    status=PageResult.FAILURE_NOT_ACCESSIBLE))
+            else:
+                self._publish_url_results(url, results[url], PageResult(url,\
+                    load_results=[result for _, _, result in results[url]]))
+            occurrences[url] -= 1
+            if not occurrences[url]:
+                results.pop(url, None)
@@ -0,0 +1,539 @@
+import json
+import time
+import logging
+import urlparse
+import datetime
+import requests
+import websocket
+from collections import defaultdict
+from loader import TimeoutError
+from httpdate import parse_http_date
+
+# events with the raw headers a request was sent and its response received
+# with (including cookies), and the _Request attribute each is kept in
+EXTRA_INFO_EVENTS = {
+    'Network.requestWillBeSentExtraInfo': 'request_extra',
+    'Network.responseReceivedExtraInfo': 'response_extra',
+}
+
+class DevToolsError(Exception):
+    pass
+
+class DevToolsClient(object):
+    '''Minimal Chrome DevTools Protocol client that keeps one persistent
+    websocket open to a single page target.
+
+    :param port: Chrome's remote debugging port
+    :param host: host Chrome is listening on
+    :param target_id: ID of the target (tab) to attach to; if None, attach to
+        the first page target Chrome reports
+    :param timeout: default timeout (seconds) for commands
+    :param browser: attach to the browser itself rather than a page (needed
+        for Target domain commands like creating browser contexts)
+    '''
+
+    def __init__(self, port=9222, host='localhost', target_id=None, timeout=10,\
+        browser=False):
+        self._port = port
+        self._host = host
+        self._target_id = target_id
+        self._browser = browser
+        self._timeout = timeout
+        self._ws = None
+        self._next_id = 0
+        self._events = []  # events received while waiting for a command reply
+
+    @property
+    def target_id(self):
+        '''ID of the target this client is attached to.'''
+        return self._target_id
+
+    def _targets(self):
+        url = 'http://%s:%d/json' % (self._host, self._port)
+        return requests.get(url, timeout=self._timeout).json()
+
+    def connect(self):
+        '''Open the websocket to the target.'''
+        ws_url = None
+        if self._browser:
+            url = 'http://%s:%d/json/version' % (self._host, self._port)
+            ws_url = requests.get(url, timeout=self._timeout).json()\
+                .get('webSocketDebuggerUrl')
+        elif self._target_id:
+            ws_url = 'ws://%s:%d/devtools/page/%s'\
+                % (self._host, self._port, self._target_id)
+        else:
+            for target in self._targets():
+                if target.get('type') != 'page':
+                    continue
+                ws_url = target.get('webSocketDebuggerUrl')
+                self._target_id = target['id']
+                break
+        if not ws_url:
+            raise DevToolsError('No debuggable target on port %d' % self._port)
+
+        logging.debug('Connecting to DevTools target %s', ws_url)
+        self._ws = websocket.create_connection(ws_url, timeout=self._timeout)
+
+    def close(self):
+        '''Close the websocket (the target itself is left open).'''
+        if self._ws:
+            try:
+                self._ws.close()
+            except Exception as e:
+                logging.debug('Error closing DevTools websocket: %s', e)
+        self._ws = None
+        self._events = []
+
+    def _recv(self, timeout):
+        '''Read one message off the websocket; None if nothing arrived in time.'''
+        self._ws.settimeout(max(timeout, 0.001))
+        try:
+            return json.loads(self._ws.recv())
+        except websocket.WebSocketTimeoutException:
+            return None
+
+    def send(self, method, timeout=None, **params):
+        '''Issue a command and block until its reply arrives. Events received in
+        the meantime are queued for :meth:`next_event`.'''
+        if timeout is None:
+            timeout = self._timeout
+        self._next_id += 1
+        msg_id = self._next_id
+        self._ws.send(json.dumps({'id': msg_id, 'method': method, 'params': params}))
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError('Timeout waiting for reply to %s' % method)
+            msg = self._recv(remaining)
+            if msg is None:
+                continue
+            if msg.get('id') == msg_id:
+                if 'error' in msg:
+                    raise DevToolsError('%s failed: %s' % (method, msg['error']))
+                return msg.get('result', {})
+            elif 'method' in msg:
+                self._events.append(msg)
+
+    def next_event(self, timeout):
+        '''Return the next event (a dict with 'method' and 'params'), or None if
+        none arrives within `timeout` seconds.'''
+        if self._events:
+            return self._events.pop(0)
+        msg = self._recv(timeout)
+        while msg is not None and 'method' not in msg:
+            msg = self._recv(timeout)  # stray command reply; ignore
+        return msg
+
+    def drain_events(self):
+        '''Discard any queued or pending events.'''
+        self._events = []
+        while self._recv(0.001) is not None:
+            pass
+
+
+class IsolatedTab(object):
+    '''A page target in its own browser context, so it shares no cache,
+    cookies or connections with other tabs in the same Chrome, plus a
+    :class:`DevToolsClient` and :class:`HarCapture` attached to it.
+
+    :param browser: a :class:`DevToolsClient` connected with ``browser=True``
+    :param port: Chrome's remote debugging port
+    :param timeout: default timeout (seconds) for commands
+    '''
+
+    def __init__(self, browser, port=9222, host='localhost', timeout=10):
+        self._browser = browser
+        self.context_id = browser.send('Target.createBrowserContext')\
+            ['browserContextId']
+        self.target_id = browser.send('Target.createTarget', url='about:blank',\
+            browserContextId=self.context_id)['targetId']
+        self.client = DevToolsClient(port=port, host=host,\
+            target_id=self.target_id, timeout=timeout)
+        self.client.connect()
+        self.capture = HarCapture(self.client)
+
+    def close(self):
+        '''Close the tab and throw away its browser context.'''
+        self.client.close()
+        try:
+            self._browser.send('Target.closeTarget', targetId=self.target_id)
+            self._browser.send('Target.disposeBrowserContext',\
+                browserContextId=self.context_id)
+        except Exception as e:
+            logging.debug('Error closing tab %s: %s', self.target_id, e)
+
+
+def _iso_time(epoch_seconds):
+    return datetime.datetime.utcfromtimestamp(epoch_seconds)\
+        .strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def _get_header(headers, name):
+    for key, value in headers.iteritems():
+        if key.lower() == name.lower():
+            return value
+    return ''
+
+def _header_list(headers):
+    return [{'name': name, 'value': value}\
+        for name, values in headers.iteritems()\
+        for value in values.split('\n')]
+
+def _request_cookies(headers):
+    '''HAR cookies from a request's Cookie header(s).'''
+    cookies = []
+    for pair in _get_header(headers, 'Cookie').replace('\n', ';').split(';'):
+        name, _, value = pair.strip().partition('=')
+        if name or value:
+            cookies.append({'name': name, 'value': value})
+    return cookies
+
+def _response_cookies(headers):
+    '''HAR cookies from a response's Set-Cookie header(s).'''
+    cookies = []
+    for line in _get_header(headers, 'Set-Cookie').split('\n'):
+        attrs = line.split(';')
+        name, sep, value = attrs[0].strip().partition('=')
+        if not sep:
+            continue  # not a cookie (RFC 6265 5.2)
+        cookie = {'name': name, 'value': value}
+        for attr in attrs[1:]:
+            key, _, attr_value = attr.strip().partition('=')
+            key = key.lower()
+            if key in ('path', 'domain'):
+                cookie[key] = attr_value
+            elif key == 'expires':
+                expires = parse_http_date(attr_value)
+                if expires is not None:
+                    cookie['expires'] = _iso_time(expires)
+            elif key == 'httponly':
+                cookie['httpOnly'] = True
+            elif key == 'secure':
+                cookie['secure'] = True
+        cookies.append(cookie)
+    return cookies
+
+def _post_data(request):
+    '''HAR postData for a DevTools request, or None if it has no body.'''
+    if 'postData' not in request:
+        return None
+    mime_type = _get_header(request['headers'], 'Content-Type')
+    params = []
+    if mime_type.startswith('application/x-www-form-urlencoded'):
+        params = [{'name': name, 'value': value} for name, value\
+            in urlparse.parse_qsl(request['postData'], keep_blank_values=True)]
+    return {'mimeType': mime_type, 'text': request['postData'],\
+        'params': params}
+
+
+class _Request(object):
+    '''Everything we learn about one request while the page loads.'''
+
+    def __init__(self, params, wall_offset):
+        self.id = params['requestId']
+        self.request = params['request']
+        self.timestamp = params['timestamp']
+        self.wall_time = params.get('wallTime', params['timestamp'] + wall_offset)
+        self.response = None
+        self.request_extra = None  # see EXTRA_INFO_EVENTS
+        self.response_extra = None
+        self.data_length = 0
+        self.encoded_length = None
+        self.end_timestamp = None
+        self.failed = False
+        self.content = None
+
+
+class HarCapture(object):
+    '''Captures a HAR for one page load over an existing
+    :class:`DevToolsClient` connection. Entries include the cookies each
+    request sent and each response set, and POST bodies.
+
+    :param client: a connected :class:`DevToolsClient`
+    '''
+
+    def __init__(self, client):
+        self._client = client
+
+    def enable(self, disable_cache=True, disable_network_cache=False,\
+        user_agent=None):
+        '''Turn on the domains we need; call once per connection.'''
+        self._client.send('Page.enable')
+        self._client.send('Network.enable')
+        self._client.send('Network.setCacheDisabled', cacheDisabled=disable_cache)
+        if disable_network_cache:
+            self._client.send('Network.setExtraHTTPHeaders',\
+                headers={'Cache-Control': 'max-age=0'})
+        if user_agent:
+            self._client.send('Network.setUserAgentOverride', userAgent=user_agent)
+
+    def _reset(self, timeout):
+        '''Park the tab on about:blank so events from the previous page don't
+        leak into the next capture.'''
+        self._client.send('Page.navigate', url='about:blank')
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            event = self._client.next_event(deadline - time.time())
+            if event is None or event['method'] == 'Page.loadEventFired':
+                break
+        self._client.drain_events()
+
+    def capture(self, url, timeout=30, onload_delay=0, save_content=False,\
+        clear_cache=True):
+        '''Load `url` and return ``(har, final_url, load_time)``, where `har` is
+        a HAR dict and `load_time` is the onLoad time in seconds.
+
+        Raises :class:`TimeoutError` if onLoad doesn't fire within `timeout`
+        seconds and :class:`DevToolsError` if the main document fails.
+        '''
+        self._reset(timeout)
+        if clear_cache:
+            self._client.send('Network.clearBrowserCache')
+
+        requests_by_id = {}
+        order = []
+        hops = defaultdict(list)  # request ID -> _Requests, in redirect order
+        early_extra_info = defaultdict(list)  # (request ID, attr) -> params
+        main_request_id = None
+        page_start = None
+        dom_content_time = None
+        load_time = None
+        wall_offset = 0  # wall clock minus monotonic timestamp; set by first request
+
+        self._client.send('Page.navigate', url=url)
+        deadline = time.time() + timeout
+        stop_time = None
+        while True:
+            now = time.time()
+            if stop_time is not None and now >= stop_time:
+                break
+            if stop_time is None and now >= deadline:
+                raise TimeoutError('Timeout loading %s' % url)
+            wait = (stop_time if stop_time is not None else deadline) - now
+            event = self._client.next_event(wait)
+            if event is None:
+                continue
+            method = event['method']
+            params = event.get('params', {})
+
+            if method == 'Network.requestWillBeSent':
+                if page_start is None:
+                    page_start = params['timestamp']
+                    wall_offset = params.get('wallTime', time.time()) - page_start
+                    main_request_id = params['requestId']
+                req_id = params['requestId']
+                if req_id in requests_by_id and params.get('redirectResponse'):
+                    # the redirect reuses the request ID; finish the old entry
+                    prev = requests_by_id.pop(req_id)
+                    prev.response = params['redirectResponse']
+                    prev.end_timestamp = params['timestamp']
+                    prev.id = '%s-redirect-%d' % (req_id, len(order))
+                    requests_by_id[prev.id] = prev
+                req = _Request(params, wall_offset)
+                requests_by_id[req_id] = req
+                order.append(req)
+                hops[req_id].append(req)
+                for attr in EXTRA_INFO_EVENTS.values():
+                    if early_extra_info[req_id, attr]:
+                        setattr(req, attr, early_extra_info[req_id, attr].pop(0))
+            elif method in EXTRA_INFO_EVENTS:
+                # these can arrive before or after the events they go with,
+                # but in order; give each to the first hop still missing one
+                attr = EXTRA_INFO_EVENTS[method]
+                req_id = params['requestId']
+                missing = [r for r in hops[req_id] if getattr(r, attr) is None]
+                if missing:
+                    setattr(missing[0], attr, params)
+                else:
+                    early_extra_info[req_id, attr].append(params)
+            elif method == 'Network.responseReceived':
+                req = requests_by_id.get(params['requestId'])
+                if req: req.response = params['response']
+            elif method == 'Network.dataReceived':
+                req = requests_by_id.get(params['requestId'])
+                if req: req.data_length += params['dataLength']
+            elif method == 'Network.loadingFinished':
+                req = requests_by_id.get(params['requestId'])
+                if req:
+                    req.end_timestamp = params['timestamp']
+                    req.encoded_length = params.get('encodedDataLength')
+            elif method == 'Network.loadingFailed':
+                req = requests_by_id.get(params['requestId'])
+                if req:
+                    req.failed = True
+                    req.end_timestamp = params['timestamp']
+                if params['requestId'] == main_request_id and\
+                    not params.get('canceled'):
+                    raise DevToolsError('Error loading %s: %s'\
+                        % (url, params.get('errorText')))
+            elif method == 'Page.domContentEventFired':
+                dom_content_time = params['timestamp']
+            elif method == 'Page.loadEventFired' and page_start is not None:
+                load_time = params['timestamp']
+                stop_time = time.time() + onload_delay / 1000.0
+
+        # fetch bodies after onLoad so we don't perturb the load itself; Chrome
+        # leaves big POST bodies out of requestWillBeSent
+        for req in order:
+            if req.request.get('hasPostData') and 'postData' not in req.request:
+                try:
+                    req.request['postData'] = self._client.send(\
+                        'Network.getRequestPostData', requestId=req.id)['postData']
+                except DevToolsError as e:
+                    logging.debug('No POST data for %s: %s', req.request['url'], e)
+        if save_content:
+            for req in order:
+                if req.failed or not req.response or req.end_timestamp is None:
+                    continue
+                try:
+                    req.content = self._client.send('Network.getResponseBody',\
+                        requestId=req.id)
+                except DevToolsError as e:
+                    logging.debug('No body for %s: %s', req.request['url'], e)
+
+        try:
+            title = self._client.send('Runtime.evaluate',\
+                expression='document.title')['result'].get('value', '')
+        except Exception as e:
+            logging.debug('Error getting page title: %s', e)
+            title = url
+
+        final_url = url
+        main = [r for r in order if r.id == main_request_id]
+        if main:
+            final_url = main[-1].request['url']
+
+        har = self._build_har(url, title, page_start, wall_offset,\
+            dom_content_time, load_time, order)
+        return har, final_url, (load_time - page_start)
+
+    def _build_entry(self, req, url):
+        response = req.response
+        timing = response.get('timing')
+        request_time = timing['requestTime'] if timing else req.timestamp
+        end = req.end_timestamp if req.end_timestamp is not None else request_time
+
+        if timing:
+            def span(start, stop):
+                if timing[start] < 0 or timing[stop] < 0:
+                    return -1
+                return timing[stop] - timing[start]
+            starts = [timing[k] for k in ('dnsStart', 'connectStart', 'sendStart')\
+                if timing[k] >= 0]
+            blocked = starts[0] if starts else -1
+            dns = span('dnsStart', 'dnsEnd')
+            connect = span('connectStart', 'connectEnd')
+            ssl = span('sslStart', 'sslEnd')
+            send = span('sendStart', 'sendEnd')
+            wait = span('sendEnd', 'receiveHeadersEnd')
+            receive = max((end - request_time) * 1000 - timing['receiveHeadersEnd'], 0)
+        else:
+            blocked, dns, connect, ssl, send, wait = -1, -1, -1, -1, 0, 0
+            receive = max((end - req.timestamp) * 1000, 0)
+        total = sum(t for t in (blocked, dns, connect, send, wait, receive) if t > 0)
+
+        # the ExtraInfo events have the headers as sent and received; the
+        # others leave some out (e.g., Set-Cookie)
+        response_headers = response.get('headers', {})
+        headers_text = response.get('headersText')
+        if req.response_extra:
+            response_headers = req.response_extra['headers']
+            headers_text = headers_text or req.response_extra.get('headersText')
+        headers_size = len(headers_text) if headers_text else -1
+        if req.encoded_length is not None:
+            body_size = req.encoded_length - max(headers_size, 0)
+        else:
+            body_size = req.data_length
+        body_size = max(body_size, 0)
+
+        content = {'size': req.data_length,
+                   'compression': req.data_length - body_size,
+                   'mimeType': response.get('mimeType', '')}
+        if req.content:
+            content['text'] = req.content.get('body', '')
+            if req.content.get('base64Encoded'):
+                content['encoding'] = 'base64'
+
+        request_headers = response.get('requestHeaders', req.request['headers'])
+        if req.request_extra:
+            request_headers = req.request_extra['headers']
+        request_headers_text = response.get('requestHeadersText')
+
+        har_request = {
+            'method': req.request['method'],
+            'url': req.request['url'],
+            'httpVersion': response.get('protocol', 'unknown'),
+            'cookies': _request_cookies(request_headers),
+            'headers': _header_list(request_headers),
+            'queryString': [],
+            'headersSize': len(request_headers_text) if request_headers_text else -1,
+            'bodySize': len(req.request.get('postData', '')),
+        }
+        post_data = _post_data(req.request)
+        if post_data:
+            har_request['postData'] = post_data
+
+        return {
+            'pageref': url,
+            'startedDateTime': _iso_time(req.wall_time),
+            'time': total,
+            'request': har_request,
+            'response': {
+                'status': response['status'],
+                'statusText': response.get('statusText', ''),
+                'httpVersion': response.get('protocol', 'unknown'),
+                'cookies': _response_cookies(response_headers),
+                'headers': _header_list(response_headers),
+                'redirectURL': _get_header(response_headers, 'Location'),
+                'headersSize': headers_size,
+                'bodySize': body_size,
+                'content': content,
+            },
+            'cache': {},
+            'timings': {
+                'blocked': blocked,
+                'dns': dns,
+                'connect': connect,
+                'send': send,
+                'wait': wait,
+                'receive': receive,
+                'ssl': ssl,
+            },
+            'connection': str(response.get('connectionId', '')),
+        }
+
+    def _build_har(self, url, title, page_start, wall_offset, dom_content_time,\
+        load_time, order):
+        entries = []
+        for req in order:
+            if req.failed or not req.response:
+                continue
+            if req.request['url'].startswith('data:'):
+                continue  # data URIs aren't part of the HAR spec
+            try:
+                entries.append(self._build_entry(req, url))
+            except Exception as e:
+                logging.warn('Error building HAR entry for %s: %s',\
+                    req.request['url'], e)
+
+        def since_start(ts):
+            return (ts - page_start) * 1000 if ts is not None else -1
+
+        return {
+            'log': {
+                'version': '1.2',
+                'creator': {'name': 'WebLoader', 'version': '0.1'},
+                'pages': [{
+                    'startedDateTime': _iso_time(page_start + wall_offset),
+                    'id': url,
+                    'title': title,
+                    'pageTimings': {
+                        'onContentLoad': since_start(dom_content_time),
+                        'onLoad': since_start(load_time),
+                    },
+                }],
+                'entries': entries,
+            }
+        }
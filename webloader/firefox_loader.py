@@ -6,15 +6,17 @@ import logging
 import tempfile
 import platform
 from time import sleep
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, Timeout, TimeoutError, check_output,\
+    popen, kill_process_tree
+from resources import lease_display, make_profile_dir, remove_profile_dir
 from selenium import webdriver
+from selenium.webdriver.firefox.firefox_binary import FirefoxBinary
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait # available since 2.4.0
 
 FIREFOX = '/usr/bin/env firefox' if platform.system() != 'Darwin' else\
     '/Applications/Firefox.app/Contents/MacOS/firefox'
 XVFB = '/usr/bin/env Xvfb'
-DISPLAY = ':99'
 
 TIMINGS_JAVASCRIPT = '''
 var performance = window.performance || {};
@@ -37,6 +39,10 @@ class FirefoxLoader(Loader):
     .. note:: The :class:`FirefoxLoader` currently does not support saving content.
     '''
 
+    # one running Firefox (see Loader.standby_instances)
+    _backend_state = ('_xvfb_proc', '_firefox_proc', '_selenium_driver',\
+        '_display_lease', '_profile_path')
+
     def __init__(self, selenium=True, **kwargs):
         super(FirefoxLoader, self).__init__(**kwargs)
         if not self._full_page:
@@ -56,9 +62,15 @@ class FirefoxLoader(Loader):
         self._xvfb_proc = None
         self._firefox_proc = None
         self._profile_name = 'webloader'
-        self._profile_path = os.path.join(tempfile.gettempdir(),\
-            'webloader_profile')
+        self._profile_path = None
         self._selenium_driver = None
+        self._display_lease = None
+
+    def __getstate__(self):
+        '''don't try to pickle the display lease (it holds a lock file)'''
+        state = super(FirefoxLoader, self).__getstate__()
+        state.pop('_display_lease', None)
+        return state
 
     def _load_page_selenium(self, url, outdir):
         # load the specified URL (with selenium)
@@ -98,7 +110,7 @@ class FirefoxLoader(Loader):
             #firefox_cmd =  '%s -profile %s %s' % (FIREFOX, self._profile_path, url)
             logging.debug('Loading: %s', firefox_cmd)
             with Timeout(seconds=self._timeout+5):
-                subprocess.check_output(firefox_cmd.split())
+                check_output(firefox_cmd.split())
 
             # TODO: error checking
             # TODO: try to get timing info, final URL, HAR, etc.
@@ -147,7 +159,14 @@ class FirefoxLoader(Loader):
 #		profile.set_preference("network.http.spdy.enforce-tls-profile", False)
             if self._user_agent:
                 profile.set_preference("general.useragent.override", '"%s"' % self._user_agent)
-            self._selenium_driver = webdriver.Firefox(firefox_profile=profile)
+            # hand the virtual display to this Firefox only (see _setup)
+            binary = FirefoxBinary()
+            binary._firefox_env.update(self._child_env())
+            self._selenium_driver = webdriver.Firefox(firefox_profile=profile,\
+                firefox_binary=binary)
+            # our Timeout can't interrupt selenium calls, so have selenium
+            # enforce the deadline itself
+            self._selenium_driver.set_page_load_timeout(self._timeout)
         except Exception as e:
             logging.exception("Error making selenium driver")
             return False
@@ -159,10 +178,12 @@ class FirefoxLoader(Loader):
         # make firefox profile and set preferences
         try:
             # create profile
+            self._profile_path = make_profile_dir()
             create_cmd = '%s -CreateProfile "%s %s"'\
                 % (FIREFOX, self._profile_name, self._profile_path)
             logging.debug('Creating Firefox profile: %s' % create_cmd)
-            subprocess.check_output(create_cmd, shell=True)
+            subprocess.check_output(create_cmd, shell=True,\
+                env=self._child_env())
 
             # write prefs to user.js
             userjs_path = os.path.join(self._profile_path, 'user.js')
@@ -185,7 +206,8 @@ class FirefoxLoader(Loader):
         try:
             firefox_command =  '%s -profile %s' % (FIREFOX, self._profile_path)
             logging.debug('Starting Firefox: %s', firefox_command)
-            self._firefox_proc = subprocess.Popen(firefox_command.split())
+            self._firefox_proc = popen(firefox_command.split(),\
+                env=self._child_env())
             sleep(5)
         except Exception as e:
             logging.exception("Error starting Firefox")
@@ -195,19 +217,31 @@ class FirefoxLoader(Loader):
 
 
 
+    def _child_env(self):
+        '''Environment for the processes this instance starts: ours, plus
+        DISPLAY pointing at this instance's virtual display, if any.'''
+        env = dict(os.environ)
+        if self._display_lease:
+            env['DISPLAY'] = ':%d' % self._display_lease.value
+        return env
+
     def _setup(self):
         if self._headless:
             # start a virtual display
             try:
-                os.environ['DISPLAY'] = DISPLAY
-                xvfb_command = '%s %s -screen 0 1366x768x24 -ac' % (XVFB, DISPLAY)
+                # Firefox gets DISPLAY through its own environment (see
+                # _child_env), not ours: a standby instance is set up on a
+                # background thread while the live one is still loading
+                self._display_lease = lease_display()
+                display = ':%d' % self._display_lease.value
+                xvfb_command = '%s %s -screen 0 1366x768x24 -ac' % (XVFB, display)
                 logging.debug('Starting XVFB: %s', xvfb_command)
-                self._xvfb_proc = subprocess.Popen(xvfb_command.split())
+                self._xvfb_proc = popen(xvfb_command.split())
                 sleep(2)
             except Exception as e:
                 logging.exception("Error starting XFVB")
                 return False
-            logging.debug('Started XVFB (DISPLAY=%s)', os.environ['DISPLAY'])
+            logging.debug('Started XVFB (DISPLAY=%s)', display)
 
         if self._selenium:
             return self._setup_selenium()
@@ -220,17 +254,22 @@ class FirefoxLoader(Loader):
     def _teardown(self):
         if self._selenium_driver:
             self._selenium_driver.quit()
+            self._selenium_driver = None
         if self._firefox_proc:
             logging.debug('Stopping Firefox')
-            self._firefox_proc.kill()
+            kill_process_tree(self._firefox_proc)
             self._firefox_proc.wait()
+            self._firefox_proc = None
         if self._xvfb_proc:
             logging.debug('Stopping XVFB')
-            self._xvfb_proc.kill()
+            kill_process_tree(self._xvfb_proc)
             self._xvfb_proc.wait()
-
-        ## remove the firefox profile
-        #try:
-        #    shutil.rmtree(self._profile_path)
-        #except Exception as e:
-        #    logging.exception('Error removing firefox profile: %s' % e)
+            self._xvfb_proc = None
+        if self._display_lease:
+            self._display_lease.release()
+            self._display_lease = None
+
+        # remove the firefox profile
+        if self._profile_path:
+            remove_profile_dir(self._profile_path)
+            self._profile_path = None
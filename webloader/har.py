@@ -5,50 +5,329 @@ import json
 import re
 import logging
 import argparse
-import time
 import datetime
+import calendar
 import pprint
 import numpy
 from urlparse import urlparse
 from collections import defaultdict
+from cachepolicy import CachePolicy, cache_policy
 
 CACHEABLE_CATEGORIES = ('image', 'text', 'css', 'javascript', 'flash', 'pdf',\
                         'xml', 'json', 'audio', 'video', 'font')
-CACHE_CONTROL_CACHEABLE = ('public', 'max-age', 's-maxage', 'must-revalidate',\
-                           'proxy-revalidate', 'no-transform')
-CACHE_CONTROL_NOT_CACHEABLE = ('private', 'no-cache', 'no-store')
+# seconds between a first and a repeat view of a page (a minute, an hour, a
+# day, a week) at which the profile estimates cache savings
+REVISIT_INTERVALS = (60, 3600, 86400, 604800)
 
-DATE_FORMATS = ('%a, %d %b %Y %H:%M:%S %Z',
-                '%a, %d %b %Y %H:%M:%S',
-                '%m/%d/%Y %I:%M:%S %p', 
-                '%a %b %d %H:%M:%S %Z %Y', 
-                '%A, %d %b %Y %H:%M:%S %Z', 
-                '%a, %d %b %Y %H:%M:%S %Z')
+# JSON characters that matter when scanning a HAR outside / inside strings
+_STRUCTURE_CHARS = re.compile(r'["{}\[\],:]')
+_STRING_CHARS = re.compile(r'["\\]')
 
 class HarError(Exception):
     pass
 
+def _memoized(getter, slot):
+    '''A read-only property that calls `getter` on first access and keeps the
+    result in `slot`.'''
+    def get(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = getter(self)
+            setattr(self, slot, value)
+            return value
+    return property(get, doc=getter.__doc__)
+
+# header name as written -> lower-cased name, shared by every header with
+# that name (a corpus repeats the same few names over and over)
+_header_names = {}
+MAX_HEADER_NAMES = 10000  # stop remembering new names after this many
+
+def _header_name(name):
+    try:
+        return _header_names[name]
+    except KeyError:
+        lower = name.lower()
+        lower = _header_names.get(lower, lower)
+        if len(_header_names) < MAX_HEADER_NAMES:
+            _header_names[name] = _header_names[lower] = lower
+        return lower
+
+class HarHeaders(object):
+    '''The headers of a HAR request or response.
+
+    Keeps every header, in order, including repeated ones (e.g., several
+    Set-Cookie or Cache-Control headers). Names are case-insensitive and are
+    given back lower-cased. Indexing (``headers['Date']``) and :meth:`get`
+    return the first value for a name; :meth:`get_all` returns them all.
+
+    :param headers: the HAR's list of ``{'name': ..., 'value': ...}`` dicts
+    '''
+
+    __slots__ = ('_names', '_values')
+
+    def __init__(self, headers):
+        try:
+            names = _header_names
+            self._names = tuple([names[h['name']] for h in headers])
+        except KeyError:
+            self._names = tuple([_header_name(h['name']) for h in headers])
+        self._values = tuple([h['value'] for h in headers])
+
+    def get_all(self, name):
+        '''All values of header `name`, in order (empty if there are none).'''
+        name = _header_name(name)
+        names = self._names
+        if name not in names:
+            return []
+        return [value for n, value in zip(names, self._values) if n == name]
+
+    def get(self, name, default=None):
+        '''The first value of header `name`, or `default`.'''
+        try:
+            return self._values[self._names.index(_header_name(name))]
+        except ValueError:
+            return default
+
+    def get_combined(self, name):
+        '''All values of header `name` joined into one comma-separated value
+        (RFC 7230 3.2.2), or None if there are none. Not meaningful for
+        Set-Cookie.'''
+        values = self.get_all(name)
+        return ', '.join(values) if values else None
+
+    def items(self):
+        '''(name, value) for every header, in order.'''
+        return zip(self._names, self._values)
+
+    def keys(self):
+        '''The distinct header names, in order of first appearance.'''
+        names = []
+        for name in self._names:
+            if name not in names:
+                names.append(name)
+        return names
+
+    def __getitem__(self, name):
+        value = self.get(name, self)
+        if value is self:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return _header_name(name) in self._names
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._names)
+
+    def __str__(self):
+        return str(self.items())
+
+    def __repr__(self):
+        return 'HarHeaders(%r)' % self.items()
+
+def _mime_category(mime_type):
+    if 'image' in mime_type:
+        return 'image'
+    elif 'audio' in mime_type:
+        return 'audio'
+    elif 'video' in mime_type:
+        return 'video'
+    elif 'css' in mime_type:
+        return 'css'
+    elif 'html' in mime_type:
+        return 'html'
+    elif 'javascript' in mime_type:
+        return 'javascript'
+    elif any(t in mime_type for t in ['text/plain', 'text/rtf']):
+        return 'text'
+    elif 'flash' in mime_type:
+        return 'flash'
+    elif any(t in mime_type for t in ['text/xml', 'application/xml']):
+        return 'xml'
+    elif 'json' in mime_type:
+        return 'json'
+    elif 'font' in mime_type:
+        return 'font'
+    elif 'octet-stream' in mime_type:
+        return 'binary'
+    else:
+        return 'unknown'
+
+# MIME type -> category (a corpus only has so many distinct MIME types)
+_mime_categories = {}
+
+# every category _mime_category() can return
+MIME_CATEGORIES = ('image', 'audio', 'video', 'css', 'html', 'javascript',\
+                   'text', 'flash', 'xml', 'json', 'font', 'binary', 'unknown')
+
+# HAR timestamps (ISO 8601), e.g. 2016-03-01T12:00:00.123Z or ...+01:00
+_HAR_TIME = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?'\
+    r'(Z|([+-])(\d\d):?(\d\d))?$')
+
+def _har_timestamp(value):
+    '''Seconds since the epoch for a HAR timestamp, or None. Much faster than
+    strptime, which matters when there's one per entry.'''
+    m = _HAR_TIME.match(value)
+    if not m:
+        return None
+    year, month, day, hour, minute, second, fraction, zone, sign,\
+        zone_hours, zone_minutes = m.groups()
+    timestamp = calendar.timegm((int(year), int(month), int(day), int(hour),\
+        int(minute), int(second))) + (float(fraction) if fraction else 0.0)
+    if sign:
+        offset = int(zone_hours) * 3600 + int(zone_minutes) * 60
+        timestamp += -offset if sign == '+' else offset
+    return timestamp
+
+class HarReader(object):
+    '''Reads a HAR file's entries one at a time, so memory use is
+    proportional to the largest entry rather than the whole file.
+
+    Iterate over a :class:`HarReader` to get each entry's JSON (a dict).
+    Response bodies (``response.content.text``) are dropped while reading
+    unless `include_content` is set, so they're never decoded or held in
+    memory. Everything in the HAR besides the entries is available as
+    :attr:`log` once iteration finishes.
+
+    :param path: the HAR file
+    :param include_content: keep response bodies
+    :param chunk_size: how many bytes to read at a time
+    '''
+
+    def __init__(self, path, include_content=False, chunk_size=1024*1024):
+        self._path = path
+        self._include_content = include_content
+        self._chunk_size = chunk_size
+        self._log = None
+
+    def _get_log(self):
+        '''The HAR's ``log`` object, with an empty ``entries`` list (None until
+        the entries have been read).'''
+        return self._log
+    log = property(_get_log)
+
+    def __iter__(self):
+        # Scan the JSON text, tracking where we are (a stack of [container,
+        # current key] pairs). Each entry's text is collected and decoded on
+        # its own; everything else goes into a skeleton decoded at the end.
+        skeleton = []
+        entry = None
+        out = skeleton
+        stack = []
+        entries_depth = None  # len(stack) inside the log.entries array
+        expect_key = False
+        in_string = is_key = skipping = escape = False
+        key = []
+
+        with open(self._path, 'r') as f:
+            for chunk in iter(lambda: f.read(self._chunk_size), ''):
+                pos = 0
+                end = len(chunk)
+                while pos < end:
+                    if in_string:
+                        if escape:
+                            if not skipping:
+                                out.append(chunk[pos])
+                                if is_key: key.append(chunk[pos])
+                            pos += 1
+                            escape = False
+                            continue
+                        m = _STRING_CHARS.search(chunk, pos)
+                        stop = m.start() + 1 if m else end
+                        if not skipping:
+                            out.append(chunk[pos:stop])
+                            if is_key: key.append(chunk[pos:stop])
+                        pos = stop
+                        if m and m.group() == '\\':
+                            escape = True
+                        elif m:
+                            in_string = False
+                            if is_key:
+                                stack[-1][1] = ''.join(key)[:-1]
+                            skipping = False
+                        continue
+
+                    m = _STRUCTURE_CHARS.search(chunk, pos)
+                    if not m:
+                        out.append(chunk[pos:])
+                        break
+                    out.append(chunk[pos:m.start()])
+                    pos = m.end()
+                    c = m.group()
+
+                    if c == '"':
+                        in_string = True
+                        is_key = bool(stack) and stack[-1][0] == '{' and expect_key
+                        key = []
+                        if not is_key and not self._include_content and\
+                            entries_depth is not None and\
+                            len(stack) == entries_depth + 3 and\
+                            [s[1] for s in stack[-3:]] == ['response', 'content', 'text']:
+                            skipping = True
+                            out.append('null')
+                        else:
+                            out.append(c)
+                    elif c == ':':
+                        expect_key = False
+                        out.append(c)
+                    elif c == ',':
+                        expect_key = stack[-1][0] == '{'
+                        if len(stack) != entries_depth:
+                            out.append(c)  # (commas between entries are dropped)
+                    elif c in '{[':
+                        if c == '{' and len(stack) == entries_depth:
+                            entry = out = []
+                        stack.append([c, None])
+                        expect_key = c == '{'
+                        out.append(c)
+                        if c == '[' and len(stack) == 3 and stack[0][1] == 'log'\
+                            and stack[1][1] == 'entries':
+                            entries_depth = len(stack)
+                    else:  # } or ]
+                        out.append(c)
+                        stack.pop()
+                        expect_key = False
+                        if len(stack) == entries_depth and entry is not None:
+                            out = skeleton
+                            entry_json = json.loads(''.join(entry))
+                            entry = None
+                            if not self._include_content:
+                                entry_json.get('response', {})\
+                                    .get('content', {}).pop('text', None)
+                            yield entry_json
+                        elif entries_depth is not None and\
+                            len(stack) < entries_depth:
+                            entries_depth = None
+
+        self._log = json.loads(''.join(skeleton))['log']
+
 class HarObject(object):
-    '''Encapsulates a single HAR request'''
+    '''Encapsulates a single HAR request
+
+    Derived fields (headers, URL parts, category, cacheability) are worked out
+    the first time they're used and then remembered.
+    '''
+
+    __slots__ = ('json', '_request_headers', '_response_headers', '_parsed_url',\
+        '_protocol', '_category', '_explicitly_cacheable', '_cache_policy',\
+        '_shared_cache_policy', '_response_time')
 
     def __init__(self, object_json):
         self.json = object_json
 
-        def process_headers(headers):
-            # FIXME: don't discard multiple headers of same type
-            header_dict = {}
-            for header in headers:
-                if header['name'] in header_dict:
-                    logging.getLogger(__name__)\
-                        .debug('Header "%s" already exists in this response.',
-                        header['name'])
-                else:
-                    header_dict[header['name']] = header['value']
-            return header_dict
-
-        # make dicts for request and response headers
-        self.request_headers = process_headers(self.json['request']['headers'])
-        self.response_headers = process_headers(self.json['response']['headers'])
+    def _get_request_headers(self):
+        '''The request's headers (a :class:`HarHeaders`).'''
+        return HarHeaders(self.json['request']['headers'])
+    request_headers = _memoized(_get_request_headers, '_request_headers')
+
+    def _get_response_headers(self):
+        '''The response's headers (a :class:`HarHeaders`).'''
+        return HarHeaders(self.json['response']['headers'])
+    response_headers = _memoized(_get_response_headers, '_response_headers')
 
     def sanity_check(self, print_report=True):
         report = ''
@@ -82,45 +361,30 @@ class HarObject(object):
     mime_type = property(_get_mime_type)
 
     def _get_category(self):
-        if 'image' in self.mime_type:
-            return 'image'
-        elif 'audio' in self.mime_type:
-            return 'audio'
-        elif 'video' in self.mime_type:
-            return 'video'
-        elif 'css' in self.mime_type:
-            return 'css'
-        elif 'html' in self.mime_type:
-            return 'html'
-        elif 'javascript' in self.mime_type:
-            return 'javascript'
-        elif any(t in self.mime_type for t in ['text/plain', 'text/rtf']):
-            return 'text'
-        elif 'flash' in self.mime_type:
-            return 'flash'
-        elif any(t in self.mime_type for t in ['text/xml', 'application/xml']):
-            return 'xml'
-        elif 'json' in self.mime_type:
-            return 'json'
-        elif 'font' in self.mime_type:
-            return 'font'
-        elif 'octet-stream' in self.mime_type:
-            return 'binary'
-        else:
-            return 'unknown'
-    category = property(_get_category)
+        mime_type = self.mime_type
+        try:
+            return _mime_categories[mime_type]
+        except KeyError:
+            category = _mime_categories[mime_type] = _mime_category(mime_type)
+            return category
+    category = _memoized(_get_category, '_category')
 
     @property
     def url(self):
         return self.json['request']['url']
 
+    def _get_parsed_url(self):
+        '''The URL, split up by :func:`urlparse.urlparse`.'''
+        return urlparse(self.url)
+    parsed_url = _memoized(_get_parsed_url, '_parsed_url')
+
     @property
     def host(self):
-        return urlparse(self.url).netloc
+        return self.parsed_url.netloc
 
     @property
     def path(self):
-        return urlparse(self.url).path
+        return self.parsed_url.path
 
     @property
     def filename(self):
@@ -128,7 +392,7 @@ class HarObject(object):
 
     def _get_protocol(self):
         return self.url.split('://')[0]
-    protocol = property(_get_protocol)
+    protocol = _memoized(_get_protocol, '_protocol')
 
     @property
     def response_code(self):
@@ -180,55 +444,73 @@ class HarObject(object):
     response_body_size = property(_get_body_size)
     body_size = property(_get_body_size)
 
-    def _get_explicitly_cacheable(self):
-        '''Based on response headers, is this cacheable?'''
+    def _get_response_time(self):
+        '''When the response finished arriving (seconds since the epoch), or
+        None if the HAR doesn't say.'''
         try:
-            if 'Expires' in self.response_headers:
-                if self.response_headers['Expires'] in ['0', '-1']:
-                    return False
-                elif 'Date' in self.response_headers:
-                    expires_str = self.response_headers['Expires'].replace('-', ' ')
-                    for fmt in DATE_FORMATS:
-                        try:
-                            expires = time.strptime(expires_str, fmt)
-                        except ValueError:
-                            pass
-                        else:
-                            break  # if we parsed date successfully, stop tyring more formats
-                    else:  # no format succeeded
-                        logging.warn('Error parsing date: %s' % expires_str)
-                        return False
-                    
-                    date_str = self.response_headers['Date'][:-4].replace('-', ' ')
-                    for fmt in DATE_FORMATS:
-                        try:
-                            date = time.strptime(date_str, fmt)
-                        except ValueError:
-                            pass
-                        else:
-                            break  # if we parsed date successfully, stop tyring more formats
-                    else:  # no format succeeded
-                        logging.warn('Error parsing date: %s' % date_str)
-                        return False
-                        
-                    return expires > date
-            elif 'Cache-Control' in self.response_headers:
-                if any(t in self.response_headers['Cache-Control'] for t in CACHE_CONTROL_NOT_CACHEABLE):
-                    return False
-                elif 'max-age=' in self.response_headers['Cache-Control']:
-                    max_age = int(self.response_headers['Cache-Control'].split('max-age=')[-1].split(',')[0])
-                    return max_age > 0
-                elif 's-maxage=' in self.response_headers['Cache-Control']:
-                    max_age = int(self.response_headers['Cache-Control'].split('s-maxage=')[1].split(',')[0])
-                    return max_age > 0
-                elif any(t in self.response_headers['Cache-Control'] for t in CACHE_CONTROL_CACHEABLE):
-                    return True
-            else:
-                return False
+            start = _har_timestamp(self.json['startedDateTime'])
+            if start is not None:
+                return start + float(self.json['time']) / 1000.0
+        except (KeyError, TypeError, ValueError):
+            pass
+        return None
+    response_time = _memoized(_get_response_time, '_response_time')
+
+    def _policy(self, shared):
+        try:
+            return cache_policy(self.response_headers,\
+                status=self.response_code,\
+                request_headers=self.request_headers,\
+                method=self.json['request'].get('method', 'GET'),\
+                response_time=self.response_time, shared=shared)
         except Exception as e:
-            logging.warn('Error parsing Cache-Control or Expires header: %s', e)
-        return False  # if there was an error, just say not cacheable
-    explicitly_cacheable = property(_get_explicitly_cacheable) 
+            logging.warn('Error working out cache policy for %s: %s', self.url, e)
+            return CachePolicy()  # if there was an error, just say not cacheable
+
+    def _get_cache_policy(self):
+        '''How a browser cache may reuse this response (a
+        :class:`cachepolicy.CachePolicy`).'''
+        return self._policy(shared=False)
+    cache_policy = _memoized(_get_cache_policy, '_cache_policy')
+
+    def _get_shared_cache_policy(self):
+        '''How a shared cache (e.g., a CDN or proxy) may reuse this response
+        (a :class:`cachepolicy.CachePolicy`).'''
+        return self._policy(shared=True)
+    shared_cache_policy = _memoized(_get_shared_cache_policy, '_shared_cache_policy')
+
+    def _get_freshness_lifetime(self):
+        '''Seconds a browser cache may reuse this response without checking
+        with the server (0 if it can't store it).'''
+        policy = self.cache_policy
+        if not policy.storable or policy.no_cache:
+            return 0
+        return max(policy.freshness_lifetime - policy.age, 0)
+    freshness_lifetime = property(_get_freshness_lifetime)
+
+    def _get_revalidatable(self):
+        '''Does the response have a validator (ETag or Last-Modified)?'''
+        return self.cache_policy.revalidatable
+    revalidatable = property(_get_revalidatable)
+
+    def _get_private_cacheable(self):
+        '''May a browser cache store this response?'''
+        return self.cache_policy.storable
+    private_cacheable = property(_get_private_cacheable)
+
+    def _get_shared_cacheable(self):
+        '''May a shared cache store this response?'''
+        return self.shared_cache_policy.storable
+    shared_cacheable = property(_get_shared_cacheable)
+
+    def _get_explicitly_cacheable(self):
+        '''Based on response headers, is this cacheable? That is, does the
+        server give it a freshness lifetime (Cache-Control or Expires) a
+        browser cache can use?'''
+        policy = self.cache_policy
+        return policy.storable and not policy.heuristic and\
+            not policy.no_cache and policy.freshness_lifetime > 0
+    explicitly_cacheable = _memoized(_get_explicitly_cacheable, '_explicitly_cacheable')
 
     def _get_implicitly_cacheable(self):
         '''Based on MIME type, do we think this is cacheable?'''
@@ -250,20 +532,35 @@ class HarObject(object):
 
 
 class Har(object):
-    '''Encapsulates an HTTP Archive (HAR)'''
-
-    def __init__(self, har_json):
+    '''Encapsulates an HTTP Archive (HAR)
+
+    :param har_json: the decoded HAR
+    :param keep_objects: keep a :class:`HarObject` for every entry (needed
+        for :attr:`objects`, :meth:`get_objects` and :meth:`sanity_check`);
+        the summary stats (e.g., :attr:`profile`) don't need them
+    :param revisit_intervals: seconds after this load at which to estimate
+        how many bytes a repeat view would get from cache
+    '''
+
+    def __init__(self, har_json, keep_objects=True,\
+        revisit_intervals=REVISIT_INTERVALS):
         if har_json['log']['pages'] == [] or har_json['log']['entries'] == []:
             raise HarError('HAR is empty: %s' % har_json)
 
-        self.data = har_json
+        self._reset(keep_objects, revisit_intervals)
+        self._set_log(har_json)
+        for obj_json in self.data['log']['entries']:
+            self._add_entry(obj_json)
+
+    def _reset(self, keep_objects, revisit_intervals=REVISIT_INTERVALS):
+        self._keep_objects = keep_objects
+        self._revisit_intervals = tuple(revisit_intervals)
         self.objects = []  # all objects, in order
         self.object_lists = defaultdict(list)
+        self._type_counts = defaultdict(int)  # category -> number of objects
+        self._type_bytes = defaultdict(int)  # category -> content bytes
         self._sizes = []  # all object sizes, for computing mean/median
         self._hosts = set()
-        self.page_start_time = datetime.datetime.strptime(\
-            self.data['log']['pages'][0]['startedDateTime'],\
-            '%Y-%m-%dT%H:%M:%S.%fZ')
 
         self._num_objects = 0
         self._num_bytes = 0
@@ -271,6 +568,12 @@ class Har(object):
         self._num_implicitly_cacheable_objects = 0
         self._num_explicitly_cacheable_bytes = 0
         self._num_implicitly_cacheable_bytes = 0
+        self._num_body_bytes = 0
+        # revisit interval -> body bytes a browser cache could reuse as-is /
+        # after revalidating, and that a shared cache could reuse as-is
+        self._repeat_view_fresh_bytes = defaultdict(int)
+        self._repeat_view_revalidated_bytes = defaultdict(int)
+        self._shared_cache_fresh_bytes = defaultdict(int)
         self._num_http_objects = 0
         self._num_https_objects = 0
         self._num_tcp_handshakes = 0
@@ -280,45 +583,73 @@ class Har(object):
         self._total_handshake_ms = 0
         self._version_counts = defaultdict(int)  # http version -> count
 
-        for obj_json in self.data['log']['entries']:
-            try:
-                obj = HarObject(obj_json)
-                if not obj.sanity_check(print_report=False): continue
-                #print '%d\t%s (%s)\t%s' % (obj.content_size, obj.mime_type, obj.category, obj.domain)
+    def _set_log(self, har_json):
+        self.data = har_json
+        self.page_start_time = datetime.datetime.strptime(\
+            self.data['log']['pages'][0]['startedDateTime'],\
+            '%Y-%m-%dT%H:%M:%S.%fZ')
 
+    def _add_entry(self, obj_json):
+        try:
+            obj = HarObject(obj_json)
+            if not obj.sanity_check(print_report=False): return
+            #print '%d\t%s (%s)\t%s' % (obj.content_size, obj.mime_type, obj.category, obj.domain)
+
+            if self._keep_objects:
                 self.objects.append(obj)
                 self.object_lists[obj.category].append(obj)
-                self._sizes.append(obj.content_size)
-                self._hosts.add(obj.host)
-
-                self._num_objects += 1
-                self._num_bytes += obj.content_size
-
-                if obj.protocol == 'http':
-                    self._num_http_objects += 1
-                elif obj.protocol == 'https':
-                    self._num_https_objects += 1
-
-                if obj.explicitly_cacheable:
-                    self._num_explicitly_cacheable_objects += 1
-                    self._num_explicitly_cacheable_bytes += obj.body_size
-                if obj.implicitly_cacheable:
-                    self._num_implicitly_cacheable_objects += 1
-                    self._num_implicitly_cacheable_bytes += obj.body_size
-                if obj.tcp_handshake:
-                    self._num_tcp_handshakes += 1
-                if obj.ssl_handshake:
-                    self._num_ssl_handshakes += 1
-                if obj.timings['connect'] >= 0:
-                    self._total_tcp_handshake_ms += obj.timings['connect']
-                    self._total_handshake_ms += obj.timings['connect']
-                if obj.timings['ssl'] >= 0:
-                    self._total_ssl_handshake_ms += obj.timings['ssl']
-                    self._total_handshake_ms += obj.timings['ssl']
-                
-                self._version_counts[obj.response_http_version] += 1
-            except Exception as e:
-                logging.warn('Error parsing HAR object:%s\n%s', e, obj_json)
+            category = obj.category
+            content_size = obj.content_size
+            self._type_counts[category] += 1
+            self._type_bytes[category] += content_size
+            self._sizes.append(content_size)
+            self._hosts.add(obj.host)
+
+            self._num_objects += 1
+            self._num_bytes += content_size
+
+            protocol = obj.protocol
+            if protocol == 'http':
+                self._num_http_objects += 1
+            elif protocol == 'https':
+                self._num_https_objects += 1
+
+            if obj.explicitly_cacheable:
+                self._num_explicitly_cacheable_objects += 1
+                self._num_explicitly_cacheable_bytes += obj.body_size
+            if obj.implicitly_cacheable:
+                self._num_implicitly_cacheable_objects += 1
+                self._num_implicitly_cacheable_bytes += obj.body_size
+
+            body_size = max(obj.body_size, 0)
+            self._num_body_bytes += body_size
+            policy = obj.cache_policy
+            shared_policy = obj.shared_cache_policy
+            for interval in self._revisit_intervals:
+                reuse = policy.reuse_after(interval)
+                if reuse == CachePolicy.FRESH:
+                    self._repeat_view_fresh_bytes[interval] += body_size
+                elif reuse == CachePolicy.REVALIDATE:
+                    self._repeat_view_revalidated_bytes[interval] += body_size
+                if shared_policy.fresh_after(interval):
+                    self._shared_cache_fresh_bytes[interval] += body_size
+
+            connect = obj.timings['connect']
+            ssl = obj.timings['ssl']
+            if connect > 0:
+                self._num_tcp_handshakes += 1
+            if ssl > 0:
+                self._num_ssl_handshakes += 1
+            if connect >= 0:
+                self._total_tcp_handshake_ms += connect
+                self._total_handshake_ms += connect
+            if ssl >= 0:
+                self._total_ssl_handshake_ms += ssl
+                self._total_handshake_ms += ssl
+            
+            self._version_counts[obj.response_http_version] += 1
+        except Exception as e:
+            logging.warn('Error parsing HAR object:%s\n%s', e, obj_json)
 
 
     def sanity_check(self):
@@ -326,11 +657,35 @@ class Har(object):
             obj.sanity_check()
 
     @classmethod
-    def from_file(cls, path):
-        with open(path, 'r') as f:
-            data = json.load(f)
-        f.closed
-        return Har(data)
+    def from_file(cls, path, stream=False, revisit_intervals=REVISIT_INTERVALS,\
+        keep_objects=True):
+        '''Read a HAR file.
+
+        :param stream: read entries one at a time (see :class:`HarReader`)
+            and don't keep a :class:`HarObject` for each, so memory use stays
+            proportional to one entry; as with ``keep_objects=False``, only
+            the summary stats are available
+        :param revisit_intervals: see :class:`Har`
+        :param keep_objects: see :class:`Har` (always False if streaming)
+        '''
+        if not stream:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            f.closed
+            return Har(data, keep_objects=keep_objects,\
+                revisit_intervals=revisit_intervals)
+
+        har = cls.__new__(cls)
+        har._reset(keep_objects=False, revisit_intervals=revisit_intervals)
+        reader = HarReader(path)
+        num_entries = 0
+        for obj_json in reader:
+            har._add_entry(obj_json)
+            num_entries += 1
+        if reader.log['pages'] == [] or num_entries == 0:
+            raise HarError('HAR is empty: %s' % path)
+        har._set_log({'log': reader.log})
+        return har
 
     @classmethod
     def sanitize_url(cls, url):
@@ -363,7 +718,7 @@ class Har(object):
         return float(self.data['log']['pages'][0]['pageTimings']['onContentLoad'])
 
     def _get_file_types(self):
-        return self.object_lists.keys()
+        return self._type_counts.keys()
     file_types = property(_get_file_types)
 
     def get_objects(self, obj_type):
@@ -378,14 +733,11 @@ class Har(object):
     num_hosts = property(_get_num_hosts)
 
     def get_num_objects_by_type(self, obj_type):
-        return len(self.object_lists[obj_type])
+        return self._type_counts.get(obj_type, 0)
 
     def get_num_bytes_by_type(self, obj_type):
         ''' Returns total size, in bytes, of all objects of the specified type'''
-        size = 0
-        for obj in self.object_lists[obj_type]:
-            size += obj.content_size
-        return size
+        return self._type_bytes.get(obj_type, 0)
 
     def _get_num_objects(self):
         return self._num_objects
@@ -423,6 +775,36 @@ class Har(object):
         return self._num_implicitly_cacheable_bytes
     num_implicitly_cacheable_bytes = property(_get_num_implicitly_cacheable_bytes)
 
+    def _get_revisit_intervals(self):
+        return self._revisit_intervals
+    revisit_intervals = property(_get_revisit_intervals)
+
+    def _get_num_body_bytes(self):
+        '''Total response body bytes (as transferred, possibly compressed)'''
+        return self._num_body_bytes
+    num_body_bytes = property(_get_num_body_bytes)
+
+    def get_repeat_view_fresh_bytes(self, interval):
+        '''Body bytes a repeat view `interval` seconds later could take from
+        the browser cache without contacting the server.'''
+        return self._repeat_view_fresh_bytes.get(interval, 0)
+
+    def get_repeat_view_revalidated_bytes(self, interval):
+        '''Body bytes a repeat view `interval` seconds later could take from
+        the browser cache after a conditional request (e.g., a 304).'''
+        return self._repeat_view_revalidated_bytes.get(interval, 0)
+
+    def get_repeat_view_bytes_saved(self, interval):
+        '''Body bytes a repeat view `interval` seconds later wouldn't need to
+        download, thanks to the browser cache.'''
+        return self.get_repeat_view_fresh_bytes(interval) +\
+            self.get_repeat_view_revalidated_bytes(interval)
+
+    def get_shared_cache_fresh_bytes(self, interval):
+        '''Body bytes a shared cache (e.g., a CDN) could still serve without
+        contacting the origin `interval` seconds later.'''
+        return self._shared_cache_fresh_bytes.get(interval, 0)
+
     def _get_num_http_objects(self):
         return self._num_http_objects
     num_http_objects = property(_get_num_http_objects)
@@ -480,6 +862,22 @@ class Har(object):
         profile['percentage-implicitly-cacheable-bytes'] = \
             self.num_implicitly_cacheable_bytes / float(self.num_bytes)\
             if self.num_bytes else 0
+        profile['num-body-bytes'] = self.num_body_bytes
+        for key in ('repeat-view-fresh-bytes', 'repeat-view-revalidated-bytes',\
+            'repeat-view-bytes-saved', 'percentage-repeat-view-bytes-saved',\
+            'shared-cache-fresh-bytes'):
+            profile[key] = {}
+        for interval in self.revisit_intervals:
+            saved = self.get_repeat_view_bytes_saved(interval)
+            profile['repeat-view-fresh-bytes'][interval] =\
+                self.get_repeat_view_fresh_bytes(interval)
+            profile['repeat-view-revalidated-bytes'][interval] =\
+                self.get_repeat_view_revalidated_bytes(interval)
+            profile['repeat-view-bytes-saved'][interval] = saved
+            profile['percentage-repeat-view-bytes-saved'][interval] =\
+                saved / float(self.num_body_bytes) if self.num_body_bytes else 0
+            profile['shared-cache-fresh-bytes'][interval] =\
+                self.get_shared_cache_fresh_bytes(interval)
         return profile
     profile = property(_get_profile)
 
@@ -492,11 +890,8 @@ class Har(object):
 
 
 def main():
-    with open(args.har, 'r') as f:
-        data = json.load(f)
-    f.closed
-    
-    h = Har(data)
+    h = Har.from_file(args.har, stream=args.stream and not args.sanity_check,\
+        revisit_intervals=args.revisit)
 
     if args.sanity_check:
         h.sanity_check()
@@ -510,6 +905,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Analyze a HAR file.')
     parser.add_argument('har', help='HAR file to analyze')
     parser.add_argument('-s', '--sanity_check', action='store_true', default=False, help='Check for problems in the HAR file')
+    parser.add_argument('-t', '--stream', action='store_true', default=False, help='Read entries one at a time, skipping response bodies (for very large HARs; ignored with -s)')
+    parser.add_argument('-r', '--revisit', type=int, nargs='+', default=REVISIT_INTERVALS, help='Seconds after the load at which to estimate repeat-view cache savings')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
     args = parser.parse_args()
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+import csv
+import time
+import signal
+import logging
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from har import Har, MIME_CATEGORIES, REVISIT_INTERVALS
+
+# <sanitized URL>[<config tag>][_trial<N>].har, as named by Loader._outfile_path
+HAR_FILENAME = re.compile(r'^(?P<name>.*?)(?:<(?P<tag>[^<>]*)>)?'\
+    r'(?:_trial(?P<trial>\d+))?\.har$')
+PROGRESS_INTERVAL = 1000  # log throughput every this many HARs
+
+
+def parse_har_filename(path):
+    '''The (config tag, trial number) in the name of a HAR saved by a
+    :class:`loader.Loader`; either is None if the name doesn't have one.'''
+    m = HAR_FILENAME.match(os.path.basename(path))
+    if not m:
+        return None, None
+    trial = m.group('trial')
+    return m.group('tag'), int(trial) if trial is not None else None
+
+def find_har_files(paths):
+    '''The HAR files in `paths` (files, or directories searched recursively
+    for \\*.har), in sorted order within each directory.'''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith('.har'):
+                    yield os.path.join(dirpath, filename)
+
+def profile_row(profile):
+    '''Flatten a :attr:`har.Har.profile` into an ordered dict with one
+    column per value. Nested dicts become one column per key ("key:subkey");
+    per-type counts get a column for every category, so every HAR's row has
+    the same columns.'''
+    row = OrderedDict()
+    for key in sorted(profile):
+        value = profile[key]
+        if isinstance(value, dict):
+            subkeys = MIME_CATEGORIES if key.endswith('-by-type')\
+                else sorted(value)
+            for subkey in subkeys:
+                row['%s:%s' % (key, subkey)] = value.get(subkey, 0)
+        else:
+            row[key] = value
+    return row
+
+def profile_file(path, stream=False, revisit_intervals=REVISIT_INTERVALS):
+    '''Analyze one HAR file. Returns its row in the corpus table: the page
+    URL, config tag, trial number and path, then its :func:`profile_row`.'''
+    har = Har.from_file(path, stream=stream, keep_objects=False,\
+        revisit_intervals=revisit_intervals)
+    tag, trial = parse_har_filename(path)
+    row = OrderedDict()
+    row['url'] = har.url
+    row['tag'] = tag
+    row['trial'] = trial
+    row['path'] = path
+    row.update(profile_row(har.profile))
+    return row
+
+def _profile_file_task(task):
+    # runs in a worker: never raise, so one bad HAR can't stop the pool
+    path, stream, revisit_intervals = task
+    try:
+        return path, profile_file(path, stream, revisit_intervals), None
+    except Exception as e:
+        return path, None, '%s: %s' % (type(e).__name__, e)
+
+def _profile_files_task(tasks):
+    return [_profile_file_task(task) for task in tasks]
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _ignore_sigint():
+    # let the parent handle Ctrl-C (and terminate the pool)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def analyze_corpus(paths, processes=None, stream=False,\
+    revisit_intervals=REVISIT_INTERVALS, chunksize=8):
+    '''Analyze many HAR files in a pool of worker processes. Yields
+    (path, row, error) for each file, in the order of `paths`, as results
+    come in; `row` (see :func:`profile_file`) is None if the file couldn't be
+    analyzed, in which case `error` says why.
+
+    :param paths: HAR file paths
+    :param processes: number of worker processes (default: one per CPU);
+        with 1, files are analyzed in this process
+    :param stream: read each HAR with :class:`har.HarReader` (for HARs too
+        big to load at once)
+    :param revisit_intervals: see :class:`har.Har`
+    :param chunksize: files handed to a worker at a time
+    '''
+    tasks = ((path, stream, revisit_intervals) for path in paths)
+    if processes == 1:
+        for task in tasks:
+            yield _profile_file_task(task)
+        return
+
+    pool = multiprocessing.Pool(processes, initializer=_ignore_sigint)
+    finished = False
+    try:
+        # batch tasks ourselves: with a chunksize, imap() doesn't give back an
+        # iterator that can wait with a timeout, which keeps Ctrl-C working
+        results = pool.imap(_profile_files_task, _batches(tasks, chunksize))
+        while True:
+            try:
+                batch = results.next(1)
+            except multiprocessing.TimeoutError:
+                continue
+            except StopIteration:
+                break
+            for result in batch:
+                yield result
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+def _csv_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def main():
+    paths = list(find_har_files(args.paths))
+    logging.info('Analyzing %d HARs', len(paths))
+
+    out = open(args.output, 'wb') if args.output else sys.stdout
+    writer = None
+    num_analyzed = 0
+    num_failed = 0
+    start = time.time()
+    try:
+        for path, row, error in analyze_corpus(paths, processes=args.processes,\
+            stream=args.stream, revisit_intervals=args.revisit):
+            if row is None:
+                num_failed += 1
+                logging.warn('Error analyzing %s: %s', path, error)
+                continue
+            if writer is None:
+                columns = row.keys()
+                writer = csv.writer(out)
+                writer.writerow(columns)
+            writer.writerow([_csv_value(row.get(c)) for c in columns])
+            num_analyzed += 1
+            if num_analyzed % PROGRESS_INTERVAL == 0:
+                logging.info('Analyzed %d HARs (%.1f HARs/s)', num_analyzed,\
+                    num_analyzed / (time.time() - start))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.time() - start
+    logging.info('Analyzed %d HARs (%d failed) in %.1f s: %.1f HARs/s',\
+        num_analyzed, num_failed, elapsed,\
+        (num_analyzed + num_failed) / elapsed if elapsed else 0)
+
+
+if __name__ == '__main__':
+    # set up command line args
+    parser = argparse.ArgumentParser(description='Analyze a corpus of HAR files (e.g., from har_generator.py) in parallel, writing one CSV row per HAR.')
+    parser.add_argument('paths', nargs='+', help='HAR files, or directories to search for them')
+    parser.add_argument('-o', '--output', default=None, help='CSV file to write (default: stdout)')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='Number of worker processes (default: one per CPU)')
+    parser.add_argument('-t', '--stream', action='store_true', default=False, help='Read entries one at a time, skipping response bodies (for very large HARs)')
+    parser.add_argument('-r', '--revisit', type=int, nargs='+', default=REVISIT_INTERVALS, help='Seconds after the load at which to estimate repeat-view cache savings')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()
@@ -0,0 +1,130 @@
+import re
+import time
+import calendar
+
+# other formats seen in the wild, tried (slowly) if a date isn't in one of
+# the RFC 7231 formats
+DATE_FORMATS = ('%a, %d %b %Y %H:%M:%S %Z',
+                '%a, %d %b %Y %H:%M:%S',
+                '%m/%d/%Y %I:%M:%S %p',
+                '%a %b %d %H:%M:%S %Z %Y',
+                '%A, %d %b %Y %H:%M:%S %Z',
+                '%a, %d %b %Y %H:%M:%S %Z')
+
+CACHE_SIZE = 4096  # distinct date strings to remember
+
+MONTHS = dict((name, number) for number, name in enumerate(('jan', 'feb',\
+    'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1))
+
+# IMF-fixdate ("Sun, 06 Nov 1994 08:49:37 GMT") and the obsolete RFC 850
+# format ("Sunday, 06-Nov-94 08:49:37 GMT"), leniently
+_RFC1123_OR_850 = re.compile(r'\s*(?:[A-Za-z]+,?\s*)?(\d{1,2})[\s-]+([A-Za-z]{3})'\
+    r'[A-Za-z]*[\s-]+(\d{2}|\d{4})\s+(\d{1,2}):(\d{2}):(\d{2})'\
+    r'(?:\s*(?:GMT|UTC|UT|Z|[+-]00:?00))?\s*$')
+# asctime() ("Sun Nov  6 08:49:37 1994")
+_ASCTIME = re.compile(r'\s*[A-Za-z]+\s+([A-Za-z]{3})\s+(\d{1,2})\s+'\
+    r'(\d{1,2}):(\d{2}):(\d{2})\s+(\d{4})\s*$')
+
+
+def _timestamp(year, month, day, hour, minute, second):
+    # reject impossible dates like 31 Feb (timegm would roll them over)
+    if not 1 <= month <= 12 or\
+        not 1 <= day <= calendar.monthrange(year, month)[1] or hour > 23 or\
+        minute > 59 or second > 60:
+        return None
+    return calendar.timegm((year, month, day, hour, minute, second))
+
+def _full_year(year):
+    '''RFC 7231 7.1.1.1: a two-digit year more than 50 years in the future is
+    in the past.'''
+    this_year = time.gmtime().tm_year
+    year += this_year - this_year % 100
+    if year > this_year + 50:
+        year -= 100
+    return year
+
+def _parse(value):
+    m = _RFC1123_OR_850.match(value)
+    if m:
+        day, month, year, hour, minute, second = m.groups()
+        month = MONTHS.get(month.lower())
+        if month:
+            year = int(year) if len(year) == 4 else _full_year(int(year))
+            return _timestamp(year, month, int(day), int(hour), int(minute),\
+                int(second))
+
+    m = _ASCTIME.match(value)
+    if m:
+        month, day, hour, minute, second, year = m.groups()
+        month = MONTHS.get(month.lower())
+        if month:
+            return _timestamp(int(year), month, int(day), int(hour),\
+                int(minute), int(second))
+
+    for fmt in DATE_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    return None
+
+
+class _LRUCache(object):
+    '''Remembers values for recently used keys, dropping the least recently
+    used first. It's approximate, to keep lookups down to a dict lookup or
+    two: keys are kept in a "recent" generation, which becomes the "old"
+    generation when it reaches `size` keys (and the previous old generation is
+    dropped); keys found in the old generation are moved back to the recent
+    one. So keys used in the last `size` lookups are always kept, and at most
+    2 * `size` are.
+
+    Safe to share between threads (at worst a key is looked up again).
+    '''
+
+    def __init__(self, size):
+        self._size = size
+        self._recent = {}
+        self._old = {}
+
+    def get(self, key, default=None):
+        try:
+            return self._recent[key]
+        except KeyError:
+            pass
+        try:
+            value = self._old[key]
+        except KeyError:
+            return default
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        recent = self._recent
+        recent[key] = value
+        if len(recent) >= self._size:
+            self._old = recent
+            self._recent = {}
+
+    def clear(self):
+        self._recent = {}
+        self._old = {}
+
+_cache = _LRUCache(CACHE_SIZE)
+_UNPARSEABLE = object()  # cached for values we couldn't parse
+
+
+def parse_http_date(value):
+    '''Parse an HTTP date (e.g., from a Date or Expires header). Returns
+    seconds since the epoch (UTC), or None if `value` isn't a date.
+
+    Handles the three formats in RFC 7231 (IMF-fixdate, RFC 850 and asctime)
+    directly and falls back to :data:`DATE_FORMATS`. Results are cached by
+    the exact header value, since the same values turn up over and over.
+    '''
+    result = _cache.get(value)
+    if result is None:
+        result = _parse(value.strip())
+        _cache.put(value, _UNPARSEABLE if result is None else result)
+    elif result is _UNPARSEABLE:
+        result = None
+    return result
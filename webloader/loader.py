@@ -3,16 +3,25 @@ import subprocess
 import re
 import logging
 import urlparse
-import requests
 import signal
 import pprint
 import traceback
 import numpy
 import time
+import copy
+import array
+import Queue
+import threading
+import multiprocessing
 from collections import defaultdict
+from availability import AvailabilityCache, DEFAULT_TTL, check_url, check_urls
+from checkpoint import Checkpoint
+from capture import TCPDUMP, RunCapture, slice_capture
 
-
-TCPDUMP = '/usr/sbin/tcpdump'
+# seconds (on top of the loader's timeout) to let a worker process finish
+# tearing down its backend (killing browsers, releasing leases) before it's
+# killed
+TEARDOWN_GRACE = 30
 
 
 ################################################################################
@@ -24,18 +33,107 @@ TCPDUMP = '/usr/sbin/tcpdump'
 class TimeoutError(Exception):
     pass
 
-class Timeout:
-    '''Can be used w/ 'with' to make arbitrary function calls with timeouts'''
+# per-thread stack of the Timeouts currently in effect (innermost last)
+_timeout_state = threading.local()
+
+def _active_timeouts():
+    if not hasattr(_timeout_state, 'stack'):
+        _timeout_state.stack = []
+    return _timeout_state.stack
+
+def kill_process_tree(proc):
+    '''Kill a process started with :func:`popen` and everything it spawned
+    (i.e., its whole process group).'''
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass  # already gone
+
+class Timeout(object):
+    '''Can be used w/ 'with' to make arbitrary function calls with timeouts.
+
+    Uses a timer thread rather than SIGALRM, so it works in any thread, can be
+    nested, and accepts fractional seconds. Python code in the block is not
+    interrupted; instead, when the deadline passes, every child process started
+    in the block with :func:`popen` (or the :func:`call`, :func:`check_call`
+    and :func:`check_output` wrappers) has its process tree killed, and
+    TimeoutError is raised when the block exits. Long-running loops should
+    call :meth:`check` to bail out early.
+    '''
     def __init__(self, seconds=10, error_message='Timeout'):
         self.seconds = seconds
         self.error_message = error_message
-    def handle_timeout(self, signum, frame):
-        raise TimeoutError(self.error_message)
+        self._procs = []
+        self._expired = False
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _expire(self):
+        with self._lock:
+            self._expired = True
+            procs = list(self._procs)
+        for proc in procs:
+            kill_process_tree(proc)
+
+    def track(self, proc):
+        '''Kill `proc`'s process tree if this timeout expires.'''
+        with self._lock:
+            self._procs.append(proc)
+            expired = self._expired
+        if expired:
+            kill_process_tree(proc)
+
+    @property
+    def expired(self):
+        '''True once the deadline has passed.'''
+        return self._expired
+
+    def check(self):
+        '''Raise TimeoutError if the deadline has passed.'''
+        if self._expired:
+            raise TimeoutError(self.error_message)
+
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+        self._timer = threading.Timer(self.seconds, self._expire)
+        _active_timeouts().append(self)
+        self._timer.start()
+        return self
+
     def __exit__(self, type, value, traceback):
-        signal.alarm(0)
+        self._timer.cancel()
+        _active_timeouts().remove(self)
+        if self._expired:
+            # whatever the block raised was most likely caused by us killing
+            # its child processes; report the timeout instead
+            raise TimeoutError(self.error_message)
+
+def popen(args, **kwargs):
+    '''Like subprocess.Popen, but starts the child in its own process group
+    and registers it with any enclosing :class:`Timeout`s.'''
+    kwargs.setdefault('preexec_fn', os.setsid)
+    proc = subprocess.Popen(args, **kwargs)
+    for timeout in _active_timeouts():
+        timeout.track(proc)
+    return proc
+
+def call(args, **kwargs):
+    '''Like subprocess.call, but see :func:`popen`.'''
+    return popen(args, **kwargs).wait()
+
+def check_call(args, **kwargs):
+    '''Like subprocess.check_call, but see :func:`popen`.'''
+    retcode = call(args, **kwargs)
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, args)
+    return 0
+
+def check_output(args, **kwargs):
+    '''Like subprocess.check_output, but see :func:`popen`.'''
+    proc = popen(args, stdout=subprocess.PIPE, **kwargs)
+    output, _ = proc.communicate()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, output=output)
+    return output
 
 
 ################################################################################
@@ -44,7 +142,124 @@ class Timeout:
 #                                                                              #
 ################################################################################
 
-class LoadResult(object):
+class _Slotted(object):
+    '''Base for the result classes, which use ``__slots__`` (there can be
+    millions of them in memory). Makes them picklable and gives them a
+    readable repr.'''
+
+    __slots__ = ()
+
+    def _fields(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__\
+            if hasattr(self, name))
+
+    def __getstate__(self):
+        return self._fields()
+
+    def __setstate__(self, state):
+        # also accepts the __dict__ of a result pickled before we used slots
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+
+def _column(values):
+    '''A numpy view (no copy) of one of a :class:`PageResult`'s typed arrays.
+    Don't hold on to it: appending to the array can move its buffer.'''
+    if not values:
+        return numpy.empty(0)
+    return numpy.frombuffer(values, dtype=values.typecode)
+
+
+class PhaseTimings(_Slotted):
+    '''Where the time went during a single object load. Each phase is a
+    duration in seconds, or None if the loader could not measure it.
+
+    :param dns: name lookup
+    :param connect: TCP connection setup (after name lookup)
+    :param tls: TLS handshake (0 for plain HTTP)
+    :param ttfb: from the connection being ready until the first byte of the
+        response arrives (i.e., sending the request plus server think time)
+    :param transfer: from the first byte of the response until the last
+    '''
+
+    PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')  #: Phase names, in order
+
+    __slots__ = ('_dns', '_connect', '_tls', '_ttfb', '_transfer')
+
+    def __init__(self, dns=None, connect=None, tls=None, ttfb=None,\
+        transfer=None):
+        self._dns = dns
+        self._connect = connect
+        self._tls = tls
+        self._ttfb = ttfb
+        self._transfer = transfer
+
+    @staticmethod
+    def from_marks(start, dns_done=None, connected=None, tls_done=None,\
+        first_byte=None, end=None):
+        '''Build a :class:`PhaseTimings` from the times (in seconds, on any
+        common clock) at which each phase finished. A phase whose start or
+        end is missing is left as None; pass `tls_done` equal to `connected`
+        for plain HTTP.'''
+        def span(begin, finish):
+            if begin is None or finish is None:
+                return None
+            return max(finish - begin, 0.0)
+        ready = tls_done if tls_done is not None else connected
+        return PhaseTimings(dns=span(start, dns_done),
+            connect=span(dns_done, connected),
+            tls=span(connected, tls_done),
+            ttfb=span(ready, first_byte),
+            transfer=span(first_byte, end))
+
+    @staticmethod
+    def from_curl(namelookup, connect, appconnect, starttransfer, total):
+        '''Build a :class:`PhaseTimings` from curl's cumulative
+        ``time_namelookup``, ``time_connect``, ``time_appconnect``,
+        ``time_starttransfer`` and ``time_total``.'''
+        # curl reports appconnect as 0 when there was no TLS handshake
+        tls_done = appconnect if appconnect > 0 else connect
+        return PhaseTimings.from_marks(0.0, dns_done=namelookup,\
+            connected=connect, tls_done=tls_done, first_byte=starttransfer,\
+            end=total)
+
+    @property
+    def dns(self):
+        '''Name lookup time in seconds.'''
+        return self._dns
+
+    @property
+    def connect(self):
+        '''TCP connection setup time in seconds.'''
+        return self._connect
+
+    @property
+    def tls(self):
+        '''TLS handshake time in seconds (0 for plain HTTP).'''
+        return self._tls
+
+    @property
+    def ttfb(self):
+        '''Time from connection ready to first response byte in seconds.'''
+        return self._ttfb
+
+    @property
+    def transfer(self):
+        '''Time from first to last response byte in seconds.'''
+        return self._transfer
+
+    def as_dict(self):
+        '''The phases as a dict mapping phase name to duration.'''
+        return dict((phase, getattr(self, phase)) for phase in self.PHASES)
+
+    def __str__(self):
+        return 'PhaseTimings: %s' % pprint.saferepr(self.as_dict())
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class LoadResult(_Slotted):
     '''Status and stats for a single URL load (i.e., one trial).
     
     :param status: The status of the page load.
@@ -57,6 +272,8 @@ class LoadResult(object):
     :param img: Path to a screenshot of the loaded page.
     :param tcp_fast_open_supported: True if TCP fast open was used successfully;
         False otherwise or unknown
+    :param timings: :class:`PhaseTimings` breaking down `time` (object
+        loaders only).
     '''
     
     # Status constants
@@ -66,10 +283,15 @@ class LoadResult(object):
     FAILURE_NO_200 = 'FAILURE_NO_200'  #: HTTP status code was not 200
     FAILURE_UNSET = 'FAILURE_UNSET' #: Status has not been set
 
+    __slots__ = ('_status', '_url', '_final_url', '_time', '_size',\
+        '_har_path', '_image_path', '_raw', '_server',\
+        '_tcp_fast_open_supported', '_tls_false_start_supported',\
+        '_tls_session_resumption_supported', '_timings')
+
     def __init__(self, status, url, final_url=None, time=None, size=None,\
         har=None, img=None, raw=None, server=None,\
         tcp_fast_open_supported=False, tls_false_start_supported=False,\
-        tls_session_resumption_supported=False):
+        tls_session_resumption_supported=False, timings=None):
 
         self._status = status
         self._url = url  # the initial URL we requested
@@ -83,6 +305,7 @@ class LoadResult(object):
         self._tcp_fast_open_supported = tcp_fast_open_supported
         self._tls_false_start_supported = tls_false_start_supported
         self._tls_session_resumption_supported = tls_session_resumption_supported
+        self._timings = timings
 
     @property
     def status(self):
@@ -147,15 +370,138 @@ class LoadResult(object):
             connection.'''
         return self._tls_session_resumption_supported
 
+    @property
+    def timings(self):
+        '''Per-phase :class:`PhaseTimings` for this load, or None if the
+            loader doesn't measure them.'''
+        return self._timings
+
     def __str__(self):
-        return 'LoadResult (%s): %s' % (self._status,  pprint.saferepr(self.__dict__))
+        return 'LoadResult (%s): %s' % (self._status,  pprint.saferepr(self._fields()))
 
     def __repr__(self):
         return self.__str__()
 
 
-class PageResult(object):
+class TimeStats(_Slotted):
+    '''Summary statistics over a set of load times, computed together from
+    one sorted copy of the data. Bootstrap confidence intervals are computed
+    the first time they're asked for and then remembered.
+
+    :param times: the load times in seconds (any sequence of numbers)
+    '''
+
+    PERCENTILES = (50, 90, 95, 99)  #: Percentiles computed up front
+    OUTLIER_IQR_FACTOR = 1.5  #: Outliers lie this many IQRs outside the quartiles
+
+    __slots__ = ('_times', '_sorted', '_mean', '_stddev', '_percentiles',\
+        '_outliers', '_intervals')
+
+    def __init__(self, times):
+        self._times = numpy.array(times, dtype=numpy.float64)
+        self._sorted = numpy.sort(self._times)
+        self._intervals = {}  # (confidence, iterations) -> (low, high)
+        if len(self._times):
+            self._mean = float(self._times.mean())
+            self._stddev = float(self._times.std())
+            self._percentiles = dict(zip(self.PERCENTILES,\
+                numpy.percentile(self._sorted, self.PERCENTILES)))
+            q1, q3 = numpy.percentile(self._sorted, (25, 75))
+            fence = self.OUTLIER_IQR_FACTOR * (q3 - q1)
+            self._outliers = (self._times < q1 - fence) |\
+                (self._times > q3 + fence)
+        else:
+            self._mean = self._stddev = float('nan')
+            self._percentiles = dict.fromkeys(self.PERCENTILES, float('nan'))
+            self._outliers = numpy.zeros(0, dtype=bool)
+
+    @property
+    def count(self):
+        '''Number of times.'''
+        return len(self._times)
+
+    @property
+    def mean(self):
+        '''Mean time (NaN if there are no times).'''
+        return self._mean
+
+    @property
+    def median(self):
+        '''Median time (NaN if there are no times).'''
+        return self._percentiles[50]
+
+    @property
+    def stddev(self):
+        '''Standard deviation of the times (NaN if there are no times).'''
+        return self._stddev
+
+    @property
+    def percentiles(self):
+        '''A dict mapping each of :attr:`PERCENTILES` to its value.'''
+        return dict(self._percentiles)
+
+    def percentile(self, percentile):
+        '''The given percentile (0-100) of the times.'''
+        if percentile in self._percentiles:
+            return self._percentiles[percentile]
+        if not len(self._sorted):
+            return float('nan')
+        return float(numpy.percentile(self._sorted, percentile))
+
+    def trimmed_mean(self, proportion=0.1):
+        '''Mean after dropping `proportion` of the times from each end.'''
+        if not 0 <= proportion < 0.5:
+            raise ValueError('proportion must be in [0, 0.5), not %s' % proportion)
+        cut = int(proportion * len(self._sorted))
+        kept = self._sorted[cut:len(self._sorted)-cut]
+        return float(kept.mean()) if len(kept) else float('nan')
+
+    def confidence_interval(self, confidence=0.95, iterations=1000):
+        '''A bootstrap confidence interval for the mean, as a (low, high)
+        tuple. Resampling uses a fixed seed, so the same times always give
+        the same interval.'''
+        key = (confidence, iterations)
+        if key not in self._intervals:
+            if not len(self._times):
+                self._intervals[key] = (float('nan'), float('nan'))
+            else:
+                rng = numpy.random.RandomState(0)
+                samples = rng.randint(0, len(self._times),\
+                    (iterations, len(self._times)))
+                means = self._times[samples].mean(axis=1)
+                tail = (1 - confidence) / 2.0 * 100
+                low, high = numpy.percentile(means, (tail, 100 - tail))
+                self._intervals[key] = (float(low), float(high))
+        return self._intervals[key]
+
+    @property
+    def outliers(self):
+        '''A boolean array, in the order the times were given, flagging the
+        ones more than :attr:`OUTLIER_IQR_FACTOR` interquartile ranges
+        outside the quartiles.'''
+        return self._outliers
+
+    @property
+    def num_outliers(self):
+        '''Number of times flagged in :attr:`outliers`.'''
+        return int(self._outliers.sum())
+
+    def __str__(self):
+        return 'TimeStats: n=%d mean=%f p50=%f p90=%f p99=%f' % (self.count,\
+            self._mean, self._percentiles[50], self._percentiles[90],\
+            self._percentiles[99])
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class PageResult(_Slotted):
     '''Status and stats for one URL (all trials).
+
+    Per-trial values are kept column-wise in typed arrays (:mod:`array`) rather
+    than lists of Python objects. Load time statistics are computed together
+    the first time one is needed (see :attr:`time_stats`) and recomputed only
+    after :meth:`add_load_result`.
     
     :param url: The original URL.
     :param status: The overall status of all trials.
@@ -169,46 +515,60 @@ class PageResult(object):
     FAILURE_UNKNOWN = 'FAILURE_UNKNOWN' #: An unknown failure occurred
     FAILURE_UNSET = 'FAILURE_UNSET' #: Status has not been set
 
+    __slots__ = ('_status', '_url', '_load_statuses', '_times', '_sizes',\
+        '_server', '_tcp_fast_open_support_statuses',\
+        '_tls_false_start_support_statuses',\
+        '_tls_session_resumption_support_statuses', '_phase_times', '_stats')
+
     def __init__(self, url, status=None, load_results=None):
         self._status = PageResult.FAILURE_UNSET
         self._url = url
         self._load_statuses = []
-        self._times = []
-        self._sizes = []
+        self._times = array.array('d')
+        self._sizes = array.array('d')
         self._server = 'UNKNOWN'
-        self._tcp_fast_open_support_statuses = []
-        self._tls_false_start_support_statuses = []
-        self._tls_session_resumption_support_statuses = []
+        self._tcp_fast_open_support_statuses = array.array('b')
+        self._tls_false_start_support_statuses = array.array('b')
+        self._tls_session_resumption_support_statuses = array.array('b')
+        self._phase_times = dict((phase, array.array('d'))\
+            for phase in PhaseTimings.PHASES)
+        self._stats = None
 
-        if load_results:
-            was_a_failure = False
-            was_a_success = False
-            for result in load_results:
-                self._load_statuses.append(result.status)
-                if result.server:
-                    self._server = result.server
-                if result.status == PageResult.SUCCESS:
-                    was_a_success = True
-                    if result.time: self.times.append(result.time)
-                    if result.size: self.sizes.append(result.size)
-                    self._tcp_fast_open_support_statuses.append(
-                        result.tcp_fast_open_supported)
-                    self._tls_false_start_support_statuses.append(
-                        result.tls_false_start_supported)
-                    self._tls_session_resumption_support_statuses.append(
-                        result.tls_session_resumption_supported)
-                else:
-                    was_a_failure = True
-            if was_a_failure and was_a_success:
-                self._status = PageResult.PARTIAL_SUCCESS
-            elif was_a_success:
-                self._status = PageResult.SUCCESS
-            else:
-                self._status = PageResult.FAILURE_UNKNOWN
+        for result in load_results or []:
+            self.add_load_result(result)
 
         if status:
             self._status = status
 
+    def add_load_result(self, result):
+        '''Add one more trial's :class:`LoadResult` and update the overall
+        status. Cached statistics are recomputed when next used.'''
+        self._load_statuses.append(result.status)
+        if result.server:
+            self._server = result.server
+        if result.status == PageResult.SUCCESS:
+            if result.time: self._times.append(float(result.time))
+            if result.size: self._sizes.append(float(result.size))
+            self._tcp_fast_open_support_statuses.append(
+                result.tcp_fast_open_supported)
+            self._tls_false_start_support_statuses.append(
+                result.tls_false_start_supported)
+            self._tls_session_resumption_support_statuses.append(
+                result.tls_session_resumption_supported)
+            if result.timings:
+                for phase, t in result.timings.as_dict().iteritems():
+                    if t is not None:
+                        self._phase_times[phase].append(t)
+        self._stats = None
+
+        num_successes = self._load_statuses.count(PageResult.SUCCESS)
+        if num_successes == len(self._load_statuses):
+            self._status = PageResult.SUCCESS
+        elif num_successes:
+            self._status = PageResult.PARTIAL_SUCCESS
+        else:
+            self._status = PageResult.FAILURE_UNKNOWN
+
     @property
     def status(self):
         '''The overall status across all trials.'''
@@ -226,12 +586,12 @@ class PageResult(object):
 
     @property
     def times(self):
-        '''A list of the load times from individual trials.'''
+        '''An array of the load times from individual trials.'''
         return self._times
 
     @property
     def sizes(self):
-        '''A list of the page sizes from individual trials.'''
+        '''An array of the page sizes from individual trials.'''
         return self._sizes
 
     @property
@@ -241,39 +601,99 @@ class PageResult(object):
 
     @property
     def tcp_fast_open_support_statuses(self):
-        '''A list of bools indicating whether or not TCP fast open succeeded
-            for each load.'''
+        '''An array of flags (1 or 0) indicating whether or not TCP fast open
+            succeeded for each load.'''
         return self._tcp_fast_open_support_statuses
     
     @property
     def tls_false_start_support_statuses(self):
-        '''A list of bools indicating whether or not TLS false start succeeded
-            for each load.'''
+        '''An array of flags (1 or 0) indicating whether or not TLS false
+            start succeeded for each load.'''
         return self._tls_false_start_support_statuses
     
     @property
     def tls_session_resumption_support_statuses(self):
-        '''A list of bools indicating whether or not TLS session resumption 
-            succeeded for each load.'''
+        '''An array of flags (1 or 0) indicating whether or not TLS session
+            resumption succeeded for each load.'''
         return self._tls_session_resumption_support_statuses
     
+    @property
+    def time_stats(self):
+        ''':class:`TimeStats` for the load times of successful trials.'''
+        if getattr(self, '_stats', None) is None:
+            self._stats = TimeStats(_column(self._times))
+        return self._stats
+
     @property
     def mean_time(self):
         '''Mean load time across all trials.'''
-        return numpy.mean(self.times)
+        return self.time_stats.mean
     
     @property
     def median_time(self):
         '''Median load time across all trials.'''
-        return numpy.median(self.times)
+        return self.time_stats.median
     
     @property
     def stddev_time(self):
         '''Standard deviation of load time across all trials.'''
-        return numpy.std(self.times)
+        return self.time_stats.stddev
+
+    def time_percentile(self, percentile):
+        '''The given percentile (0-100) of load time across all trials.'''
+        return self.time_stats.percentile(percentile)
+
+    def trimmed_mean_time(self, proportion=0.1):
+        '''Mean load time after dropping `proportion` of trials from each
+        end.'''
+        return self.time_stats.trimmed_mean(proportion)
+
+    def time_confidence_interval(self, confidence=0.95, iterations=1000):
+        '''Bootstrap confidence interval, (low, high), for the mean load
+        time.'''
+        return self.time_stats.confidence_interval(confidence, iterations)
+
+    @property
+    def time_outliers(self):
+        '''A boolean array flagging outlying entries of :attr:`times` (see
+        :attr:`TimeStats.outliers`).'''
+        return self.time_stats.outliers
+
+    @property
+    def phase_times(self):
+        '''A dict mapping each phase in :attr:`PhaseTimings.PHASES` to an
+            array of that phase's durations from individual trials.'''
+        return self._phase_times
+
+    def _summarize_phases(self, func):
+        return dict((phase, func(_column(times)) if times else None)\
+            for phase, times in self._phase_times.iteritems())
+
+    @property
+    def mean_phase_times(self):
+        '''Mean duration of each phase across all trials (None if the phase
+            was never measured).'''
+        return self._summarize_phases(numpy.mean)
+
+    @property
+    def median_phase_times(self):
+        '''Median duration of each phase across all trials (None if the phase
+            was never measured).'''
+        return self._summarize_phases(numpy.median)
+
+    def phase_time_percentiles(self, percentile):
+        '''The given percentile (0-100) of each phase's duration across all
+        trials (None if the phase was never measured).'''
+        return self._summarize_phases(\
+            lambda times: numpy.percentile(times, percentile))
+
+    def __getstate__(self):
+        state = self._fields()
+        state.pop('_stats', None)  # cheap to recompute
+        return state
     
     def __str__(self):
-        return 'PageResult (%s): %s' % (self._status,  pprint.saferepr(self.__dict__))
+        return 'PageResult (%s): %s' % (self._status,  pprint.saferepr(self._fields()))
 
     def __repr__(self):
         return self.__str__()
@@ -291,7 +711,8 @@ class Loader(object):
     functionality (e.g., using Chrome, PhantomJS, etc.).
 
     :param outdir: directory for HAR files, screenshots, etc.
-    :param num_trials:  number of times to load each URL
+    :param num_trials:  number of times to load each URL (the most times, if
+        `target_ci_width` is set)
     :param http2: use HTTP 2 (not all subclasses support this)
     :param timeout: timeout in seconds
     :param disable_local_cache: disable the local browser cache (RAM and disk)
@@ -314,8 +735,17 @@ class Loader(object):
         stdout and stderr.
     :param check_protocol_availability: before loading the page, check to see
         if the specified protocol (HTTP or HTTPS) is supported. (otherwise, the
-        loader might silently fall back to a different protocol.)
-    :param save_packet_capture: save a pcap trace for each load (separate files)
+        loader might silently fall back to a different protocol.) All URLs are
+        checked up front, in parallel, once per scheme and host.
+    :param availability_cache: JSON file to remember protocol availability
+        checks in across runs; if None, they're only remembered for the life of
+        this loader
+    :param availability_ttl: how long (seconds) a remembered check is valid
+    :param save_packet_capture: save a pcap trace for each load (separate
+        files). True starts tcpdump for each trial; 'run' captures the whole
+        run with one tcpdump (``run.pcap`` in the output directory), indexes
+        when each trial ran (``run.pcap.index``) and slices the capture into
+        the same per-trial files at the end (see :mod:`capture`).
     :param disable_quic: disable use of the QUIC transport protocol
     :param disable_spdy: disable use of SPDY/HTTP2
     :param log_ssl_keys: instruct browser to save SSL session keys (by setting
@@ -330,19 +760,54 @@ class Loader(object):
     :param primer_load_first: load the page once before beginning normal trials
         (e.g., to prime DNS caches)
     :param configs: TODO: document
+    :param target_ci_width: adaptive trial count: stop loading a URL (in each
+        config) once the 95% confidence interval of its mean load time is
+        narrower than this fraction of the mean (e.g., 0.1), after at least
+        `min_trials` successful trials and at most `num_trials` trials. If
+        None, every URL gets `num_trials` trials.
+    :param min_trials: with `target_ci_width`, the fewest successful trials to
+        base a decision to stop on
+    :param checkpoint: path to a checkpoint journal. Every finished trial is
+        appended to it, and trials (URL, config tag, trial number) already in
+        it are not loaded again, so a crashed run can simply be restarted.
+    :param sinks: list of :class:`sinks.ResultSink` objects to stream results
+        to as each URL finishes (in input order). With `checkpoint`, URLs the
+        interrupted run already sent aren't sent again to sinks that append
+        (see :attr:`sinks.ResultSink.appends`), so a resumed run can keep
+        adding to the same outputs without duplicating rows.
+    :param keep_results: keep results in memory (:attr:`urls`,
+        :attr:`load_results` and :attr:`page_results`). Set to False with
+        `sinks` to keep memory flat on large crawls.
+    :param concurrency: number of backend instances to run in parallel. Each
+        runs in its own process with its own setup/teardown and pulls URLs off
+        a shared work queue; results are merged back in the order the URLs
+        were given.
+    :param standby_instances: keep this many fully set up spare backend
+        instances (e.g., browsers) launching in the background, so a restart
+        (see `restart_each_time` and `restart_on_fail`) just swaps one in.
+        Retired instances are torn down in the background. Only backends that
+        list their per-instance state in `_backend_state` support this.
     '''
 
+    # attributes that make up one running backend instance (processes,
+    # connections, leases; all None when torn down). Subclasses that list them
+    # here support standby instances.
+    _backend_state = ()
+
     def __init__(self, outdir='.', num_trials=1, http2=False, timeout=30,\
         disable_local_cache=True, disable_network_cache=False, full_page=True,\
         user_agent=None, headless=True, restart_on_fail=False,\
         restart_each_time=False, proxy=None, save_har=False,\
         save_screenshot=False, save_content='never', retries_per_trial=0,\
         stdout_filename=None, check_protocol_availability=True,\
+        availability_cache=None, availability_ttl=DEFAULT_TTL,\
         save_packet_capture=False, disable_quic=False, disable_spdy=False,\
         log_ssl_keys=False, ignore_certificate_errors=False,\
         delay_after_onload=0, delay_first_trial_only=False,\
         primer_load_first=False,\
-        configs=[{'tag':'default', 'settings':{}}]):
+        configs=[{'tag':'default', 'settings':{}}], concurrency=1,\
+        standby_instances=0, checkpoint=None, sinks=None, keep_results=True,\
+        target_ci_width=None, min_trials=5):
         '''Initialize a Loader object.'''
 
         # options
@@ -364,6 +829,8 @@ class Loader(object):
         self._stdout_filename = stdout_filename
         self._proxy = proxy
         self._check_protocol_availability = check_protocol_availability
+        self._availability_cache = AvailabilityCache(availability_cache,\
+            availability_ttl)
         self._save_packet_capture = save_packet_capture
         self._disable_quic = disable_quic
         self._disable_spdy = disable_spdy
@@ -373,6 +840,25 @@ class Loader(object):
         self._delay_first_trial_only = delay_first_trial_only
         self._primer_load_first = primer_load_first
         self._configs = configs
+        self._concurrency = concurrency
+        self._checkpoint = Checkpoint(checkpoint) if checkpoint else None
+        self._sinks = list(sinks) if sinks else []
+        self._keep_results = keep_results
+        self._target_ci_width = target_ci_width
+        self._min_trials = min_trials
+
+        # index of this instance within a concurrent run (None if not a worker)
+        self._worker_id = None
+
+        # how many page loads the backend can run at once after one setup
+        # (e.g., browser tabs); subclasses that support this set it > 1
+        self._parallel_loads = 1
+
+        # spare backend instances being set up in the background, and threads
+        # tearing down retired ones
+        self._standby_instances = standby_instances
+        self._standbys = []
+        self._reapers = []
         
         # cummulative list of all URLs (one per trial)
         self._urls = []
@@ -385,6 +871,9 @@ class Loader(object):
         # summarizes the LoadResults for the individual trials)
         self._page_results = {}
 
+        # Map URLs to the (config tag, trial number) of each LoadResult
+        self._trial_keys = defaultdict(list)
+
         # count how many times we restarted the loader due to failure
         self._num_restarts = 0
 
@@ -394,6 +883,9 @@ class Loader(object):
         # if self._stdout_filename is set, this var will hold the file object
         self._stdout_file = None
 
+        # whole-run packet capture (if save_packet_capture is 'run')
+        self._run_capture = None
+
     
 
 
@@ -425,6 +917,56 @@ class Loader(object):
 
         return url
 
+    def _more_trials_needed(self, results):
+        '''Whether a URL needs another trial (in the current config), given
+        the :class:`LoadResult` of each trial so far.'''
+        if len(results) >= self._num_trials:
+            return False
+        if self._target_ci_width is None or len(results) < self._min_trials:
+            return True
+        stats = TimeStats([r.time for r in results\
+            if r.status == LoadResult.SUCCESS and r.time])
+        if stats.count < self._min_trials or not stats.mean > 0:
+            return True
+        low, high = stats.confidence_interval(0.95)
+        return (high - low) / stats.mean > self._target_ci_width
+
+    def _start_run_capture(self):
+        '''Start the whole-run packet capture if `save_packet_capture` is
+        'run'.'''
+        self._run_capture = None
+        if self._save_packet_capture != 'run':
+            return
+        capture = RunCapture(os.path.join(self._outdir, 'run.pcap'))
+        if capture.start():
+            self._run_capture = capture
+
+    def _stop_run_capture(self):
+        '''Stop the whole-run packet capture and slice it into per-trial
+        pcaps.'''
+        capture, self._run_capture = self._run_capture, None
+        if not capture:
+            return
+        capture.stop()
+        try:
+            num_slices = slice_capture(capture.pcap_path, capture.index_path)
+            logging.info('Sliced %s into %d trial captures', capture.pcap_path,\
+                num_slices)
+        except:
+            logging.exception('Error slicing packet capture %s', capture.pcap_path)
+
+    def _record_capture_window(self, url, tag, trial, start, end):
+        '''Note in the whole-run capture's index (if there is one) that a trial
+        ran from `start` to `end`.'''
+        if not self._run_capture:
+            return
+        try:
+            self._run_capture.record(url, tag, trial, start, end,\
+                self._outfile_path(url, suffix='.pcap', trial=trial, tag=tag))
+        except:
+            logging.exception('Error indexing packet capture for %s (trial %d)',\
+                url, trial)
+
     # TODO: handle sites that sometimes return HTTP and sometimes HTTPS (YouTube)
     def _check_protocol_available(self, url):
         '''Check if the URL can be loaded over the specified protocol.
@@ -432,39 +974,18 @@ class Loader(object):
         For example, an HTTPS might not respond or an HTTP URL might be
         redirected to an HTTPS one.
         '''
-
-        orig_protocol = urlparse.urlparse(url).scheme
-        logging.debug('Checking if %s can be accessed using %s'\
-            % (url, orig_protocol))
-    
-        # try to fetch the page with the specified protocol
-        response = None
-        try:
-            with Timeout(seconds = self._timeout+5):
-                headers = {}
-                if self._user_agent:
-                    headers['User-Agent'] = self._user_agent
-                response = requests.get(url, timeout=self._timeout,\
-                    headers=headers, verify=False) 
-        except requests.exceptions.ConnectionError as e:
-            logging.debug('Could not connect to %s: %s', url, e)
-            return False
-        except requests.exceptions.Timeout as e:
-            logging.debug('Timed out connecting to %s: %s', url, e)
-            return False
-        except TimeoutError:
-            logging.debug('* Timed out connecting to %s', url)
-            return False
-        except Exception as e:
-            logging.exception('Error requesting %s: %s', url, e)
-            return False
-    
-        # if we got a response, check if we changed protocols
-        final_protocol = urlparse.urlparse(response.url).scheme
-        if orig_protocol == final_protocol:
-            return True
-        else:
-            return False
+        available = self._availability_cache.get(url)
+        if available is None:
+            available = check_url(url, self._timeout, self._user_agent)
+            self._availability_cache.put(url, available)
+            self._availability_cache.save()
+        return available
+
+    def _check_protocols_available(self, urls):
+        '''Check a batch of URLs at once (see :meth:`_check_protocol_available`).
+        Returns a dict mapping each URL to True or False.'''
+        return check_urls(urls, self._timeout, self._user_agent,\
+            self._availability_cache)
 
     def _setup(self):
         '''Subclasses can override to prepare (e.g., launch Xvfb)'''
@@ -495,6 +1016,8 @@ class Loader(object):
                 self._teardown()
                 time.sleep(tries_so_far)
 
+        if setup_succeeded:
+            self.__fill_standbys()
         return setup_succeeded
 
 
@@ -502,31 +1025,150 @@ class Loader(object):
         '''Subclasses can override to clean up (e.g., kill Xvfb)'''
         return True
     
-    def __teardown(self):
+    def __teardown(self, final=True):
         '''Private teardown method for Loader superclass'''
+        self.__discard_standbys()
         child_ret = self._teardown()
+        if final:
+            self.__join_reapers()
+            if self._checkpoint:
+                self._checkpoint.close()
 
         if self._stdout_file:
             self._stdout_file.close()
 
         return child_ret
 
+    def _recycle(self):
+        '''Subclasses with _parallel_loads > 1 can override to give the calling
+        worker a fresh session (e.g., a new browser tab) without disturbing
+        the loads running in other workers.'''
+        return True
+
     def __restart(self):
         '''Tear down and set up the loader'''
+        if self._parallel_loads > 1:
+            # the backend is shared with other workers; only reset our part
+            logging.debug('Recycling loader session')
+            if not self._recycle():
+                raise Exception('Failed to recycle loader session')
+            self._num_restarts += 1
+            return
+
+        if self.__swap_in_standby():
+            self._num_restarts += 1
+            return
+
         logging.debug('Restarting loader')
-        self.__teardown()
+        self.__teardown(final=False)
         time.sleep(1)
         setup_succeeded = self.__setup()
         self._num_restarts += 1
 
         if not setup_succeeded:
-            raise('Failed to restart loader')
+            raise Exception('Failed to restart loader')
+
+    def __standby_settings(self):
+        '''The config settings currently in effect; a standby launched with
+        different settings can't be swapped in.'''
+        return dict((k, self.__dict__.get(k))\
+            for config in self._configs for k in config['settings'])
+
+    def __fill_standbys(self):
+        '''Start setting up spare backend instances in the background until
+        there are `standby_instances` of them.'''
+        if not self._backend_state or self._parallel_loads > 1:
+            return
+        while len(self._standbys) < self._standby_instances:
+            standby = copy.copy(self)
+            for attr in self._backend_state:
+                setattr(standby, attr, None)
+            standby._standbys = []
+            standby._standby_settings = self.__standby_settings()
+            standby._standby_ready = threading.Event()
+            standby._standby_ok = False
+
+            def launch(standby=standby):
+                try:
+                    standby._standby_ok = standby._setup()
+                    if not standby._standby_ok:
+                        standby._teardown()
+                except:
+                    logging.exception('Error setting up standby instance')
+                finally:
+                    standby._standby_ready.set()
+
+            logging.debug('Launching standby instance')
+            thread = threading.Thread(target=launch)
+            thread.daemon = True
+            thread.start()
+            self._standbys.append(standby)
+
+    def __reap(self, instance):
+        '''Tear down a retired or unused instance in the background.'''
+        def reap():
+            try:
+                instance._standby_ready.wait()
+                if instance._standby_ok:
+                    instance._teardown()
+            except:
+                logging.exception('Error tearing down retired instance')
+        thread = threading.Thread(target=reap)
+        thread.daemon = True
+        thread.start()
+        self._reapers.append(thread)
+
+    def __discard_standbys(self):
+        for standby in self._standbys:
+            self.__reap(standby)
+        self._standbys = []
+
+    def __join_reapers(self):
+        for thread in self._reapers:
+            thread.join()
+        self._reapers = []
+
+    def __swap_in_standby(self):
+        '''Replace the running backend with the oldest standby instance.
+        Returns False if there is none, or if it is unusable (failed to start,
+        or started with other settings), in which case all the standbys are
+        discarded: the rest were started the same way.'''
+        if not self._standbys:
+            return False
+        standby = self._standbys.pop(0)
+        standby._standby_ready.wait()
+        if not standby._standby_ok or\
+            standby._standby_settings != self.__standby_settings():
+            logging.debug('Standby instance unusable; restarting normally')
+            self.__reap(standby)
+            self.__discard_standbys()
+            return False
 
+        logging.debug('Swapping in standby instance')
+        for attr in self._backend_state:
+            current = getattr(self, attr)
+            setattr(self, attr, getattr(standby, attr))
+            setattr(standby, attr, current)
+        self.__reap(standby)  # it now holds the old instance
+        self.__fill_standbys()
+        return True
+
+
+    def __copy__(self):
+        '''Plain shallow copy, for tab pool workers (which share this
+        instance's backend) and standby instances. Unlike pickling, this keeps
+        the stdout file and any backend handles.'''
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        return clone
 
     def __getstate__(self):
         '''override getstate so we don't try to pickle the stdout file object'''
         state = dict(self.__dict__)
         del state['_stdout_file']
+        state['_standbys'] = []
+        state['_reapers'] = []
+        state['_sinks'] = []
         return state
 
 
@@ -563,114 +1205,195 @@ class Loader(object):
     ## Public methods
     ##
     def load_pages(self, urls):
-        '''Load each URL in `urls` `num_trials` times and collect stats.
+        '''Load each URL in `urls` `num_trials` times (or fewer; see
+        `target_ci_width`) and collect stats.
         
         :param urls: list of URLs to load
         '''
-        tcpdump_proc = None  # if we use tcpdump, keep a handle to the process
+        if self._checkpoint:
+            self._checkpoint.replay()
+
+        if self._check_protocol_availability:
+            # check everything up front; the per-URL checks then hit the cache
+            try:
+                self._check_protocols_available(\
+                    [self._check_url(url) for url in urls])
+            except:
+                logging.exception('Error checking protocol availability')
+
+        self._start_run_capture()
+
+        if self._concurrency > 1:
+            try:
+                return self.__load_pages_concurrently(urls)
+            finally:
+                self._stop_run_capture()
+
         try:
             if not self.__setup():
                 logging.error('Error setting up loader')
                 self.__teardown()
                 return
 
+            self._load_urls(urls)
+
+        # load_pages level try block
+        except:
+            logging.exception('Error loading pages')
+        finally:
+            self.__teardown()
+            self._stop_run_capture()
+            self._flush_sinks()
+
+    def _load_urls(self, urls):
+        '''Load every URL in `urls` and publish its results, in input order.
+        :meth:`load_pages` calls this between setup and teardown (unless
+        `concurrency` > 1). Subclasses that schedule loads themselves can
+        override it, publishing with :meth:`_publish_url_results`.'''
+        if self._parallel_loads > 1:
+            self.__load_pages_in_threads(urls)
+        else:
             for url in urls:
-                try:
-                    # make sure URL is well-formed (e.g., has protocol, etc.)
-                    url = self._check_url(url)
-
-                    # make sure URL is accessible over specified protocol
-                    if self._check_protocol_availability and \
-                        not self._check_protocol_available(url):
-                        logging.info('%s is not accessible', url)
-                        self._urls.append(url)
-                        self._page_results[url] = PageResult(url,\
-                            status=PageResult.FAILURE_NOT_ACCESSIBLE)
-                        continue
+                url = self.__load_url(url)
+                self.__publish_loaded_url(url)
+
+    def __load_url(self, url):
+        '''Load one URL (all configs, all trials) and record the results.
 
-                    # Load page once before actual trials (e.g., to prime DNS cache)
-                    if self._primer_load_first:
+        Returns the URL the results were recorded under (it may have been
+        normalized by :meth:`_check_url`).
+        '''
+        tcpdump_proc = None  # if we use tcpdump, keep a handle to the process
+        try:
+            # make sure URL is well-formed (e.g., has protocol, etc.)
+            url = self._check_url(url)
+
+            # make sure URL is accessible over specified protocol
+            if self._check_protocol_availability and \
+                not self._check_protocol_available(url):
+                logging.info('%s is not accessible', url)
+                self._urls.append(url)
+                self._page_results[url] = PageResult(url,\
+                    status=PageResult.FAILURE_NOT_ACCESSIBLE)
+                return url
+
+            # trials already finished in a previous (interrupted) run
+            finished = {}
+            if self._checkpoint:
+                for config in self._configs:
+                    for i in range(0, self._num_trials):
+                        result = self._checkpoint.get(url, config['tag'], i)
+                        if result:
+                            finished[(config['tag'], i)] = result
+
+            def config_finished(tag):
+                results = []
+                for i in range(0, self._num_trials):
+                    if not self._more_trials_needed(results):
+                        break
+                    if (tag, i) not in finished:
+                        return False
+                    results.append(finished[(tag, i)])
+                return True
+            all_finished = all(config_finished(config['tag'])\
+                for config in self._configs)
+
+            # Load page once before actual trials (e.g., to prime DNS cache)
+            if self._primer_load_first and not all_finished:
+                tries_so_far = 0
+                while tries_so_far <= self._retries_per_trial:
+                    tries_so_far += 1
+                    result = self._load_page(url, self._outdir, None, tag='primer')
+                    if result.status == LoadResult.SUCCESS:
+                        break
+                
+
+            # Load URLs for each config
+            for config in self._configs:
+
+                tag = config['tag']
+                for k, v in config['settings'].iteritems():
+                    self.__dict__[k] = v  # FIXME: hacky
+                restarted = False
+                tag_results = []  # recorded results for this config
+
+                # If all is well, load URL num_trials times (or until the
+                # load time estimate is good enough)
+                for i in range(0, self._num_trials):
+                    if not self._more_trials_needed(tag_results):
+                        logging.info('%s (%s): load time converged after %d trials',\
+                            url, tag, len(tag_results))
+                        break
+                    if (tag, i) in finished:
+                        self.__record_trial(url, tag, i, finished[(tag, i)],\
+                            checkpoint=False)
+                        tag_results.append(finished[(tag, i)])
+                        continue
+                    if not restarted:
+                        self.__restart()
+                        restarted = True
+                    try:
+                        # if load fails, keep trying self._retries_per_trial times
                         tries_so_far = 0
                         while tries_so_far <= self._retries_per_trial:
                             tries_so_far += 1
-                            result = self._load_page(url, self._outdir, None, tag='primer')
-                            if result.status == LoadResult.SUCCESS:
-                                break
-                        
-
-                    # Load URLs for each config
-                    for config in self._configs:
 
-                        tag = config['tag']
-                        for k, v in config['settings'].iteritems():
-                            self.__dict__[k] = v  # FIXME: hacky
-                        self.__restart()
+                            # start tcpdump if we want a per-trial capture
+                            if self._save_packet_capture and\
+                                self._save_packet_capture != 'run':
+                                pcap_path = self._outfile_path(url, suffix='.pcap', trial=i, tag=tag)
+                                tcpdump_command = 'sudo %s -w %s' % (TCPDUMP, pcap_path)
+                                logging.debug('Starting tcpdump: %s', tcpdump_command)
+                                tcpdump_proc = subprocess.Popen(tcpdump_command.split(),\
+                                    stdout=self._stdout_file, stderr=self._stdout_file)
+
+                            # load the page
+                            trial_start = time.time()
+                            result = self._load_page(url, self._outdir, i, tag=tag)
+                            trial_end = time.time()
+                            logging.debug('Trial %d, try %d: %s' % (i, tries_so_far, result))
+
+                            # stop tcpdump (if it's running)
+                            if tcpdump_proc:
+                                logging.debug('Stopping tcpdump')
+                                os.system("sudo kill %s" % tcpdump_proc.pid)
+                                tcpdump_proc = None
+
+                            # count consecutive timeouts (if too many, we might restart)
+                            if result.status == LoadResult.FAILURE_TIMEOUT:
+                                self._consecutive_timeouts += 1
+                            else:
+                                self._consecutive_timeouts = 0
+
+                            # restart if things are going wrong or just to clean up
+                            if ((result.status == LoadResult.FAILURE_UNKNOWN\
+                                    or self._consecutive_timeouts >= 3)\
+                                    and self._restart_on_fail)\
+                                    or self._restart_each_time:
+                                self.__restart()
+
+                            # record load status
+                            if result.status == LoadResult.SUCCESS or\
+                                tries_so_far > self._retries_per_trial:
+                                # success, or this was the last try
+                                self.__record_trial(url, tag, i, result)
+                                self._record_capture_window(url, tag, i,\
+                                    trial_start, trial_end)
+                                tag_results.append(result)
+                            if result.status == LoadResult.SUCCESS:
+                                break  # success, don't retry
 
+                    # trial level try block
+                    except:
+                        logging.exception('Error loading URL (trial %d): %s ', url, i)
 
-                        # If all is well, load URL num_trials times
-                        for i in range(0, self._num_trials):
-                            try:
-                                # if load fails, keep trying self._retries_per_trial times
-                                tries_so_far = 0
-                                while tries_so_far <= self._retries_per_trial:
-                                    tries_so_far += 1
-
-                                    # start tcpdump if we want a packet capture
-                                    if self._save_packet_capture:
-                                        pcap_path = self._outfile_path(url, suffix='.pcap', trial=i, tag=tag)
-                                        tcpdump_command = 'sudo %s -w %s' % (TCPDUMP, pcap_path)
-                                        logging.debug('Starting tcpdump: %s', tcpdump_command)
-                                        tcpdump_proc = subprocess.Popen(tcpdump_command.split(),\
-                                            stdout=self._stdout_file, stderr=self._stdout_file)
-
-                                    # load the page
-                                    result = self._load_page(url, self._outdir, i, tag=tag)
-                                    logging.debug('Trial %d, try %d: %s' % (i, tries_so_far, result))
-
-                                    # stop tcpdump (if it's running)
-                                    if tcpdump_proc:
-                                        logging.debug('Stopping tcpdump')
-                                        os.system("sudo kill %s" % tcpdump_proc.pid)
-                                        tcpdump_proc = None
-
-                                    # count consecutive timeouts (if too many, we might restart)
-                                    if result.status == LoadResult.FAILURE_TIMEOUT:
-                                        self._consecutive_timeouts += 1
-                                    else:
-                                        self._consecutive_timeouts = 0
-
-                                    # restart if things are going wrong or just to clean up
-                                    if ((result.status == LoadResult.FAILURE_UNKNOWN\
-                                            or self._consecutive_timeouts >= 3)\
-                                            and self._restart_on_fail)\
-                                            or self._restart_each_time:
-                                        self.__restart()
-
-                                    # record load status
-                                    if result.status == LoadResult.SUCCESS:
-                                        self._urls.append(url)
-                                        self._load_results[url].append(result)
-                                        break  # success, don't retry
-                                    elif tries_so_far > self._retries_per_trial:
-                                        # this was the last try, record the failure
-                                        self._urls.append(url)
-                                        self._load_results[url].append(result)
-
-                            # trial level try block
-                            except:
-                                logging.exception('Error loading URL (trial %d): %s ', url, i)
-
-                    # Save PageResult summarizing the individual trial LoadResults
-                    self._page_results[url] = PageResult(url,\
-                        load_results=self._load_results[url])
-
-                # url level try block
-                except:
-                    logging.exception('Error loading URL: %s' % url)
+            # Save PageResult summarizing the individual trial LoadResults
+            self._page_results[url] = PageResult(url,\
+                load_results=self._load_results[url])
 
-        # load_pages level try block
+        # url level try block
         except:
-            logging.exception('Error loading pages')
+            logging.exception('Error loading URL: %s' % url)
         finally:
             # stop tcpdump (if it's running)
             try:
@@ -680,4 +1403,259 @@ class Loader(object):
                     tcpdump_proc = None
             except:
                 logging.exception('Error stopping tcpdump.')
+        return url
+
+    def __record_trial(self, url, tag, trial, result, checkpoint=True):
+        '''Record the final result of one trial.'''
+        self._urls.append(url)
+        self._load_results[url].append(result)
+        self._trial_keys[url].append((tag, trial))
+        if checkpoint and self._checkpoint:
+            try:
+                self._checkpoint.record(url, tag, trial, result)
+            except:
+                logging.exception('Error writing checkpoint for %s (trial %d)',\
+                    url, trial)
+
+    def __reset_results(self):
+        '''Start this instance off with empty result containers.'''
+        self._urls = []
+        self._load_results = defaultdict(list)
+        self._page_results = {}
+        self._trial_keys = defaultdict(list)
+        self._num_restarts = 0
+        self._consecutive_timeouts = 0
+
+    def __pop_url_results(self, url):
+        '''Return everything recorded for `url` (as a tuple suitable for
+        :meth:`__publish_results`) and forget it.'''
+        results = (url, self._urls, self._load_results.get(url, []),\
+            self._page_results.get(url), self._num_restarts,\
+            self._trial_keys.get(url, []))
+        self._urls = []
+        self._load_results = defaultdict(list)
+        self._page_results = {}
+        self._trial_keys = defaultdict(list)
+        self._num_restarts = 0
+        return results
+
+    def __publish_results(self, results):
+        '''Hand one URL's results (from :meth:`__pop_url_results`) to the
+        sinks and, if we're keeping results, to this instance's records.'''
+        url, trial_urls, load_results, page_result, num_restarts, trial_keys =\
+            results
+        self._num_restarts += num_restarts
+        self.__send_to_sinks(url, trial_keys, load_results, page_result)
+        if not self._keep_results:
+            return
+        self._urls.extend(trial_urls)
+        if load_results:
+            self._load_results[url].extend(load_results)
+            self._trial_keys[url].extend(trial_keys)
+        if page_result:
+            self._page_results[url] = page_result
+
+    def __publish_loaded_url(self, url):
+        '''Like :meth:`__publish_results`, for a URL this instance loaded
+        itself (so its results are already recorded here).'''
+        self.__send_to_sinks(url, self._trial_keys.get(url, []),\
+            self._load_results.get(url, []), self._page_results.get(url))
+        if not self._keep_results:
+            self._urls = []
+            self._load_results.pop(url, None)
+            self._page_results.pop(url, None)
+            self._trial_keys.pop(url, None)
+
+    def __send_to_sinks(self, url, trial_keys, load_results, page_result):
+        if not self._sinks:
+            return
+        # the run we resumed already sent these to sinks that keep its output
+        published = self._checkpoint and self._checkpoint.was_published(url)
+        for sink in self._sinks:
+            if published and sink.appends:
+                continue
+            try:
+                for (tag, trial), result in zip(trial_keys, load_results):
+                    sink.load_result(url, tag, trial, result)
+                if page_result:
+                    sink.page_result(page_result)
+            except:
+                logging.exception('Error writing results for %s to %s', url, sink)
+        if self._checkpoint and not published:
+            # make sure the results are really in the sinks before noting it
+            try:
+                for sink in self._sinks:
+                    if sink.appends:
+                        sink.flush()
+                self._checkpoint.record_published(url)
+            except:
+                logging.exception('Error writing checkpoint for %s', url)
+
+    def _publish_url_results(self, url, trials, page_result):
+        '''For subclasses that schedule loads themselves instead of using
+        :meth:`load_pages`: record one URL's results and send them to the
+        sinks. `trials` is a list of (config tag, trial number, LoadResult).'''
+        self.__publish_results((url, [url] * len(trials),\
+            [result for _, _, result in trials], page_result, 0,\
+            [(tag, trial) for tag, trial, _ in trials]))
+
+    def __merge_results(self, results_by_index, next_index=0, final=True):
+        '''Publish per-URL results from workers in input order, so they are
+        deterministic regardless of which worker finished first.
+
+        Publishes (and removes from `results_by_index`) the consecutive run
+        starting at `next_index`, plus everything left over if `final`.
+        Returns the index of the next result to publish.
+        '''
+        while next_index in results_by_index:
+            self.__publish_results(results_by_index.pop(next_index))
+            next_index += 1
+        if final:
+            for index in sorted(results_by_index):
+                self.__publish_results(results_by_index.pop(index))
+        return next_index
+
+    def _flush_sinks(self):
+        for sink in self._sinks:
+            try:
+                sink.flush()
+            except:
+                logging.exception('Error flushing %s', sink)
+
+    def __load_pages_in_threads(self, urls):
+        '''Load `urls` with `_parallel_loads` threads sharing this instance's
+        (already set up) backend.
+
+        Each thread works on a shallow copy of the loader, so backend handles
+        are shared but results and counters are per thread.
+        '''
+        url_queue = Queue.Queue()
+        result_queue = Queue.Queue()
+        for index, url in enumerate(urls):
+            url_queue.put((index, url))
+
+        def work(worker_id):
+            worker = copy.copy(self)
+            worker._worker_id = worker_id
+            worker.__reset_results()
+            while True:
+                try:
+                    index, url = url_queue.get_nowait()
+                except Queue.Empty:
+                    break
+                url = worker.__load_url(url)
+                result_queue.put((index, worker.__pop_url_results(url)))
+
+        threads = []
+        for worker_id in range(min(self._parallel_loads, len(urls))):
+            thread = threading.Thread(target=work, args=(worker_id,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # publish results (in order) as they come in
+        results_by_index = {}
+        next_index = 0
+        while next_index < len(urls):
+            try:
+                index, results = result_queue.get(timeout=1)
+            except Queue.Empty:
+                if not any(t.is_alive() for t in threads) and result_queue.empty():
+                    break
+                continue
+            results_by_index[index] = results
+            next_index = self.__merge_results(results_by_index, next_index,\
+                final=False)
+        for thread in threads:
+            thread.join()
+
+        self.__merge_results(results_by_index, next_index)
+
+    def __load_pages_worker(self, worker_id, url_queue, result_queue):
+        '''Body of one worker process in concurrent mode.
+
+        Runs in a forked child: sets up its own backend instance, then pulls
+        (index, url) jobs off `url_queue` until it sees a `None` sentinel.
+        Results for each URL are sent back on `result_queue` as soon as the URL
+        finishes and are then dropped from this process's memory.
+        '''
+        self._concurrency = 1
+        self._worker_id = worker_id
+        self._sinks = []  # the parent publishes our results
+        self.__reset_results()
+
+        setup_succeeded = False
+        try:
+            setup_succeeded = self.__setup()
+            if not setup_succeeded:
+                logging.error('Error setting up loader (worker %d)', worker_id)
+            while True:
+                job = url_queue.get()
+                if job is None:
+                    break
+                index, url = job
+                if setup_succeeded:
+                    url = self.__load_url(url)
+                result_queue.put((index, self.__pop_url_results(url)))
+        except:
+            logging.exception('Error in loader worker %d', worker_id)
+        finally:
             self.__teardown()
+
+    def __load_pages_concurrently(self, urls):
+        '''Load `urls` using `concurrency` worker processes, each with its own
+        backend instance, and merge their results in the order of `urls`.'''
+        url_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        for index, url in enumerate(urls):
+            url_queue.put((index, url))
+
+        num_workers = min(self._concurrency, len(urls))
+        for _ in range(num_workers):
+            url_queue.put(None)  # one sentinel per worker
+
+        workers = []
+        for worker_id in range(num_workers):
+            worker = multiprocessing.Process(target=self.__load_pages_worker,\
+                args=(worker_id, url_queue, result_queue))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        # collect results as they come in (drain the queue before joining the
+        # workers, or they can block forever flushing their pipes)
+        results_by_index = {}
+        next_index = 0
+        num_received = 0
+        finished = False
+        try:
+            while num_received < len(urls):
+                try:
+                    index, results = result_queue.get(timeout=1)
+                except Queue.Empty:
+                    if not any(w.is_alive() for w in workers):
+                        logging.error('All loader workers exited with %d URLs unfinished',\
+                            len(urls) - num_received)
+                        break
+                    continue
+                num_received += 1
+                results_by_index[index] = results
+                next_index = self.__merge_results(results_by_index,\
+                    next_index, final=False)
+            finished = True
+        except:
+            logging.exception('Error collecting results from loader workers')
+        finally:
+            # workers tear down their backends after sending their last
+            # results; killing one mid-teardown would leak its browser and
+            # leases, so only do that if we're bailing out (or it hangs)
+            grace = self._timeout + TEARDOWN_GRACE if finished else 1
+            deadline = time.time() + grace
+            for worker in workers:
+                worker.join(max(deadline - time.time(), 0))
+                if worker.is_alive():
+                    logging.warn('Loader worker did not exit; terminating it')
+                    worker.terminate()
+
+        self.__merge_results(results_by_index, next_index)
+        self._flush_sinks()
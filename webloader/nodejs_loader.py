@@ -5,11 +5,17 @@ import shlex
 import subprocess
 import string
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, PhaseTimings, Timeout, TimeoutError,\
+    check_output
 
 NODE = '/usr/bin/env node'
 NODEHTTP2 = 'node-http2/example/objloader_client.js' # Put your path here
 
+# Optional fields the client can add to its output (same meaning as curl's
+# -w variables) so we can break the load time down by phase
+PHASE_FIELDS = ('time_namelookup', 'time_connect', 'time_appconnect',\
+    'time_starttransfer')
+
 class NodeJsLoader(Loader):
     '''Subclass of :class:`Loader` that loads pages using NODE.JS.
     
@@ -43,7 +49,7 @@ class NodeJsLoader(Loader):
         self._image_paths_by_url = defaultdict(list)
 
 
-    def _load_page(self, url, outdir, trial_num=-1):
+    def _load_page(self, url, outdir, trial_num=-1, tag=None):
     
         # load the specified URL
         logging.info('Loading page: %s', url)
@@ -56,11 +62,12 @@ class NodeJsLoader(Loader):
             # load the page
             logging.debug('Running node.js: %s', node_cmd)
             with Timeout(seconds=self._timeout+5):
-                output = subprocess.check_output(shlex.split(node_cmd))
+                output = check_output(shlex.split(node_cmd))
                 logging.debug('NODE returned: %s', output.strip())
 
             # NODE returned, but may or may not have succeeded
-            returnvals = {field.split('=')[0]: field.split('=')[1] for field in output.split(';')}
+            returnvals = {field.split('=', 1)[0]: field.split('=', 1)[1] for field in output.split(';')}
+            seconds = lambda field: float(string.replace(returnvals[field], ',', '.'))
 
             if returnvals['http_code'] != '200':
                 return LoadResult(LoadResult.FAILURE_NO_200, url)
@@ -69,8 +76,11 @@ class NodeJsLoader(Loader):
                 return LoadResult(LoadResult.SUCCESS,
                     url,
                     final_url=returnvals['final_url'],
-                    time=float(string.replace(returnvals['time'], ',', '.')),
-                    size=returnvals['size'])
+                    time=seconds('time'),
+                    size=returnvals['size'],
+                    timings=PhaseTimings.from_curl(\
+                        *[seconds(f) for f in PHASE_FIELDS + ('time',)])\
+                        if all(f in returnvals for f in PHASE_FIELDS) else None)
 
         # problem running NODE
         except TimeoutError:
@@ -1,13 +1,19 @@
 import os
+import json
 import logging
+import threading
 import traceback
 import subprocess
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, Timeout, TimeoutError, popen,\
+    kill_process_tree
 
 PHANTOMJS = '/usr/bin/env phantomjs'
 PHANTOMLOADER = os.path.join(os.path.dirname(__file__), 'phantomloader.js')
 
+# phantomloader.js (in server mode) prefixes each job's result line with this
+RESULT_PREFIX = 'WEBLOADER-RESULT '
+
 # TODO: when do we return FAILURE_NO_200?
 # TODO: enable caching
 # TODO: user agent
@@ -21,9 +27,19 @@ class PhantomJSLoader(Loader):
     .. note:: The :class:`PhantomJSLoader` currently does not support disabling network caching.
     .. note:: The :class:`PhantomJSLoader` currently does not support single-object loading (i.e., it always loads the full page).
     .. note:: The :class:`PhantomJSLoader` currently does not support saving content.
+
+    Trials are isolated from each other even though workers are reused: before
+    every load, the worker clears its cookies and its in-memory cache, so
+    every trial starts cold, as with a fresh process. (PhantomJS versions
+    that can't clear the memory cache get a fresh worker after every load
+    instead.)
+
+    :param num_workers: number of warm PhantomJS processes to keep. Each one
+        runs phantomloader.js in server mode and loads one page at a time, so
+        this many pages load in parallel.
     '''
 
-    def __init__(self, **kwargs):
+    def __init__(self, num_workers=1, **kwargs):
         super(PhantomJSLoader, self).__init__(**kwargs)
         if self._http2:
             raise NotImplementedError('PhantomJSLoader does not support HTTP2')
@@ -40,8 +56,66 @@ class PhantomJSLoader(Loader):
         
         self._image_paths_by_url = defaultdict(list)
 
+        # warm PhantomJS processes (running phantomloader.js in server mode)
+        self._parallel_loads = num_workers
+        self._worker_lock = threading.Lock()
+        self._workers = []  # all running workers; shared by all load threads
+        self._worker = None  # the worker this load thread is using
+
+    def __getstate__(self):
+        '''don't try to pickle worker processes or locks'''
+        state = super(PhantomJSLoader, self).__getstate__()
+        for key in ('_worker_lock', '_workers', '_worker'):
+            state.pop(key, None)
+        return state
 
-    def _load_page(self, url, outdir, trial_num=-1):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._worker_lock = threading.Lock()
+        self._workers = []
+        self._worker = None
+
+    def _start_worker(self):
+        cmd = '%s --ssl-protocol=any %s --server' % (PHANTOMJS, PHANTOMLOADER)
+        logging.debug('Starting PhantomJS worker: %s', cmd)
+        worker = popen(cmd.split(), stdin=subprocess.PIPE,\
+            stdout=subprocess.PIPE, stderr=self._stdout_file)
+        with self._worker_lock:
+            self._workers.append(worker)
+        return worker
+
+    def _stop_worker(self, worker):
+        try:
+            worker.stdin.close()
+        except Exception:
+            pass
+        kill_process_tree(worker)
+        worker.wait()
+        with self._worker_lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+
+    def _run_job(self, job):
+        '''Hand one job to this thread's worker and return its result dict.'''
+        if self._worker is None or self._worker.poll() is not None:
+            self._worker = self._start_worker()
+        self._worker.stdin.write(json.dumps(job) + '\n')
+        self._worker.stdin.flush()
+        while True:
+            line = self._worker.stdout.readline()
+            if line == '':
+                raise Exception('PhantomJS worker exited (return code: %s)'\
+                    % self._worker.poll())
+            if line.startswith(RESULT_PREFIX):
+                result = json.loads(line[len(RESULT_PREFIX):])
+                if not result.get('isolated', False):
+                    # this worker can't clear its cache; don't let the next
+                    # load start warm
+                    self._discard_worker()
+                return result
+            logging.debug('PhantomJS: %s', line.rstrip())
+
+    def _load_page(self, url, outdir, trial_num=-1, tag=None):
         # path for new HAR file
         safeurl = self._sanitize_url(url)
         filename = '%s_trial%d.har' % (safeurl, trial_num)
@@ -51,33 +125,28 @@ class PhantomJSLoader(Loader):
         if self._save_har:
             logging.debug('Will save HAR to %s', harpath)
 
+        imagepath = None
         if self._save_screenshot:
             imagepath = os.path.join(outdir, imagename)
             logging.debug('Will save screenshot to %s', imagepath)
-        else:
-            imagepath = '/dev/null'
 
     
         # load the specified URL
         logging.info('Loading page: %s', url)
         try:
-            # Load the page
-            phantom_cmd = '%s --ssl-protocol=any %s %s %s %d' %\
-                (PHANTOMJS, PHANTOMLOADER, url, imagepath, self._timeout)
-            phantom_cmd = phantom_cmd.split()
-            if self._user_agent:
-                phantom_cmd.append(' "%s"' % self._user_agent)
-
-            logging.debug('Running PhantomJS: %s', phantom_cmd)
-            with Timeout(seconds=self._timeout+5):
-                output = subprocess.check_output(phantom_cmd)
-                har, statusline = output.split('*=*=*=*')
-                logging.debug('loadspeed.js returned: %s', statusline.strip())
+            job = {'url': url, 'image': imagepath, 'timeout': self._timeout,\
+                'userAgent': self._user_agent}
+            logging.debug('Sending job to PhantomJS: %s', job)
+            with Timeout(seconds=self._timeout+5) as timeout:
+                if self._worker is not None:
+                    timeout.track(self._worker)
+                result = self._run_job(job)
+                logging.debug('phantomloader.js returned: %s:%s',\
+                    result['status'], result['message'])
 
             # PhantomJS returned, but may or may not have succeeded
-            fields = statusline.strip().split(':')
-            status = fields[0]
-            message = ':'.join(fields[1:])
+            status = result['status']
+            message = result['message']
 
             if status == 'FAILURE':
                 if message == 'timeout':
@@ -90,7 +159,7 @@ class PhantomJSLoader(Loader):
                 # Save the HAR
                 if self._save_har:
                     with open(harpath, 'w') as f:
-                        f.write(har)
+                        json.dump(result['har'], f, indent=4)
                     f.closed
 
                 # Report status and time
@@ -102,21 +171,31 @@ class PhantomJSLoader(Loader):
                     har=harpath,
                     img=imagepath)
             else:
-                logging.error('loadspeed.js returned unexpected output: %s', output)
+                logging.error('phantomloader.js returned unexpected output: %s', result)
                 return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
 
-        # problem running PhantomJS
+        # problem running PhantomJS; start a fresh worker for the next load
         except TimeoutError:
             logging.exception('* Timeout fetching %s', url)
+            self._discard_worker()
             return LoadResult(LoadResult.FAILURE_TIMEOUT, url)
-        except subprocess.CalledProcessError as e:
-            logging.exception('Error loading %s: %s\n%s\n%s' % (url, e, e.output, traceback.format_exc()))
-            return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
         except Exception as e:
             logging.exception('Error loading %s: %s\n%s' % (url, e, traceback.format_exc()))
+            self._discard_worker()
             return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
-        finally:
-            try:
-                subprocess.check_output('killall phantomjs'.split())
-            except Exception as e:
-                logging.warning('Error killing phantomjs (process might not exist): %s', e)
+
+    def _discard_worker(self):
+        if self._worker is not None:
+            self._stop_worker(self._worker)
+            self._worker = None
+
+    def _recycle(self):
+        '''Replace this load thread's worker with a fresh one.'''
+        self._discard_worker()
+        return True
+
+    def _teardown(self):
+        for worker in list(self._workers):
+            self._stop_worker(worker)
+        self._worker = None
+        return True
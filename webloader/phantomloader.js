@@ -16,7 +16,7 @@ if (!Date.prototype.toISOString) {
     }
 }
 
-function createHAR(address, title, startTime, resources)
+function createHAR(page, address, title, startTime, resources)
 {
     var entries = [];
 
@@ -97,104 +97,162 @@ function createHAR(address, title, startTime, resources)
     };
 }
 
-var page = require('webpage').create(),
-    system = require('system'),
-	url
-    error_msg = '';
+var webpage = require('webpage'),
+    system = require('system');
 
+/*
+ * Load one page. job = {url, image, timeout (sec), userAgent (optional)}.
+ * Calls done({status: 'SUCCESS' or 'FAILURE', message, har, isolated})
+ * exactly once. Every job starts with no cookies and an empty memory cache,
+ * so jobs run by the same process don't warm each other up; isolated is
+ * false if this PhantomJS can't clear its memory cache (before 2.0), in
+ * which case the caller must not reuse the process.
+ */
+function loadPage(job, done)
+{
+    var page = webpage.create(),
+        error_msg = '',
+        finished = false,
+        isolated = typeof page.clearMemoryCache === 'function';
 
-if (system.args.length < 4) {
-  console.log('Usage: phantomloader.js <some URL> <image path> <timeout (sec)> [<user agent>]');
-  phantom.exit(1);
-} else if (system.args.length === 5) {
-  page.settings.userAgent = system.args[4];
-}
+    phantom.clearCookies();
+    if (isolated) {
+        page.clearMemoryCache();
+    }
 
-url = system.args[1];
-timeout = parseFloat(system.args[3]);
-
-page.settings.resourceTimeout = 1000 * timeout;
-page.onResourceTimeout = function(e) {
-  console.log('FAILURE:timeout')
-  phantom.exit(0);
-};
-
-page.onError = function (msg, trace) {
-  console.log('FAILURE:' + msg + '\n');
-  trace.forEach(function(item) {
-    console.log('  ', item.file, ':', item.line);
-  })
-  phantom.exit(0);
-}
+    function finish(result) {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        clearTimeout(page.jobTimer);
+        if (job.image) {
+            page.render(job.image);
+        }
+        page.close();
+        result.isolated = isolated;
+        done(result);
+    }
 
+    if (job.userAgent) {
+        page.settings.userAgent = job.userAgent;
+    }
 
-page.address = url;
-page.resources = [];
+    page.settings.resourceTimeout = 1000 * job.timeout;
+    page.onResourceTimeout = function(e) {
+        finish({status: 'FAILURE', message: 'timeout'});
+    };
+    page.jobTimer = setTimeout(function () {
+        finish({status: 'FAILURE', message: 'timeout'});
+    }, 1000 * job.timeout);
 
-page.onLoadStarted = function () {
-    page.startTime = new Date();
-};
+    page.address = job.url;
+    page.resources = [];
 
-page.onResourceRequested = function (req) {
-    page.resources[req.id] = {
-        request: req,
-        startReply: null,
-        endReply: null
+    page.onLoadStarted = function () {
+        page.startTime = new Date();
     };
-};
 
-page.onResourceReceived = function (res) {
-    JSON.stringify(res);
-    if (res.stage === 'start') {
-        page.resources[res.id].startReply = res;
-    }
-    if (res.stage === 'end') {
-        page.resources[res.id].endReply = res;
-    }
-};
+    page.onResourceRequested = function (req) {
+        page.resources[req.id] = {
+            request: req,
+            startReply: null,
+            endReply: null
+        };
+    };
 
+    page.onResourceReceived = function (res) {
+        if (res.stage === 'start') {
+            page.resources[res.id].startReply = res;
+        }
+        if (res.stage === 'end') {
+            page.resources[res.id].endReply = res;
+        }
+    };
 
-page.onError = function(msg, trace) {
+    page.onError = function(msg, trace) {
+        var msgStack = ['ERROR: ' + msg];
 
-  console.log('error');
+        if (trace && trace.length) {
+            msgStack.push('TRACE:');
+            trace.forEach(function(t) {
+                msgStack.push(' -> ' + t.file + ': ' + t.line + (t.function ? ' (in function "' + t.function +'")' : ''));
+            });
+        }
 
-  var msgStack = ['ERROR: ' + msg];
+        console.error(msgStack.join('\n'));
+        error_msg = msg;
+    };
+
+    page.onResourceError = function(resourceError) {
+        error_msg = 'Error code: ' + resourceError.errorCode + '. Description: ' + resourceError.errorString + '  (' + resourceError.url + ' #' + resourceError.id + ')';
+    };
 
-  if (trace && trace.length) {
-    msgStack.push('TRACE:');
-    trace.forEach(function(t) {
-      msgStack.push(' -> ' + t.file + ': ' + t.line + (t.function ? ' (in function "' + t.function +'")' : ''));
+    page.open(page.address, function (status) {
+        var har, t;
+        if (status !== 'success') {
+            finish({status: 'FAILURE', message: error_msg});
+        } else {
+            page.endTime = new Date();
+            page.title = page.evaluate(function () {
+                return document.title;
+            });
+            har = createHAR(page, page.address, page.title, page.startTime, page.resources);
+            t = page.endTime - page.startTime;  // time in msec
+            finish({status: 'SUCCESS',
+                    message: 'time=' + t + ';orig_url=' + job.url + ';final_url=' + page.url,
+                    har: har});
+        }
     });
-  }
-
-  console.error(msgStack.join('\n'));
-  error_msg = msg;
-
-};
-
-page.onResourceError = function(resourceError) {
-    error_msg = 'Error code: ' + resourceError.errorCode + '. Description: ' + resourceError.errorString + '  (' + resourceError.url + ' #' + resourceError.id + ')';
-};
-
-
-page.open(page.address, function (status) {
-    var har;
-    console.log(status)
-    if (status !== 'success') {
-    	console.log('FAILURE:' + error_msg);
-        page.render(system.args[2])
-        phantom.exit(1);
-    } else {
-        page.endTime = new Date();
-    	t = Date.now() - t;
-        page.title = page.evaluate(function () {
-            return document.title;
-        });
-        har = createHAR(page.address, page.title, page.startTime, page.resources);
-        page.render(system.args[2])
-        console.log(JSON.stringify(har, undefined, 4));
-		var t = page.endTime-page.startTime;
-    	console.log('*=*=*=*\nSUCCESS:time=' + t + ';orig_url=' + url + ';final_url=' + page.url); // time in msec
-        phantom.exit();
+}
+
+/*
+ * Server mode: read one JSON job per line from stdin and write one result
+ * line (prefixed with RESULT_PREFIX) per job to stdout. Exits on EOF.
+ */
+var RESULT_PREFIX = 'WEBLOADER-RESULT ';
+
+function serveNextJob()
+{
+    var line = system.stdin.readLine(),
+        job;
+    if (!line) {
+        phantom.exit(0);
+        return;
+    }
+    try {
+        job = JSON.parse(line);
+    } catch (e) {
+        console.log(RESULT_PREFIX + JSON.stringify({status: 'FAILURE', message: 'bad job: ' + e}));
+        setTimeout(serveNextJob, 0);
+        return;
     }
-});
+    loadPage(job, function (result) {
+        console.log(RESULT_PREFIX + JSON.stringify(result));
+        setTimeout(serveNextJob, 0);
+    });
+}
+
+
+if (system.args.length === 2 && system.args[1] === '--server') {
+    serveNextJob();
+} else if (system.args.length < 4) {
+    console.log('Usage: phantomloader.js <some URL> <image path> <timeout (sec)> [<user agent>]');
+    console.log('       phantomloader.js --server');
+    phantom.exit(1);
+} else {
+    loadPage({url: system.args[1],
+              image: system.args[2],
+              timeout: parseFloat(system.args[3]),
+              userAgent: system.args.length === 5 ? system.args[4] : null},
+        function (result) {
+            if (result.status === 'SUCCESS') {
+                console.log(JSON.stringify(result.har, undefined, 4));
+                console.log('*=*=*=*\nSUCCESS:' + result.message);
+                phantom.exit();
+            } else {
+                console.log('FAILURE:' + result.message);
+                phantom.exit(result.message === 'timeout' ? 0 : 1);
+            }
+        });
+}
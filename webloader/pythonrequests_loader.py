@@ -1,13 +1,77 @@
 import os
+import time
+import urlparse
+import socket
 import logging
 import traceback
+import threading
 import subprocess
 import requests
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection,\
+    VerifiedHTTPSConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool,\
+    HTTPSConnectionPool
+from loader import Loader, LoadResult, PhaseTimings, Timeout, TimeoutError
 
 #TODO: disable network cache
 
+# times at which the current thread's connection finished each phase
+_phase_marks = threading.local()
+
+def _mark(phase):
+    marks = getattr(_phase_marks, 'marks', None)
+    if marks is not None:
+        marks[phase] = time.time()
+
+
+class _TimedConnectionMixin(object):
+    '''Records when name lookup and TCP connect finish.'''
+
+    def _new_conn(self):
+        _mark('start')
+        if hasattr(self, '_dns_host'):
+            # resolve the name ourselves so we can time it, then hand urllib3
+            # the address (the original name is still used for SNI and
+            # certificate checks)
+            host = self._dns_host
+            self._dns_host = socket.getaddrinfo(host, self.port, 0,\
+                socket.SOCK_STREAM)[0][4][0]
+            _mark('dns_done')
+            try:
+                conn = super(_TimedConnectionMixin, self)._new_conn()
+            finally:
+                self._dns_host = host
+        else:
+            conn = super(_TimedConnectionMixin, self)._new_conn()
+        _mark('connected')
+        return conn
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, VerifiedHTTPSConnection):
+    def connect(self):
+        super(_TimedHTTPSConnection, self).connect()
+        _mark('tls_done')
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedAdapter(HTTPAdapter):
+    '''Transport adapter whose connections record phase timings.'''
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_TimedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
 class PythonRequestsLoader(Loader):
     '''Subclass of :class:`Loader` that loads pages using Python requests.
     
@@ -18,10 +82,22 @@ class PythonRequestsLoader(Loader):
     .. note:: The :class:`PythonRequestsLoader` currently does not support saving HARs.
     .. note:: The :class:`PythonRequestsLoader` currently does not support saving screenshots.
     .. note:: The :class:`PythonRequestsLoader` currently does not support saving content.
+
+    :param connections: 'cold' to open a fresh connection for every trial
+        (measures first-load latency, including DNS, TCP and TLS setup) or
+        'warm' to keep pooled keep-alive connections open across trials
+        (measures latency over an established connection). In 'warm' mode an
+        unmeasured request opens the connection to each origin before its
+        first trial.
+    :param chunk_size: how many bytes to read at a time when counting the
+        response body (bodies are never held in memory)
     '''
 
-    def __init__(self, **kwargs):
+    def __init__(self, connections='cold', chunk_size=64*1024, **kwargs):
         super(PythonRequestsLoader, self).__init__(**kwargs)
+        if connections not in ('cold', 'warm'):
+            raise ValueError('connections must be "cold" or "warm", not "%s"'\
+                % connections)
         if self._http2:
             raise NotImplementedError('PythonRequestsLoader does not support HTTP2')
         if not self._disable_local_cache:
@@ -39,28 +115,141 @@ class PythonRequestsLoader(Loader):
         if self._save_content != 'never':
             raise NotImplementedError('PyhtonRequestsLoader does not support saving content')
 
+        self._connections = connections
+        self._chunk_size = chunk_size
+
+        # warm mode: one pooled session per thread (thread pool workers share
+        # this instance's attributes), all listed so teardown can close them
+        self._pooled = threading.local()
+        self._pooled_sessions = []
+        self._pooled_lock = threading.Lock()
 
-    def _load_page(self, url, outdir, trial_num=-1):
+    def __getstate__(self):
+        '''don't try to pickle sessions or locks'''
+        state = super(PythonRequestsLoader, self).__getstate__()
+        for key in ('_pooled', '_pooled_sessions', '_pooled_lock'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pooled = threading.local()
+        self._pooled_sessions = []
+        self._pooled_lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = _TimedAdapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _pooled_session(self):
+        '''This thread's keep-alive session (warm mode).'''
+        session = getattr(self._pooled, 'session', None)
+        if session is None:
+            session = self._new_session()
+            session.warm_origins = set()  # (scheme, netloc) we've connected to
+            self._pooled.session = session
+            with self._pooled_lock:
+                self._pooled_sessions.append(session)
+        return session
+
+    def _close_pooled_sessions(self):
+        with self._pooled_lock:
+            for session in self._pooled_sessions:
+                session.close()
+            self._pooled_sessions = []
+        self._pooled = threading.local()
+
+    def _teardown(self):
+        self._close_pooled_sessions()
+        return True
+
+    def _recycle(self):
+        # only drop this worker's connections
+        session = getattr(self._pooled, 'session', None)
+        if session is not None:
+            self._pooled.session = None
+            with self._pooled_lock:
+                if session in self._pooled_sessions:
+                    self._pooled_sessions.remove(session)
+            session.close()
+        return True
+
+    def _read_body(self, response):
+        '''Read and discard the body; returns its size in bytes.'''
+        size = 0
+        for chunk in response.iter_content(self._chunk_size):
+            size += len(chunk)
+        return size
+
+    def _warm_up(self, session, url, headers):
+        '''Open a pooled connection to `url`'s origin (and those of any
+        redirects) if we don't have one yet.'''
+        origin = urlparse.urlsplit(url)[:2]
+        if origin in session.warm_origins:
+            return
+        logging.debug('Opening connection for %s', url)
+        response = session.get(url, timeout=self._timeout, headers=headers,\
+            stream=True)
+        try:
+            self._read_body(response)
+        finally:
+            response.close()  # hands the connection back to the pool
+        session.warm_origins.add(origin)
+        for r in response.history + [response]:
+            session.warm_origins.add(urlparse.urlsplit(r.url)[:2])
+
+    def _load_page(self, url, outdir, trial_num=-1, tag=None):
     
         # load the specified URL
         logging.info('Loading page: %s', url)
+        warm = self._connections == 'warm'
+        session = self._pooled_session() if warm else self._new_session()
+        response = None
+        loaded = False
         try:
             # Load the page
             with Timeout(seconds=self._timeout+5):
                 headers = {}
                 if self._user_agent:
                     headers['User-Agent'] = self._user_agent
-                response = requests.get(url, timeout=self._timeout, headers=headers)
+                if warm:
+                    self._warm_up(session, url, headers)
+
+                _phase_marks.marks = marks = {}
+                request_start = time.time()
+                response = session.get(url, timeout=self._timeout,\
+                    headers=headers, stream=True)
+                first_byte = time.time()  # headers are in
+                size = self._read_body(response)
+                end = time.time()
+                loaded = True
+
+            if 'start' not in marks:
+                # reused a pooled connection: no lookup or handshakes
+                marks = dict.fromkeys(('start', 'dns_done', 'connected',\
+                    'tls_done'), request_start)
     
             # received response; may not have been successful
             if response.status_code != 200:
-                return LoadResult(LoadResultFAILURE_NO_200, url)
+                return LoadResult(LoadResult.FAILURE_NO_200, url)
             else:
+                # marks are from the last connection made, i.e., the one
+                # that fetched the final URL if we were redirected; time
+                # spans the same phases, through the end of the body
+                # (response.elapsed stops at the headers)
                 return LoadResult(LoadResult.SUCCESS,
                     url,
                     final_url=response.url,
-                    time=response.elapsed.total_seconds(),
-                    size=len(response.content))
+                    time=end - marks['start'],
+                    size=size,
+                    timings=PhaseTimings.from_marks(marks.get('start'),
+                        dns_done=marks.get('dns_done'),
+                        connected=marks.get('connected'),
+                        tls_done=marks.get('tls_done', marks.get('connected')),
+                        first_byte=first_byte, end=end))
 
         # problem executing request
         except (TimeoutError, requests.exceptions.Timeout):
@@ -69,3 +258,12 @@ class PythonRequestsLoader(Loader):
         except Exception as e:
             logging.exception('Error loading %s: %s\n%s' % (url, e, traceback.format_exc()))
             return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
+        finally:
+            _phase_marks.marks = None
+            if response is not None:
+                response.close()
+            if not warm:
+                session.close()
+            elif not loaded:
+                # the connection may be gone; open a new one before next trial
+                session.warm_origins.discard(urlparse.urlsplit(url)[:2])
@@ -0,0 +1,118 @@
+import os
+import errno
+import fcntl
+import socket
+import shutil
+import logging
+import tempfile
+
+LOCK_DIR = tempfile.gettempdir()
+
+# Ranges we hand out from
+DISPLAYS = (99, 199)
+DEBUGGING_PORTS = (9222, 9321)
+
+
+class ResourceError(Exception):
+    pass
+
+class Lease(object):
+    '''A display number or port reserved for one loader instance.
+
+    The reservation is an flock on a lock file, so it is honored by every
+    loader on the machine (in any process) and is released automatically if
+    the holding process dies.
+
+    :param kind: what's being leased (used in the lock file name)
+    :param value: the leased display number or port
+    :param lock_file: the open, locked lock file
+    '''
+
+    def __init__(self, kind, value, lock_file):
+        self._kind = kind
+        self._value = value
+        self._lock_file = lock_file
+
+    @property
+    def value(self):
+        '''The leased display number or port.'''
+        return self._value
+
+    def release(self):
+        '''Give the resource back.'''
+        if self._lock_file:
+            # leave the file itself in place: unlinking it would let a second
+            # loader lock a fresh file while a third still holds the old one
+            self._lock_file.close()  # drops the flock
+            self._lock_file = None
+
+    def __str__(self):
+        return 'Lease (%s): %s' % (self._kind, self._value)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _try_lock(kind, value):
+    '''Returns an open, flock'd lock file for (kind, value), or None if some
+    other loader holds it.'''
+    path = os.path.join(LOCK_DIR, 'webloader-%s-%d.lock' % (kind, value))
+    lock_file = open(path, 'a')
+    # don't let Xvfb, browsers, etc. inherit the lock: one that outlived its
+    # loader would keep the resource leased
+    flags = fcntl.fcntl(lock_file.fileno(), fcntl.F_GETFD)
+    fcntl.fcntl(lock_file.fileno(), fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        lock_file.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return lock_file
+
+def _display_in_use(display):
+    # X servers we didn't start (or ones left over from a crash) leave these
+    return os.path.exists('/tmp/.X%d-lock' % display) or\
+        os.path.exists('/tmp/.X11-unix/X%d' % display)
+
+def _port_in_use(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', port))
+    except socket.error:
+        return True
+    finally:
+        sock.close()
+    return False
+
+def _lease(kind, first, last, in_use):
+    for value in range(first, last + 1):
+        lock_file = _try_lock(kind, value)
+        if lock_file is None:
+            continue
+        if in_use(value):
+            lock_file.close()
+            continue
+        logging.debug('Leased %s %d', kind, value)
+        return Lease(kind, value, lock_file)
+    raise ResourceError('No free %s in range %d-%d' % (kind, first, last))
+
+def lease_display(first=DISPLAYS[0], last=DISPLAYS[1]):
+    '''Reserve an X display number no other loader (or X server) is using.'''
+    return _lease('display', first, last, _display_in_use)
+
+def lease_port(first=DEBUGGING_PORTS[0], last=DEBUGGING_PORTS[1]):
+    '''Reserve a local TCP port no other loader (or process) is using.'''
+    return _lease('port', first, last, _port_in_use)
+
+def make_profile_dir(prefix='webloader-profile-'):
+    '''Make a fresh, private browser profile directory.'''
+    return tempfile.mkdtemp(prefix=prefix)
+
+def remove_profile_dir(path):
+    '''Delete a directory made by :func:`make_profile_dir`.'''
+    try:
+        shutil.rmtree(path)
+    except Exception as e:
+        logging.debug('Error removing profile dir %s: %s', path, e)
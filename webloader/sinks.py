@@ -0,0 +1,230 @@
+import os
+import csv
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from loader import PhaseTimings
+
+# columns for each kind of record, in order
+LOAD_RESULT_FIELDS = ('url', 'tag', 'trial', 'status', 'final_url', 'time',\
+    'size', 'har_path', 'image_path', 'server', 'tcp_fast_open_supported',\
+    'tls_false_start_supported', 'tls_session_resumption_supported')\
+    + PhaseTimings.PHASES
+PAGE_RESULT_FIELDS = ('url', 'status', 'num_trials', 'num_successes',\
+    'mean_time', 'median_time', 'stddev_time', 'p90_time', 'p99_time',\
+    'server')\
+    + tuple('mean_%s' % phase for phase in PhaseTimings.PHASES)
+
+
+def load_result_record(url, tag, trial, result):
+    '''Flatten one :class:`LoadResult` into an ordered dict of
+    :data:`LOAD_RESULT_FIELDS`.'''
+    record = OrderedDict()
+    record['url'] = url
+    record['tag'] = tag
+    record['trial'] = trial
+    for field in LOAD_RESULT_FIELDS[3:-len(PhaseTimings.PHASES)]:
+        record[field] = getattr(result, field)
+    timings = result.timings.as_dict() if result.timings else {}
+    for phase in PhaseTimings.PHASES:
+        record[phase] = timings.get(phase)
+    return record
+
+def page_result_record(result):
+    '''Flatten one :class:`PageResult` into an ordered dict of
+    :data:`PAGE_RESULT_FIELDS`.'''
+    stats = result.time_stats
+    record = OrderedDict()
+    record['url'] = result.url
+    record['status'] = result.status
+    record['num_trials'] = len(result.load_statuses)
+    record['num_successes'] = len([s for s in result.load_statuses\
+        if s == result.SUCCESS])
+    if stats.count:
+        record['mean_time'] = stats.mean
+        record['median_time'] = stats.median
+        record['stddev_time'] = stats.stddev
+        record['p90_time'] = stats.percentile(90)
+        record['p99_time'] = stats.percentile(99)
+    else:
+        for field in ('mean_time', 'median_time', 'stddev_time', 'p90_time',\
+            'p99_time'):
+            record[field] = None
+    record['server'] = result.server
+    mean_phase_times = result.mean_phase_times
+    for phase in PhaseTimings.PHASES:
+        mean = mean_phase_times.get(phase)
+        record['mean_%s' % phase] = float(mean) if mean is not None else None
+    return record
+
+
+class ResultSink(object):
+    '''Receives results as :meth:`Loader.load_pages` finishes each URL: one
+    :meth:`load_result` call per trial, then one :meth:`page_result` call.
+    URLs are delivered in the order they were given to ``load_pages``, and all
+    calls come from the thread that called ``load_pages``.
+
+    Subclasses override the methods they care about. Sinks are not closed by
+    the loader (one sink can outlive several ``load_pages`` calls); call
+    :meth:`close` when done.
+
+    A loader resuming from a checkpoint doesn't send sinks that
+    :attr:`appends` the URLs the interrupted run already sent them.
+    '''
+
+    #: True if output from earlier runs is kept and added to (rather than
+    #: replaced), so a resumed run must not send the same results again
+    appends = False
+
+    def load_result(self, url, tag, trial, result):
+        '''Called with each trial's :class:`LoadResult`. `tag` is the config
+        tag and `trial` the trial number.'''
+        pass
+
+    def page_result(self, result):
+        '''Called with each URL's :class:`PageResult`.'''
+        pass
+
+    def flush(self):
+        '''Called at the end of each ``load_pages``.'''
+        pass
+
+    def close(self):
+        '''Flush and release any files or connections.'''
+        self.flush()
+
+
+class JSONLinesSink(ResultSink):
+    '''Writes one JSON object per line, with a "type" of "load" or "page".
+
+    :param path: output file
+    :param append: add to the file instead of overwriting it (e.g., when
+        resuming from a checkpoint)
+    '''
+
+    def __init__(self, path, append=False):
+        self.appends = append
+        self._file = open(path, 'a' if append else 'w')
+
+    def _write(self, kind, record):
+        record['type'] = kind
+        self._file.write(json.dumps(record))
+        self._file.write('\n')
+
+    def load_result(self, url, tag, trial, result):
+        self._write('load', load_result_record(url, tag, trial, result))
+
+    def page_result(self, result):
+        self._write('page', page_result_record(result))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CSVSink(ResultSink):
+    '''Writes trial results, and optionally page results, as CSV with a
+    header row.
+
+    :param load_results_path: CSV file for :class:`LoadResult` rows
+    :param page_results_path: CSV file for :class:`PageResult` rows; if None,
+        page results are not written
+    :param append: add rows to the files instead of overwriting them (e.g.,
+        when resuming from a checkpoint); the header row is written only to
+        empty files
+    '''
+
+    def __init__(self, load_results_path, page_results_path=None, append=False):
+        self.appends = append
+        self._files = []
+        self._load_writer = self._open(load_results_path, LOAD_RESULT_FIELDS)
+        self._page_writer = None
+        if page_results_path:
+            self._page_writer = self._open(page_results_path, PAGE_RESULT_FIELDS)
+
+    def _open(self, path, fields):
+        f = open(path, 'ab' if self.appends else 'wb')
+        self._files.append(f)
+        writer = csv.writer(f)
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            writer.writerow(fields)
+        return writer
+
+    def _row(self, record):
+        return [v.encode('utf-8') if isinstance(v, unicode) else v\
+            for v in record.itervalues()]
+
+    def load_result(self, url, tag, trial, result):
+        self._load_writer.writerow(self._row(\
+            load_result_record(url, tag, trial, result)))
+
+    def page_result(self, result):
+        if self._page_writer:
+            self._page_writer.writerow(self._row(page_result_record(result)))
+
+    def flush(self):
+        for f in self._files:
+            f.flush()
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+
+class SQLiteSink(ResultSink):
+    '''Inserts results into ``load_results`` and ``page_results`` tables
+    (created if needed; rows are appended). Tables created by an older
+    version with fewer columns get the missing columns added (empty in the
+    existing rows).
+
+    :param path: SQLite database file
+    :param commit_every: commit after this many inserts
+    '''
+
+    appends = True
+
+    def __init__(self, path, commit_every=1000):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._commit_every = commit_every
+        self._pending = 0
+        for table, fields in (('load_results', LOAD_RESULT_FIELDS),\
+                              ('page_results', PAGE_RESULT_FIELDS)):
+            self._db.execute('CREATE TABLE IF NOT EXISTS %s (%s)'\
+                % (table, ', '.join(fields)))
+            columns = set(row[1] for row in\
+                self._db.execute('PRAGMA table_info(%s)' % table))
+            for field in fields:
+                if field not in columns:
+                    self._db.execute('ALTER TABLE %s ADD COLUMN %s'\
+                        % (table, field))
+        self._db.commit()
+
+    def _insert(self, table, record):
+        with self._lock:
+            self._db.execute('INSERT INTO %s (%s) VALUES (%s)'\
+                % (table, ', '.join(record), ', '.join('?' * len(record))),\
+                record.values())
+            self._pending += 1
+            if self._pending >= self._commit_every:
+                self._db.commit()
+                self._pending = 0
+
+    def load_result(self, url, tag, trial, result):
+        self._insert('load_results', load_result_record(url, tag, trial, result))
+
+    def page_result(self, result):
+        self._insert('page_results', page_result_record(result))
+
+    def flush(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._db.close()
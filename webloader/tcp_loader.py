@@ -5,7 +5,8 @@ import logging
 import traceback
 import subprocess
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, PhaseTimings, Timeout, TimeoutError,\
+    check_output
 
 TCPLOADER = os.path.join(os.path.dirname(__file__), 'tcp_loader/tcp_loader')
 
@@ -40,7 +41,16 @@ class TCPLoader(Loader):
             raise NotImplementedError('TCPLoader does not support saving content')
 
 
-    def _load_page(self, url, outdir, trial_num=-1):
+    def _phase_timings(self, returnvals):
+        if 'dns_seconds' not in returnvals:
+            return None  # tcp_loader binary predates phase timings; rebuild it
+        return PhaseTimings(dns=float(returnvals['dns_seconds']),
+            connect=float(returnvals['connect_seconds']),
+            tls=0.0,  # tcp_loader speaks plain HTTP only
+            ttfb=float(returnvals['ttfb_seconds']),
+            transfer=float(returnvals['transfer_seconds']))
+
+    def _load_page(self, url, outdir, trial_num=-1, tag=None):
         # load the specified URL
         logging.info('Loading page: %s', url)
         try:
@@ -54,7 +64,7 @@ class TCPLoader(Loader):
 
             logging.debug('Running tcploader: %s', cmd)
             with Timeout(seconds=self._timeout+5):
-                output = subprocess.check_output(cmd, shell=True)
+                output = check_output(cmd, shell=True)
 
             logging.debug('tcploader returned: %s', output.strip())
             returnvals = {field.split('=')[0]: field.split('=')[1]\
@@ -65,7 +75,8 @@ class TCPLoader(Loader):
                 size=int(returnvals['size']),
                 server=returnvals['server'],
                 tcp_fast_open_supported=\
-                    bool(int(returnvals['tcp_fast_open_used']))
+                    bool(int(returnvals['tcp_fast_open_used'])),
+                timings=self._phase_timings(returnvals)
                 )
 
         # problem running tcp_loader
@@ -78,8 +89,3 @@ class TCPLoader(Loader):
         except Exception as e:
             logging.exception('Error loading %s: %s\n%s' % (url, e, traceback.format_exc()))
             return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
-        finally:
-            try:
-                subprocess.check_output('killall tcp_loader'.split())
-            except Exception as e:
-                logging.debug('Error killing tcp_loader (process might not exist): %s', e)
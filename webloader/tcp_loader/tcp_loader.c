@@ -15,6 +15,11 @@
 #define REQUEST_SIZE 4096
 #define RESPONSE_BUF_SIZE 500*1024
 
+static double seconds_between(struct timespec *from, struct timespec *to)
+{
+    return to->tv_sec - from->tv_sec + (to->tv_nsec - from->tv_nsec) / 1000000000.0;
+}
+
 int main(int argc, char* argv[])
 {
 	/*************** PARSE ARGUMENTS ***************/
@@ -51,7 +56,7 @@ int main(int argc, char* argv[])
     hints.ai_socktype = SOCK_STREAM;  // TCP stream sockets
     hints.ai_flags = AI_PASSIVE;  // fill in my IP for me
     
-    struct timespec start, end;
+    struct timespec start, dns_done, connected, first_byte, end;
     clock_gettime(CLOCK_MONOTONIC, &start);
 
     if ((status = getaddrinfo(host, protocol, &hints, &servinfo)) != 0) 
@@ -59,6 +64,7 @@ int main(int argc, char* argv[])
         fprintf(stderr, "getaddrinfo error: %s \n", gai_strerror(status));
         return EXIT_FAILURE;
     }
+    clock_gettime(CLOCK_MONOTONIC, &dns_done);
 
 	struct sockaddr_in *addr;
     addr = (struct sockaddr_in *)servinfo->ai_addr; 
@@ -84,6 +90,7 @@ int main(int argc, char* argv[])
 	// Use sendto() for TFO or connect() followed by send() for normal TCP
     //send(sock, request, strlen(request), 0);
 	sendto(sock, request, strlen(request), MSG_FASTOPEN, servinfo->ai_addr, servinfo->ai_addrlen);
+	clock_gettime(CLOCK_MONOTONIC, &connected);  // handshake done (request may ride on the SYN)
 
 	// Test if TCP Fast Open was successful
 	int tfo_support = 0;
@@ -99,6 +106,7 @@ int main(int argc, char* argv[])
     int total_bytes_received = 0;
 	int bytes_received = 0;  // during last recv() call
 	int header_length = 0;
+	bool got_first_byte = false;
 	int content_length = 0;
 	bool found_server_software = false;
 	char server_software[128];
@@ -113,6 +121,10 @@ int main(int argc, char* argv[])
 			fprintf(stderr, "Error receiving: %s\n", strerror(errno));
 			return EXIT_FAILURE;
 		}
+		if (!got_first_byte) {
+			clock_gettime(CLOCK_MONOTONIC, &first_byte);
+			got_first_byte = true;
+		}
 
 
 		// If we still don't know header length, we're still receiving headers
@@ -161,7 +173,7 @@ int main(int argc, char* argv[])
 	} while (bytes_received > 0 && total_bytes_received < header_length + content_length);
 
     clock_gettime(CLOCK_MONOTONIC, &end);
-    double seconds_elapsed = end.tv_sec - start.tv_sec + (end.tv_nsec - start.tv_nsec) / 1000000000.0;
+    double seconds_elapsed = seconds_between(&start, &end);
 
 	buf[total_bytes_received] = '\0';
 	//fprintf(stdout, "Received %s", buf);
@@ -176,6 +188,10 @@ int main(int argc, char* argv[])
     printf("tcp_fast_open_used=%d", tfo_support);
     printf(";time_seconds=%f", seconds_elapsed);
 	printf(";size=%d", total_bytes_received-header_length);
+	printf(";dns_seconds=%f", seconds_between(&start, &dns_done));
+	printf(";connect_seconds=%f", seconds_between(&dns_done, &connected));
+	printf(";ttfb_seconds=%f", seconds_between(&connected, &first_byte));
+	printf(";transfer_seconds=%f", seconds_between(&first_byte, &end));
 	printf(";server=%s\n", server_software);
 
     return EXIT_SUCCESS;
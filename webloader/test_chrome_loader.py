@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import shutil
+import tempfile
+import threading
+import unittest
+import chrome_loader
+from chrome_loader import ChromeLoader
+from loader import LoadResult
+from resources import lease_port
+
+
+class FakeCapture(object):
+    '''Stands in for a :class:`devtools.HarCapture` on one tab.'''
+
+    def __init__(self, tab):
+        self._tab = tab
+
+    def enable(self, **kwargs):
+        pass
+
+    def capture(self, url, **kwargs):
+        if self._tab.closed:
+            raise Exception('capture on a closed tab')
+        self._tab.loads.append(url)
+        return {'log': {'entries': []}}, url, 0.1
+
+
+class FakeTab(object):
+    '''Stands in for a :class:`devtools.IsolatedTab`; records which browser
+    connection it was opened on.'''
+
+    opened = []
+    lock = threading.Lock()
+
+    def __init__(self, browser, **kwargs):
+        if browser is None:
+            raise Exception('no browser DevTools connection')
+        self.browser = browser
+        self.closed = False
+        self.loads = []
+        self.capture = FakeCapture(self)
+        with FakeTab.lock:
+            FakeTab.opened.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+class TabPoolLoader(ChromeLoader):
+    '''A :class:`ChromeLoader` whose "Chrome" is just a browser DevTools
+    handle; tabs come from :class:`FakeTab`.'''
+
+    def _setup(self):
+        self._port_lease = lease_port()
+        self._browser_devtools = object()
+        return True
+
+    def _teardown(self):
+        self._browser_devtools = None
+        if self._port_lease:
+            self._port_lease.release()
+            self._port_lease = None
+        return True
+
+
+class TabPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._outdir = tempfile.mkdtemp()
+        self._real_tab = chrome_loader.IsolatedTab
+        chrome_loader.IsolatedTab = FakeTab
+        FakeTab.opened = []
+
+    def tearDown(self):
+        chrome_loader.IsolatedTab = self._real_tab
+        shutil.rmtree(self._outdir)
+
+    def test_workers_share_browser(self):
+        urls = ['http://example.com/%d' % i for i in range(6)]
+        loader = TabPoolLoader(num_tabs=3, num_trials=2, outdir=self._outdir,\
+            check_protocol_availability=False,\
+            stdout_filename='%s/stdout' % self._outdir)
+        loader.load_pages(urls)
+
+        for url in urls:
+            self.assertEqual(loader.page_results[url].status,\
+                LoadResult.SUCCESS)
+            self.assertEqual([r.status for r in loader.load_results[url]],\
+                [LoadResult.SUCCESS] * 2)
+
+        # every worker opened its tabs on the one browser connection, and
+        # every trial loaded in a tab
+        browsers = set(id(tab.browser) for tab in FakeTab.opened)
+        self.assertEqual(len(browsers), 1)
+        self.assertEqual(sum(len(tab.loads) for tab in FakeTab.opened),\
+            len(urls) * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
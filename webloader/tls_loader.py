@@ -5,7 +5,7 @@ import logging
 import traceback
 import subprocess
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, Timeout, TimeoutError, popen
 
 OPENSSL_BINARY = '/home/dnaylor/Documents/OpenSSL_stable/openssl-1.0.1f/apps/openssl'
 
@@ -68,7 +68,7 @@ class TLSLoader(Loader):
 
             logging.debug('Running tcploader: %s', cmd)
             with Timeout(seconds=self._timeout+5):
-                p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,\
+                p = popen(cmd, shell=True, stdin=subprocess.PIPE,\
                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
                 (stdout, stderr) = p.communicate(input=get_request)
                 #output = subprocess.check_output(cmd, shell=True)
@@ -91,8 +91,3 @@ class TLSLoader(Loader):
         except Exception as e:
             logging.exception('Error loading %s: %s\n%s' % (url, e, traceback.format_exc()))
             return LoadResult(LoadResult.FAILURE_UNKNOWN, url)
-        finally:
-            try:
-                subprocess.check_output('killall openssl'.split())
-            except Exception as e:
-                logging.debug('Error killing openssl (process might not exist): %s', e)
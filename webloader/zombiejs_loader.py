@@ -4,7 +4,7 @@ import traceback
 import subprocess
 import httplib
 from collections import defaultdict
-from loader import Loader, LoadResult, Timeout, TimeoutError
+from loader import Loader, LoadResult, Timeout, TimeoutError, check_output
 
 ENV = '/usr/bin/env'
 ZombieJS = 'node'
@@ -56,8 +56,8 @@ class ZombieJSLoader(Loader):
                 Zombie_cmd.append(self._proxy)
 
             logging.debug('Running ZombieJS: %s', Zombie_cmd)
-            #with Timeout(seconds=self._timeout+5): The process should always end
-            output = subprocess.check_output(Zombie_cmd)
+            with Timeout(seconds=self._timeout+5):
+                output = check_output(Zombie_cmd)
 
             return LoadResult(LoadResult.SUCCESS, url, raw=output)
 